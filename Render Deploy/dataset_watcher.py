@@ -0,0 +1,263 @@
+import logging
+import os
+import signal
+import threading
+import time
+from survey_data import CACHE_DIR
+from survey_dataset import QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE, load_dataset
+from survey_ingest import CHECKPOINT_BATCHES, AppendLog, append_respondents
+from question_registry import QUESTIONS_SCHEMA_PATH
+from text_analysis import ClassificationStore
+from survey_snapshot import read_snapshot, write_snapshot
+
+# Seconds between checks of the survey files for changes (0 turns the
+# watcher off)
+RELOAD_INTERVAL = float(os.environ.get('SURVEY_RELOAD_INTERVAL', '10'))
+
+# Messages go through logging rather than print: the watcher runs in a
+# thread, and CPython resets the handlers' locks in a forked child
+log = logging.getLogger(__name__)
+
+
+# Holds the dataset the callbacks serve and replaces it when the survey files
+# change.
+#
+# A background thread compares the size and mtime of the workbooks and the
+# question schema every `interval` seconds. A change is only acted on once
+# the files have stayed the same for a whole interval, so a wave still being
+# copied in is not read half-written. The new dataset is then built in that
+# thread while requests keep being served from the current one, and swapped
+# in by rebinding `current`. Callbacks read `current` once per request and
+# use that dataset throughout, so a request never mixes two versions. If the
+# build fails, the current dataset stays and the error is logged.
+#
+# Batches of new respondents go through append(), which records them in the
+# AppendLog of the current workbooks. Each check also takes in the batches
+# other processes recorded, and a reloaded dataset gets the batches recorded
+# for its workbooks replayed onto it, starting from the log's latest
+# checkpoint. The process recording every CHECKPOINT_BATCHES-th batch
+# writes that checkpoint.
+#
+# Under gunicorn, run_in_master() makes one reloader process, forked from the
+# master, the only one that watches the files. It rebuilds the dataset,
+# writes it as a snapshot and sends the master a HUP; the master maps the
+# snapshot with take_reloaded() and restarts the workers so they fork from
+# it. The master itself runs no threads and builds nothing, so a worker is
+# never forked while another thread holds a lock. The workers' own threads
+# only take in appended batches.
+class DatasetWatcher:
+    def __init__(self, dataset, data_dir='.', interval=RELOAD_INTERVAL, loader=None, on_swap=None, cache_dir=None):
+        self.data_dir = data_dir
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self.loader = loader or (lambda: load_dataset(data_dir, cache_dir))
+        self.on_swap = on_swap
+        self.reloads = 0
+        self.reload_errors = 0
+        self.appends = 0
+        self._classifications = None
+        self._stamp = self.source_stamp()
+        self._pending = None
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.master_pid = None
+        self.current = self.replay(dataset)
+        # A fork in the middle of an update would leave the child's locks
+        # held forever
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def source_paths(self):
+        names = [QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE, QUESTIONS_SCHEMA_PATH]
+        return [os.path.join(self.data_dir, name) for name in names]
+
+    # (size, mtime) of every source file, None for missing ones
+    def source_stamp(self):
+        stamp = {}
+        for path in self.source_paths():
+            try:
+                stat = os.stat(path)
+                stamp[path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                stamp[path] = None
+        return stamp
+
+    # Start the watcher thread unless it runs already. Threads do not survive
+    # a fork, so this is called on every request and each gunicorn worker
+    # starts its own.
+    def ensure_running(self):
+        if self.interval <= 0 or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='survey-dataset-watcher', daemon=True)
+            self._thread.start()
+
+    # Watch the files on behalf of this process (the gunicorn master) and
+    # the workers it forks, from a child forked now, while the master still
+    # runs a single thread. `after_fork` runs first in the child, to close
+    # what it should not hold on to. The child exits once the master is gone.
+    def run_in_master(self, after_fork=None):
+        self.master_pid = os.getpid()
+        if self.interval <= 0:
+            return
+        if os.fork() != 0:
+            return
+        try:
+            # Signals meant for the master are handled by gunicorn's
+            # handlers, which only queue them for its main loop
+            for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGQUIT, signal.SIGTERM, signal.SIGCHLD,
+                           signal.SIGTTIN, signal.SIGTTOU, signal.SIGUSR1, signal.SIGUSR2, signal.SIGWINCH):
+                signal.signal(signum, signal.SIG_DFL)
+            if after_fork is not None:
+                after_fork()
+            self._reload_for_master()
+        except Exception:
+            log.exception("Survey data reloader failed")
+        finally:
+            try:
+                os.remove(self.reloaded_path())
+            except OSError:
+                pass
+            os._exit(0)
+
+    def _reload_for_master(self):
+        while os.getppid() == self.master_pid:
+            time.sleep(self.interval)
+            try:
+                if self.files_changed() and self.reload():
+                    write_snapshot(self.current, self.reloaded_path(), self.current.version)
+                    os.kill(self.master_pid, signal.SIGHUP)
+            except Exception:
+                log.exception("Survey data reloader error")
+
+    # Where the reloader leaves the datasets it built for the master
+    def reloaded_path(self):
+        return os.path.join(self.cache_dir or CACHE_DIR, f"reloaded-{self.master_pid}.snapshot")
+
+    # In the master: swap in the dataset the reloader wrote, with the batches
+    # recorded since replayed onto it. Returns it, or None when it is not
+    # newer than the current one (or the HUP came from elsewhere).
+    def take_reloaded(self):
+        dataset = read_snapshot(self.reloaded_path())
+        if dataset is None or dataset.version == self.current.version:
+            return None
+        with self._update_lock:
+            dataset = self.replay(dataset)
+            old = self.swap(dataset)
+        self.reloads += 1
+        log.info("Loaded the reloaded survey data: version %s -> %s", old.version, dataset.version)
+        return dataset
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                log.exception("Survey data watcher error")
+
+    # Reload when the files changed and have been stable since the previous
+    # check, otherwise take in newly recorded batches. Returns True when a
+    # new dataset was swapped in. The workers of a watching master leave the
+    # files to its reloader.
+    def check(self):
+        if self.master_pid is None and self.files_changed():
+            return self.reload()
+        return self.apply_appended()
+
+    # Whether the files changed and have stayed the same since the previous
+    # call
+    def files_changed(self):
+        stamp = self.source_stamp()
+        if stamp == self._stamp:
+            self._pending = None
+            return False
+        if stamp != self._pending:
+            self._pending = stamp
+            return False
+        self._pending = None
+        self._stamp = stamp
+        return True
+
+    # Build the dataset from the files and swap it in
+    def reload(self):
+        start = time.perf_counter()
+        try:
+            dataset = self.loader()
+        except Exception as e:
+            self.reload_errors += 1
+            log.error("Reloading the survey data failed, still serving version %s: %s", self.current.version, e)
+            return False
+        with self._update_lock:
+            dataset = self.replay(dataset)
+            if dataset.version is not None and dataset.version == self.current.version:
+                return False
+            old = self.swap(dataset)
+        self.reloads += 1
+        log.info("Reloaded the survey data in %.1fs: version %s -> %s",
+                 time.perf_counter() - start, old.version, dataset.version)
+        return True
+
+    # `dataset` with the batches recorded for its workbooks after the ones it
+    # already holds appended. A checkpoint at least CHECKPOINT_BATCHES
+    # batches ahead is loaded first; fewer are cheaper to replay.
+    def replay(self, dataset):
+        log = AppendLog(dataset.base_version, self.cache_dir)
+        dataset = log.read_checkpoint(dataset.batches + max(CHECKPOINT_BATCHES - 1, 0)) or dataset
+        for numeric_batch, text_batch in log.read_from(dataset.batches):
+            dataset = append_respondents(dataset, numeric_batch, text_batch, self.classification_store())
+        return dataset
+
+    # Swap in the batches other processes recorded since the last check
+    def apply_appended(self):
+        with self._update_lock:
+            dataset = self.replay(self.current)
+            if dataset is self.current:
+                return False
+            self.swap(dataset)
+        return True
+
+    # Append a batch of new respondents (see append_respondents()), record it
+    # so other processes pick it up, and serve the result. Returns the new
+    # dataset; a batch that cannot be appended raises ValueError and is not
+    # recorded.
+    def append(self, numeric_batch=None, text_batch=None):
+        with self._update_lock:
+            while True:
+                dataset = self.replay(self.current)
+                updated = append_respondents(dataset, numeric_batch, text_batch, self.classification_store())
+                log = AppendLog(dataset.base_version, self.cache_dir)
+                if log.write(dataset.batches, numeric_batch, text_batch):
+                    break
+                # Another process recorded a batch under the same number:
+                # take it in and append after it
+                if dataset is not self.current:
+                    self.swap(dataset)
+            self.swap(updated)
+            if CHECKPOINT_BATCHES and updated.batches % CHECKPOINT_BATCHES == 0:
+                try:
+                    log.write_checkpoint(updated)
+                except Exception as e:
+                    log.error("Writing a checkpoint of the appended survey data failed: %s", e)
+        self.appends += 1
+        return updated
+
+    def classification_store(self):
+        if self._classifications is None:
+            self._classifications = ClassificationStore(self.cache_dir)
+        return self._classifications
+
+    # Make `dataset` the one served and return the previous one
+    def swap(self, dataset):
+        old, self.current = self.current, dataset
+        if self.on_swap is not None:
+            self.on_swap(old, dataset)
+        return old
@@ -0,0 +1,25 @@
+import os
+
+# Load, classify and index the survey data once in the master process, then
+# fork the workers. The dataset's arrays are moved into read-only shared
+# memory first (SURVEY_SHARED_ARRAYS), so adding workers does not add copies
+# of the data.
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+os.environ.setdefault('SURVEY_SHARED_ARRAYS', '1')
+
+
+# Watch the survey files from a reloader process forked from the master, so
+# the master itself never builds a dataset or runs a thread while it forks
+# workers. The reloader does not need the listening sockets.
+def when_ready(server):
+    from app import watch_in_master
+    watch_in_master(lambda: [listener.close() for listener in server.LISTENERS])
+
+
+# The reloader sends a HUP with each new wave: the master maps the dataset it
+# built before gunicorn replaces the workers gracefully, so they fork from the
+# reloaded (and shared) dataset instead of each rebuilding it
+def on_reload(server):
+    from app import reload_in_master
+    reload_in_master()
@@ -0,0 +1,339 @@
+import hashlib
+import os
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from survey_data import CACHE_DIR, atomic_write, pool_context
+import growable_arrays
+
+# Worker processes for computing MinHash signatures (0 means one per CPU)
+DEDUP_WORKERS = int(os.environ.get('SURVEY_DEDUP_WORKERS', '1'))
+
+# MinHash/LSH parameters. 64 hash functions split into 16 bands of 4 make
+# any pair above ~0.5 similarity a likely candidate; candidates are then kept
+# only if their signatures agree on at least SIMILARITY_THRESHOLD of the
+# hash functions (an estimate of the Jaccard similarity of their shingles).
+NUM_HASHES = 64
+LSH_BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+
+# Answers shorter than this (after normalization) are never grouped: short
+# answers such as "yes" or "it's a stew" are legitimately repeated
+MIN_TEXT_LENGTH = 30
+
+# Bump this whenever the way clusters are computed changes
+DEDUP_VERSION = 2
+
+# Distinct answers worth a process pool
+PARALLEL_MIN_TEXTS = 20000
+
+_seeds = np.random.default_rng(20240501)
+HASH_MULTIPLIERS = _seeds.integers(1, 2 ** 63, NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+HASH_OFFSETS = _seeds.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+# One per band and one for the whole signature, so equal values in
+# different bands give different bucket keys
+BUCKET_SALTS = _seeds.integers(0, 2 ** 63, LSH_BANDS + 1, dtype=np.uint64)
+
+
+# Lower-case, drop punctuation and collapse whitespace, so answers that only
+# differ in those respects compare as identical
+def normalize_for_dedup(text):
+    return re.sub(r"\W+", ' ', str(text).lower()).strip()
+
+
+# MinHash signatures (one row of NUM_HASHES uint32 values per text) of texts
+# at least SHINGLE_SIZE bytes long. All texts are processed together: their
+# UTF-8 bytes are concatenated, every window of SHINGLE_SIZE bytes that does
+# not cross a text boundary is hashed, and each hash function's minimum is
+# taken per text with one reduceat.
+def minhash_signatures(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    starts = np.cumsum(lengths) - lengths
+
+    # Shingle values: the SHINGLE_SIZE bytes of each window packed together
+    window_count = np.maximum(lengths - SHINGLE_SIZE + 1, 0)
+    window_starts = np.repeat(starts - (np.cumsum(window_count) - window_count), window_count) \
+        + np.arange(window_count.sum())
+    shingles = np.zeros(len(window_starts), dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        shingles = (shingles << np.uint64(8)) | data[window_starts + offset]
+
+    signatures = np.empty((len(texts), NUM_HASHES), dtype=np.uint32)
+    if len(shingles) == 0:
+        return signatures
+    segment_starts = np.cumsum(window_count) - window_count
+    for index in range(NUM_HASHES):
+        # Multiply-shift hashing: the top 32 bits of a*x + b (mod 2**64)
+        hashed = (shingles * HASH_MULTIPLIERS[index] + HASH_OFFSETS[index]) >> np.uint64(32)
+        signatures[:, index] = np.minimum.reduceat(hashed, segment_starts)
+    return signatures
+
+
+def _signature_chunk(texts):
+    return minhash_signatures(texts)
+
+
+# minhash_signatures() spread over worker processes, or computed in this
+# process when a pool cannot be started safely (see pool_context())
+def minhash_signatures_parallel(texts, workers=None, chunks_per_worker=4):
+    workers = DEDUP_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    context = pool_context()
+    if workers <= 1 or len(texts) < PARALLEL_MIN_TEXTS or context is None:
+        return minhash_signatures(texts)
+    chunks = np.array_split(np.asarray(texts, dtype=object), workers * chunks_per_worker)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = list(pool.map(_signature_chunk, [chunk.tolist() for chunk in chunks]))
+    return np.concatenate(results) if results else minhash_signatures([])
+
+
+# Group signatures into clusters of near-duplicates. Returns one label per
+# signature: the lowest index in its cluster. `known` (a boolean per
+# signature and band) marks band buckets that already have a leader outside
+# these signatures; the signatures in them are compared with that leader
+# instead (see NearDuplicateIndex.extend()) and left out here.
+def lsh_clusters(signatures, known=None):
+    count = len(signatures)
+    labels = np.arange(count)
+    if count < 2:
+        return labels
+    rows_per_band = NUM_HASHES // LSH_BANDS
+    pairs = []
+    for band in range(LSH_BANDS):
+        members = np.arange(count) if known is None else np.flatnonzero(~known[:, band])
+        if len(members) < 2:
+            continue
+        band_values = np.ascontiguousarray(signatures[members, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows_per_band))).ravel()
+        _, first, bucket = np.unique(keys, return_index=True, return_inverse=True)
+        # Compare every signature with the first one in its bucket
+        leaders = members[first[bucket]]
+        candidates = np.flatnonzero(leaders != members)
+        if len(candidates) == 0:
+            continue
+        agreement = (signatures[members[candidates]] == signatures[leaders[candidates]]).mean(axis=1)
+        similar = candidates[agreement >= SIMILARITY_THRESHOLD]
+        pairs.append(np.stack([members[similar], leaders[similar]]))
+    if not pairs:
+        return labels
+    left, right = np.concatenate(pairs, axis=1)
+
+    # Connected components by repeatedly pulling each pair to its smaller
+    # label and short-cutting label chains
+    while True:
+        smaller = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smaller)
+        np.minimum.at(updated, right, smaller)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+# Near-duplicate clusters of a column of free-text answers.
+#
+# `labels` holds the cluster of every row: rows whose answers are
+# near-identical share a label, every other answered row gets a label of
+# its own, and missing answers get -1. Labels are row positions of the
+# cluster's first row.
+#
+# The LSH buckets of the build are kept so extend() can place new answers
+# in the clusters already found. Each bucket (one per band value, plus one
+# per whole signature so copies of a stored answer always meet it) keeps
+# only its leader: the row of the first answer that fell into it, which
+# lsh_clusters() compares the bucket's other answers with. Buckets are
+# stored as sorted (key, leader row) parts; an extend() adds a part for the
+# buckets its batch opened, and a part is merged into the previous one once
+# it has grown as large (as InvertedIndex does).
+class NearDuplicateIndex:
+    def __init__(self, texts, workers=None):
+        self.n_rows = 0
+        self.labels = np.empty(0, dtype=np.int64)
+        self.parts = []
+        self.labels, part = self._cluster(texts, workers)
+        self.parts = [part]
+        self.n_rows = len(texts)
+
+    # Index over `texts`, the column of this index's rows followed by a
+    # batch of new respondents. As in a full build, a new answer is compared
+    # with the leader of each of its buckets: the stored leader where the
+    # bucket has one, else the batch's first answer in it. A batch cluster
+    # joins the cluster of a stored leader it matches (the earliest one when
+    # there are several; clusters that a new answer links are only merged by
+    # a full rebuild). Only the batch and those leaders' answers are hashed;
+    # the labels grow in place. Returns a new index and leaves this one
+    # untouched.
+    def extend(self, texts):
+        texts = texts if isinstance(texts, pd.Series) else pd.Series(texts, dtype=object)
+        batch_labels, part = self._cluster(texts.iloc[self.n_rows:], leader_texts=texts)
+        index = NearDuplicateIndex.__new__(NearDuplicateIndex)
+        index.n_rows = len(texts)
+        index.labels = growable_arrays.append(self.labels, batch_labels)
+        parts = self.parts + [part]
+        while len(parts) > 1 and len(parts[-2][0]) <= len(parts[-1][0]):
+            newer = parts.pop()
+            keys = np.concatenate([parts[-1][0], newer[0]])
+            order = np.argsort(keys, kind='stable')
+            parts[-1] = (keys[order], np.concatenate([parts[-1][1], newer[1]])[order])
+        index.parts = parts
+        return index
+
+    # Leader row of the bucket of every key, -1 for buckets not seen yet
+    def _leaders(self, keys):
+        leaders = np.full(len(keys), -1, dtype=np.int64)
+        for part_keys, part_rows in self.parts:
+            if len(part_keys) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(part_keys, keys), len(part_keys) - 1)
+            found = part_keys[positions] == keys
+            leaders[found] = part_rows[positions[found]]
+        return leaders
+
+    # Labels of the rows of `texts`, which follow this index's rows, and the
+    # part holding the buckets they open. `leader_texts` is the whole column,
+    # where the answers of known leaders are read from.
+    def _cluster(self, texts, workers=None, leader_texts=None):
+        texts = texts if isinstance(texts, pd.Series) else pd.Series(texts, dtype=object)
+        normalized = texts.map(normalize_for_dedup, na_action='ignore')
+        codes, uniques = pd.factorize(normalized)
+        uniques = np.asarray(uniques, dtype=object)
+
+        # Only long enough answers take part in the grouping
+        long_enough = np.array([len(text) >= MIN_TEXT_LENGTH for text in uniques], dtype=bool)
+        candidates = np.flatnonzero(long_enough)
+        doc_labels = np.arange(len(uniques))
+        signatures = minhash_signatures([])
+        if len(candidates):
+            signatures = minhash_signatures_parallel(uniques[candidates].tolist(), workers=workers)
+        keys = bucket_keys(signatures)
+        leaders = self._leaders(keys.ravel()).reshape(keys.shape)
+        if len(candidates):
+            doc_labels[candidates] = candidates[lsh_clusters(signatures, leaders[:, :LSH_BANDS] >= 0)]
+
+        # First row of every distinct answer and of every cluster
+        rows = np.arange(len(texts))
+        first_row = np.full(len(uniques), len(texts), dtype=np.int64)
+        answered = codes >= 0
+        np.minimum.at(first_row, codes[answered], rows[answered])
+        cluster_first = np.full(len(uniques), len(texts), dtype=np.int64)
+        np.minimum.at(cluster_first, doc_labels, first_row)
+        cluster_first += self.n_rows
+
+        # Clusters of earlier rows the new ones join. An answer whose whole
+        # signature is stored already has a twin that the build compared
+        # with the same band leaders, so the twin's cluster is all it needs.
+        compared = leaders >= 0
+        compared[compared[:, LSH_BANDS], :LSH_BANDS] = False
+        if compared.any():
+            leader_rows = np.unique(leaders[compared])
+            leader_signatures = minhash_signatures([normalize_for_dedup(text)
+                                                    for text in leader_texts.iloc[leader_rows]])
+            doc, slot = np.nonzero(compared)
+            leader = np.searchsorted(leader_rows, leaders[doc, slot])
+            similar = (signatures[doc] == leader_signatures[leader]).mean(axis=1) >= SIMILARITY_THRESHOLD
+            np.minimum.at(cluster_first, doc_labels[candidates[doc[similar]]],
+                          self.labels[leaders[doc, slot][similar]])
+
+        labels = np.full(len(texts), -1, dtype=np.int64)
+        grouped = answered.copy()
+        grouped[answered] = long_enough[codes[answered]]
+        labels[grouped] = cluster_first[doc_labels[codes[grouped]]]
+        single = answered & ~grouped
+        labels[single] = rows[single] + self.n_rows
+
+        # Buckets first opened by these rows, led by their first answer
+        new = leaders < 0
+        new_keys = keys[new]
+        new_rows = first_row[candidates[np.nonzero(new)[0]]] + self.n_rows
+        new_keys, first = np.unique(new_keys, return_index=True)
+        return labels, (new_keys, new_rows[first])
+
+
+# Bucket keys of every signature: one 64-bit hash of its values in each
+# band, then one of the whole signature (a row of LSH_BANDS + 1 keys per
+# signature). Keys of different buckets can collide; answers sharing a
+# bucket are compared in full before being grouped, so a collision only
+# costs a comparison.
+def bucket_keys(signatures):
+    rows_per_band = NUM_HASHES // LSH_BANDS
+    keys = np.empty((len(signatures), LSH_BANDS + 1), dtype=np.uint64)
+    for band in range(LSH_BANDS + 1):
+        values = signatures if band == LSH_BANDS else signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        key = np.full(len(signatures), BUCKET_SALTS[band], dtype=np.uint64)
+        for column in values.T:
+            key = (key ^ column.astype(np.uint64)) * HASH_MULTIPLIERS[0]
+            key ^= key >> np.uint64(29)
+        keys[:, band] = key
+    return keys
+
+
+# Cluster label for every row of a column of free-text answers (see
+# NearDuplicateIndex.labels)
+def find_near_duplicates(texts, workers=None):
+    return NearDuplicateIndex(texts, workers).labels
+
+
+# NearDuplicateIndex of a column, kept on disk keyed by the column's content
+# and the dedup settings, so the pass runs once per dataset (either at
+# startup or ahead of time with `python near_duplicates.py`)
+def cached_near_duplicates(texts, cache_dir=None, workers=None):
+    cache_dir = cache_dir or CACHE_DIR
+    digest = hashlib.sha256(repr((DEDUP_VERSION, NUM_HASHES, LSH_BANDS, SIMILARITY_THRESHOLD,
+                                  SHINGLE_SIZE, MIN_TEXT_LENGTH)).encode('utf-8'))
+    for text in texts:
+        digest.update(b'\x00' if not isinstance(text, str) else text.encode('utf-8') + b'\x01')
+    path = os.path.join(cache_dir, f"duplicates-{digest.hexdigest()[:16]}.pkl")
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    index = NearDuplicateIndex(texts, workers=workers)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        def write(p):
+            with open(p, 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        atomic_write(path, write)
+    except OSError:
+        pass
+    return index
+
+
+# Precompute the near-duplicate clusters of the Q8/Q9 answers offline
+if __name__ == '__main__':
+    import argparse
+    import time
+    from survey_data import read_excel_cached
+    from question_registry import QUESTIONS_SCHEMA_PATH, load_question_registry
+
+    parser = argparse.ArgumentParser(description="Tag near-duplicate free-text responses")
+    parser.add_argument('workbook', nargs='?', default='Chat Data Text.xlsx')
+    parser.add_argument('--questions', help="questions workbook (default: Questions.xlsx next to the text workbook)")
+    parser.add_argument('--workers', type=int, default=0, help="worker processes (0 = one per CPU)")
+    args = parser.parse_args()
+
+    data_dir = os.path.dirname(args.workbook)
+    text_df = read_excel_cached(args.workbook)
+    questions_df = read_excel_cached(args.questions or os.path.join(data_dir, 'Questions.xlsx'))
+    questions = load_question_registry(questions_df, os.path.join(data_dir, QUESTIONS_SCHEMA_PATH),
+                                       text_columns=text_df.columns)
+    for question_id in questions.text_question_ids():
+        column = f"{question_id}_text"
+        if column not in text_df.columns:
+            continue
+        start = time.perf_counter()
+        labels = cached_near_duplicates(text_df[column], workers=args.workers).labels
+        answered = labels >= 0
+        clusters, sizes = np.unique(labels[answered], return_counts=True)
+        print(f"{column}: {answered.sum()} answers, {(sizes > 1).sum()} duplicate clusters "
+              f"covering {sizes[sizes > 1].sum()} answers ({time.perf_counter() - start:.1f}s)")
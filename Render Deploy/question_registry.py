@@ -0,0 +1,115 @@
+import json
+import os
+import re
+
+# Sidecar schema describing each question (short label, display text, type
+# and answer codes). Questions.xlsx stays the list of questions; the sidecar
+# adds what the workbook does not record.
+QUESTIONS_SCHEMA_PATH = os.environ.get('SURVEY_QUESTIONS_SCHEMA', 'questions.json')
+
+# Question types: 'choice' answers are codes charted from the numeric
+# workbook, 'text' answers are free text classified and charted by label
+QUESTION_TYPES = ('choice', 'text')
+
+
+# One survey question, as shown in the dashboard
+class Question:
+    def __init__(self, question_id, text, label=None, kind='choice', answers=None, options=None):
+        if kind not in QUESTION_TYPES:
+            raise ValueError(f"Unknown type {kind!r} for question {question_id}")
+        self.id = question_id
+        self.text = text
+        self.label = label or text
+        self.kind = kind
+        # Answer code -> label, in the survey's order
+        self.answers = dict(answers or {})
+        # Choices listed under the question text
+        self.options = list(options) if options is not None else list(self.answers.values())
+
+    @property
+    def is_text(self):
+        return self.kind == 'text'
+
+    # "Question 3:" for IDs like Q3, the ID itself otherwise
+    @property
+    def heading(self):
+        match = re.fullmatch(r"Q(\d+)", self.id)
+        return f"Question {match.group(1)}:" if match else f"{self.id}:"
+
+
+# All questions of the survey, keyed by ID, in the order they were asked
+class QuestionRegistry:
+    def __init__(self, questions):
+        self._questions = {}
+        for question in questions:
+            self._questions[question.id] = question
+
+    def __contains__(self, question_id):
+        return question_id in self._questions
+
+    def __iter__(self):
+        return iter(self._questions.values())
+
+    def __len__(self):
+        return len(self._questions)
+
+    def get(self, question_id):
+        return self._questions.get(question_id)
+
+    def ids(self):
+        return list(self._questions)
+
+    def text_question_ids(self):
+        return [question.id for question in self if question.is_text]
+
+    def dropdown_options(self):
+        return [{'label': f"{question.id}: {question.label}", 'value': question.id} for question in self]
+
+
+# Answer codes are stored as JSON object keys; turn integer-looking keys
+# back into the integers used in the numeric workbook
+def _answer_code(key):
+    return int(key) if re.fullmatch(r"-?\d+", key) else key
+
+
+def _read_schema(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            schema = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {entry['id']: entry for entry in schema.get('questions', [])}
+
+
+# Build the registry from the questions workbook (IDs, full text and order)
+# and the sidecar schema (labels, display text, types and answer codes).
+# Questions only found in the sidecar are appended; questions without a
+# sidecar entry are free-text if `text_columns` has a "<ID>_text" column,
+# multiple choice otherwise.
+def load_question_registry(questions_df, schema_path=None, text_columns=()):
+    schema = _read_schema(schema_path or QUESTIONS_SCHEMA_PATH)
+    text_columns = set(text_columns)
+
+    workbook_text = {}
+    for question_id, text in zip(questions_df['Question_ID'], questions_df['Question_Text']):
+        if isinstance(question_id, str) and question_id.strip():
+            workbook_text[question_id.strip()] = str(text).strip().split('\n')[0].strip()
+
+    questions = []
+    for question_id in list(workbook_text) + [qid for qid in schema if qid not in workbook_text]:
+        entry = schema.get(question_id, {})
+        default_kind = 'text' if f"{question_id}_text" in text_columns else 'choice'
+        answers = entry.get('answers', {})
+        if isinstance(answers, dict):
+            answers, options = {_answer_code(code): label for code, label in answers.items()}, None
+        else:
+            answers, options = {}, answers
+        questions.append(Question(
+            question_id,
+            entry.get('text') or workbook_text.get(question_id, question_id),
+            label=entry.get('label'),
+            kind=entry.get('type', default_kind),
+            answers=answers,
+            options=options,
+        ))
+    return QuestionRegistry(questions)
@@ -0,0 +1,294 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from survey_data import CACHE_DIR, atomic_write
+
+# Defaults for the callback result cache, overridable from the environment
+CACHE_MAX_ENTRIES = int(os.environ.get('SURVEY_RESULT_CACHE_SIZE', '512'))
+CACHE_TTL_SECONDS = float(os.environ.get('SURVEY_RESULT_CACHE_TTL', '3600'))
+CACHE_MAX_BYTES = int(float(os.environ.get('SURVEY_RESULT_CACHE_MB', '256')) * 2 ** 20)
+
+# Optional store shared by all worker processes: '' (none), 'file',
+# 'diskcache' or 'redis'
+SHARED_CACHE = os.environ.get('SURVEY_SHARED_CACHE', '')
+SHARED_CACHE_DIR = os.environ.get('SURVEY_SHARED_CACHE_DIR', os.path.join(CACHE_DIR, 'results'))
+SHARED_CACHE_URL = os.environ.get('SURVEY_SHARED_CACHE_URL', 'redis://localhost:6379/0')
+
+_MISSING = object()
+
+
+# Turn the filter dropdown state into a hashable key. Selection order and
+# duplicates do not change the filtered rows, and an empty selection means
+# the same as no selection, so all of those map to the same key.
+def canonical_selections(selections):
+    return tuple(
+        (column, tuple(sorted(set(values), key=str)))
+        for column, values in sorted(selections.items())
+        if values
+    )
+
+
+# Approximate memory held by a cached value: the buffer size of arrays and
+# frames (row positions of large filters are the biggest entries), the
+# pickled size of anything else (figures, rendered components)
+def value_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+# Stable string form of a cache key, the same in every process
+def key_digest(key):
+    return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+
+# Shared store keeping one pickle file per entry in a directory that all
+# workers on the machine can reach. Files are written atomically; expired
+# files are ignored and the oldest files are pruned beyond max_entries.
+class FileCacheBackend:
+    def __init__(self, directory=None, ttl=None, max_entries=None, prune_every=64):
+        self.directory = directory or SHARED_CACHE_DIR
+        self.ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+        self.max_entries = CACHE_MAX_ENTRIES * 4 if max_entries is None else max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key_digest(key)}.pkl")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if self.ttl and self.ttl > 0 and expires <= time.time():
+            return False, None
+        return True, value
+
+    def set(self, key, value):
+        expires = time.time() + (self.ttl or 0)
+
+        def write(p):
+            with open(p, 'wb') as f:
+                pickle.dump((expires, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        atomic_write(self._path(key), write)
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        entries.sort()
+        cutoff = time.time() - self.ttl if self.ttl and self.ttl > 0 else None
+        for index, (mtime, path) in enumerate(entries):
+            if index < len(entries) - self.max_entries or (cutoff is not None and mtime < cutoff):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.directory, name))
+
+
+# Shared store on top of the optional `diskcache` package (SQLite-backed,
+# safe across processes, with its own size limit and expiry)
+class DiskcacheBackend:
+    def __init__(self, directory=None, ttl=None, size_limit=2 ** 30):
+        try:
+            import diskcache
+        except ImportError:
+            raise ImportError("SURVEY_SHARED_CACHE=diskcache requires the 'diskcache' package") from None
+        self.ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+        self.cache = diskcache.Cache(directory or SHARED_CACHE_DIR, size_limit=size_limit)
+
+    def get(self, key):
+        value = self.cache.get(key_digest(key), default=_MISSING)
+        if value is _MISSING:
+            return False, None
+        return True, value
+
+    def set(self, key, value):
+        self.cache.set(key_digest(key), value, expire=self.ttl if self.ttl and self.ttl > 0 else None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+# Shared store on any Redis-compatible server (Redis, Valkey, KeyDB, or a
+# local stand-in on localhost) through the optional `redis` client package
+class RedisCacheBackend:
+    def __init__(self, url=None, ttl=None, prefix='survey-dashboard:'):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SURVEY_SHARED_CACHE=redis requires the 'redis' package") from None
+        self.ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url or SHARED_CACHE_URL)
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key_digest(key))
+        if data is None:
+            return False, None
+        return True, pickle.loads(data)
+
+    def set(self, key, value):
+        ttl = int(self.ttl) if self.ttl and self.ttl > 0 else None
+        self.client.set(self.prefix + key_digest(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def clear(self):
+        for name in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(name)
+
+
+# Build the shared backend selected by SURVEY_SHARED_CACHE (or `kind`)
+def create_shared_backend(kind=None):
+    kind = (SHARED_CACHE if kind is None else kind).strip().lower()
+    if kind in ('', 'none', 'off'):
+        return None
+    if kind == 'file':
+        return FileCacheBackend()
+    if kind == 'diskcache':
+        return DiskcacheBackend()
+    if kind == 'redis':
+        return RedisCacheBackend()
+    raise ValueError(f"Unknown SURVEY_SHARED_CACHE backend: {kind!r}")
+
+
+# Thread-safe LRU cache with a maximum number of entries, a memory budget
+# (`max_bytes`, as measured by value_size()) and a time-to-live. Values
+# larger than the whole budget are returned but not kept.
+# Shared by the Dash callbacks, which may run concurrently in Flask's
+# threaded server.
+#
+# With a `shared` backend, local misses fall through to the store shared by
+# all workers, and computed results are written to both, so a figure built by
+# one gunicorn worker is reused by the others. Keys are prefixed with
+# `namespace` (the dataset fingerprint) so workers never exchange results
+# computed from different data. A failing shared store only costs hits.
+class LRUCache:
+    def __init__(self, max_entries=None, ttl=None, shared=None, namespace='', max_bytes=None):
+        self.max_entries = CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.bytes = 0
+        self.ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+        self.shared = shared
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Return (True, value) for a live entry, (False, None) otherwise
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, size = entry
+                if self.ttl is None or self.ttl <= 0 or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.bytes -= size
+                self.evictions += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        size = value_size(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[key] = (value, time.monotonic() + (self.ttl or 0), size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    # Return the cached value for `key`, computing and storing it on a miss.
+    # The computation runs outside the lock so slow figures do not block
+    # other requests; two concurrent misses may both compute.
+    def get_or_compute(self, key, compute):
+        found, value = self.get(key)
+        if found:
+            return value
+        if self.shared is not None:
+            try:
+                found, value = self.shared.get((self.namespace, key))
+            except Exception:
+                self.shared_errors += 1
+                found = False
+            if found:
+                self.shared_hits += 1
+                self.set(key, value)
+                return value
+        value = compute()
+        self.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set((self.namespace, key), value)
+            except Exception:
+                self.shared_errors += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'shared_backend': type(self.shared).__name__ if self.shared is not None else None,
+                'shared_hits': self.shared_hits,
+                'shared_errors': self.shared_errors,
+            }
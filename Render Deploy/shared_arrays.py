@@ -0,0 +1,90 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Set to 1 (gunicorn.conf.py does) to move the loaded dataset into shared
+# memory before the server forks its workers
+SHARE_ARRAYS = os.environ.get('SURVEY_SHARED_ARRAYS', '') == '1'
+
+# Where the shared arrays are written before being mapped: a RAM-backed
+# tmpfs when the system has one, the temp directory otherwise
+SHARED_ARRAYS_DIR = os.environ.get('SURVEY_SHARED_ARRAYS_DIR',
+                                   '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+
+# Arrays smaller than this are left alone; mapping them saves nothing
+MIN_SHARED_BYTES = 4096
+
+
+# Moves numpy buffers into read-only memory-mapped files.
+#
+# Each array is written to a file, mapped back with MAP_SHARED and the file is
+# unlinked straight away: the mapping stays valid and the memory is released
+# once the last process holding it exits, so nothing is left behind. When the
+# mapping is made before gunicorn forks its workers, every worker reads the
+# same physical pages, and since they are read-only no worker can ever write
+# (and so copy) them.
+class SharedArrayStore:
+    def __init__(self, directory=None, min_bytes=MIN_SHARED_BYTES):
+        self.directory = directory or SHARED_ARRAYS_DIR
+        self.min_bytes = min_bytes
+        self.shared_bytes = 0
+        self.shared_arrays = 0
+
+    # Read-only mapped copy of `array` (object arrays, small arrays and
+    # arrays already read-only, such as those of a loaded snapshot, are
+    # returned unchanged)
+    def share(self, array):
+        if (array.dtype.hasobject or array.nbytes < self.min_bytes or not array.flags.c_contiguous
+                or not array.flags.writeable):
+            return array
+        fd, path = tempfile.mkstemp(prefix='survey-', suffix='.npy', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            shared = np.load(path, mmap_mode='r')
+        finally:
+            os.remove(path)
+        self.shared_bytes += array.nbytes
+        self.shared_arrays += 1
+        return shared
+
+    # Frame whose numeric columns and categorical codes are mapped arrays.
+    # Text (object) columns stay as they are.
+    def share_frame(self, df):
+        columns = {}
+        for name in df.columns:
+            column = df[name]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                codes = self.share(column.cat.codes.to_numpy())
+                values = pd.Categorical.from_codes(codes, dtype=column.dtype)
+            elif column.dtype.kind in 'biuf':
+                values = self.share(column.to_numpy())
+            else:
+                values = column.to_numpy()
+            columns[name] = values
+        return pd.DataFrame(columns, index=df.index, copy=False)
+
+    # Replace, in place, the arrays held by `obj` (an index or aggregate
+    # object) or reachable from it through dicts, lists and tuples. Returns
+    # the object, or its shared replacement for arrays, frames and tuples.
+    def share_object(self, obj):
+        if isinstance(obj, np.ndarray):
+            return self.share(obj)
+        if isinstance(obj, pd.DataFrame):
+            return self.share_frame(obj)
+        if isinstance(obj, (pd.Index, pd.Series)):
+            return obj
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                obj[key] = self.share_object(value)
+            return obj
+        if isinstance(obj, list):
+            obj[:] = [self.share_object(value) for value in obj]
+            return obj
+        if isinstance(obj, tuple):
+            return tuple(self.share_object(value) for value in obj)
+        if hasattr(obj, '__dict__') and not isinstance(obj, type):
+            for name, value in vars(obj).items():
+                setattr(obj, name, self.share_object(value))
+        return obj
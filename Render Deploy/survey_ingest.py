@@ -0,0 +1,331 @@
+import copy
+import hashlib
+import itertools
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from survey_data import CACHE_DIR, atomic_write
+from survey_dataset import FILTER_COLUMNS, process_rows, timed
+from survey_snapshot import read_snapshot, write_snapshot
+from text_analysis import ClassificationStore
+import growable_arrays
+
+# Token authorizing POST /ingest (sent as "Authorization: Bearer <token>");
+# the endpoint is off when unset
+INGEST_TOKEN = os.environ.get('SURVEY_INGEST_TOKEN', '')
+
+# Every this many appended batches, the dataset is saved as a checkpoint of
+# the append log, which later replays start from (0 turns this off)
+CHECKPOINT_BATCHES = int(os.environ.get('SURVEY_CHECKPOINT_BATCHES', '50'))
+
+
+# Append a batch of new respondents to a dataset without reprocessing the
+# rows it already holds.
+#
+# `numeric_batch` and `text_batch` are raw rows shaped like the numeric and
+# text workbooks (either may be None or empty). Only the batch is
+# classified, remapped, binned and indexed: the frames are extended with it,
+# the filter index, count cubes, word index, term matrix and near-duplicate
+# labels are extended from the batch alone, and the version moves to a
+# fingerprint of the previous version and the batch. New answers join the
+# near-duplicate clusters of earlier rows through the stored LSH buckets
+# (see NearDuplicateIndex.extend()). Answer values the dataset has not seen are placed after the
+# known ones. Returns a new dataset; `dataset` is left untouched, so
+# requests still using it are unaffected. Raises ValueError for an empty
+# batch or columns the workbooks do not have.
+def append_respondents(dataset, numeric_batch=None, text_batch=None, classification_store=None, cache_dir=None,
+                       timings=None):
+    numeric_batch = _as_frame(numeric_batch)
+    text_batch = _as_frame(text_batch)
+    if numeric_batch.empty and text_batch.empty:
+        raise ValueError("The batch has no respondents")
+    if classification_store is None:
+        classification_store = ClassificationStore(cache_dir)
+
+    updated = copy.copy(dataset)
+    derived = _derived_columns(dataset)
+    with timed(timings, 'prepare'):
+        numeric = text = None
+        if len(numeric_batch):
+            numeric = _prepare_batch(dataset.numeric_df, numeric_batch, derived, 'numeric')
+        if len(text_batch):
+            text = _prepare_batch(dataset.text_df, text_batch, derived, 'text',
+                                  dataset.text_question_ids, classification_store)
+
+    with timed(timings, 'append'):
+        if numeric is not None:
+            updated.numeric_df, numeric = _append_frame(dataset.numeric_df, numeric)
+        if text is not None:
+            updated.text_df, text = _append_frame(dataset.text_df, text)
+
+    with timed(timings, 'indexes'):
+        if numeric is not None:
+            updated.filter_values = {
+                col: sorted(set(values) | {value for value in numeric[col].unique() if pd.notna(value)})
+                for col, values in dataset.filter_values.items()
+            }
+            updated.numeric_cubes = {
+                question_id: cube.extend(numeric[question_id], {col: numeric[col] for col in FILTER_COLUMNS})
+                for question_id, cube in dataset.numeric_cubes.items()
+            }
+        if text is not None:
+            updated.text_filter_index = dataset.text_filter_index.extend(text)
+            updated.text_answered = {
+                question_id: growable_arrays.append(answered, text[f"{question_id}_text"].notna().to_numpy())
+                for question_id, answered in dataset.text_answered.items()
+            }
+            updated.text_cubes = {
+                question_id: cube.extend(text[f"{question_id}_classification"],
+                                         {col: text[col] for col in FILTER_COLUMNS})
+                for question_id, cube in dataset.text_cubes.items()
+            }
+            updated.text_search_indexes = {
+                question_id: index.extend(text[f"{question_id}_text"])
+                for question_id, index in dataset.text_search_indexes.items()
+            }
+            updated.text_term_matrices = {
+                question_id: matrix.extend(text[f"{question_id}_text"])
+                for question_id, matrix in dataset.text_term_matrices.items()
+            }
+            updated.text_duplicate_clusters = {
+                question_id: index.extend(updated.text_df[f"{question_id}_text"])
+                for question_id, index in dataset.text_duplicate_clusters.items()
+            }
+
+    updated.version = batch_version(dataset.version, numeric_batch, text_batch)
+    updated.batches = dataset.batches + 1
+    return updated
+
+
+# Version of a dataset after appending a batch: a fingerprint of the
+# previous version and the batch's rows, so every process appending the
+# same batches in the same order arrives at the same version
+def batch_version(version, *frames):
+    digest = hashlib.sha256(str(version).encode('utf-8'))
+    for frame in frames:
+        digest.update(repr(list(frame.columns)).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+# Batches appended to one build of the dataset, kept as numbered files in
+# .survey_cache/appends-<version of the workbooks>/. Other worker processes
+# and later starts replay them, so every process serves the same rows. New
+# workbooks start a new log.
+#
+# Every CHECKPOINT_BATCHES batches the dataset holding them is written as a
+# checkpoint (a snapshot, see survey_snapshot.py), which replays load
+# instead of appending every batch from the first one. The batch files the
+# checkpoint covers are then folded into one archive file, kept for
+# processes that cannot read the checkpoint (another pandas/numpy/Python),
+# and removed.
+class AppendLog:
+    def __init__(self, base_version, cache_dir=None):
+        self.directory = os.path.join(cache_dir or CACHE_DIR, f"appends-{base_version}")
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"{number:08d}.pkl")
+
+    def _checkpoint_path(self, batches):
+        return os.path.join(self.directory, f"checkpoint-{batches:08d}.snapshot")
+
+    def _archive_path(self, start, end):
+        return os.path.join(self.directory, f"batches-{start:08d}-{end:08d}.pkl")
+
+    # Numbers in the names of the files starting with `prefix`, largest first
+    def _numbered(self, prefix):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        numbers = []
+        for name in names:
+            if name.startswith(prefix) and not name.endswith('.tmp'):
+                numbers.append(tuple(int(part) for part in name[len(prefix):].split('.')[0].split('-')))
+        return sorted(numbers, reverse=True)
+
+    # Number of batches held by the latest checkpoint (0 without one)
+    def checkpoint_batches(self):
+        checkpoints = self._numbered('checkpoint-')
+        return checkpoints[0][0] if checkpoints else 0
+
+    # Record the raw batch as batch `number`. Returns False when another
+    # process recorded a batch under that number first or a checkpoint
+    # covers it already.
+    def write(self, number, numeric_batch, text_batch):
+        if number < self.checkpoint_batches():
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(number)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((numeric_batch, text_batch), f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Linking never replaces an existing file, so of two processes
+            # writing the same number only one succeeds
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # A checkpoint written meanwhile may have removed an earlier file
+        # under this number
+        if number < self.checkpoint_batches():
+            os.remove(path)
+            return False
+        return True
+
+    # (numeric_batch, text_batch) of the batches from number `start` on
+    def read_from(self, start):
+        number = start
+        while True:
+            try:
+                with open(self._path(number), 'rb') as f:
+                    batch = pickle.load(f)
+            except FileNotFoundError:
+                archived = [(first, end) for first, end in self._numbered('batches-') if first <= number < end]
+                if not archived:
+                    return
+                with open(self._archive_path(*archived[0]), 'rb') as f:
+                    batches = pickle.load(f)
+                for batch in batches[number - archived[0][0]:]:
+                    yield batch
+                    number += 1
+                continue
+            yield batch
+            number += 1
+
+    # The latest checkpoint, if it holds more than `batches` batches and can
+    # be read by this process
+    def read_checkpoint(self, batches=0):
+        for checkpoint_batches, in self._numbered('checkpoint-'):
+            if checkpoint_batches <= batches:
+                return None
+            dataset = read_snapshot(self._checkpoint_path(checkpoint_batches))
+            if dataset is not None:
+                return dataset
+        return None
+
+    # Save `dataset` (this log's base with its first dataset.batches batches
+    # appended) as a checkpoint, then fold the batch files it covers into
+    # an archive and remove older checkpoints
+    def write_checkpoint(self, dataset):
+        start = self.checkpoint_batches()
+        if dataset.batches <= start:
+            return
+        batches = list(itertools.islice(self.read_from(start), dataset.batches - start))
+        if len(batches) < dataset.batches - start:
+            return
+        atomic_write(self._archive_path(start, dataset.batches), lambda p: _write_pickle(p, batches))
+        write_snapshot(dataset, self._checkpoint_path(dataset.batches), dataset.version)
+        for number in range(start, dataset.batches):
+            if os.path.exists(self._path(number)):
+                os.remove(self._path(number))
+        for checkpoint_batches, in self._numbered('checkpoint-'):
+            if checkpoint_batches < dataset.batches:
+                os.remove(self._checkpoint_path(checkpoint_batches))
+
+
+def _write_pickle(path, obj):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _as_frame(batch):
+    if batch is None:
+        return pd.DataFrame()
+    return batch if isinstance(batch, pd.DataFrame) else pd.DataFrame.from_records(batch)
+
+
+# Columns computed at load rather than read from the workbooks
+def _derived_columns(dataset):
+    derived = {'AGE_GROUP'}
+    for question_id in dataset.text_question_ids:
+        derived.update([f"{question_id}_classification", f"{question_id}_emoji"])
+    return derived
+
+
+# Classify, remap and bin a raw batch the way build_dataset() processes
+# whole workbooks, returning it with the columns of `frame`. Columns left out
+# of the batch are missing for its rows.
+def _prepare_batch(frame, batch, derived, name, text_question_ids=(), classification_store=None):
+    unknown = [col for col in batch.columns if col not in frame.columns or col in derived]
+    if unknown:
+        raise ValueError(f"Unknown columns in the {name} batch: {', '.join(map(str, unknown))}")
+    batch = batch.reindex(columns=[col for col in frame.columns if col not in derived])
+    for col in batch.columns:
+        batch[col] = _convert_column(batch[col], frame[col].dtype, col, name)
+    if name == 'text':
+        process_rows(None, batch, text_question_ids, classification_store)
+    else:
+        process_rows(batch, None, [], classification_store)
+    return batch[list(frame.columns)]
+
+
+# `values` of a batch column as `dtype`, the dtype the column has in the
+# frame. Rows posted as JSON hold datetimes as ISO strings and numbers as
+# ints or floats whatever the column, and columns left out are float NaN.
+# Categorical columns are left to process_rows() and _append_frame(). Raises
+# ValueError for values that cannot be converted, including missing values
+# in an integer column.
+def _convert_column(values, dtype, col, name):
+    if isinstance(dtype, pd.CategoricalDtype) or values.dtype == dtype:
+        return values
+    try:
+        if dtype.kind == 'M':
+            converted = pd.to_datetime(values, format='ISO8601')
+        elif dtype.kind in 'biuf':
+            converted = pd.to_numeric(values)
+            if dtype.kind != 'f' and converted.isna().any():
+                raise ValueError("missing values")
+        else:
+            return values.astype(dtype)
+        result = converted.astype(dtype)
+        if dtype.kind in 'iu' and not (result == converted).all():
+            raise ValueError("values that are not whole numbers")
+        return result
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Column {col} of the {name} batch cannot be stored as {dtype}: {str(e).splitlines()[0]}") from None
+
+
+# `frame` with the rows of `batch` added at the end, and the batch with the
+# categorical dtypes of the result (categories extended with the batch's new
+# values) and the row positions it now has. The columns grow in place (see
+# growable_arrays.py), so the rows already in `frame` are not copied.
+def _append_frame(frame, batch):
+    index = pd.RangeIndex(len(frame), len(frame) + len(batch))
+    columns = {}
+    batch_columns = {}
+    for col in frame.columns:
+        old, new = frame[col], batch[col]
+        if isinstance(old.dtype, pd.CategoricalDtype):
+            dtype = _extended_dtype(old.dtype, new)
+            new_codes = pd.Categorical(new, dtype=dtype).codes
+            old_codes = old.cat.codes.to_numpy()
+            # Enough new categories need wider codes, which takes a copy
+            if not np.can_cast(new_codes.dtype, old_codes.dtype):
+                old_codes = old_codes.astype(new_codes.dtype)
+            columns[col] = pd.Categorical.from_codes(growable_arrays.append(old_codes, new_codes), dtype=dtype)
+            batch_columns[col] = pd.Series(pd.Categorical.from_codes(new_codes, dtype=dtype), index=index, name=col)
+        else:
+            columns[col] = growable_arrays.append(old.to_numpy(), new.to_numpy())
+            batch_columns[col] = pd.Series(new.to_numpy(), index=index, name=col)
+    appended = pd.DataFrame(columns, index=pd.RangeIndex(len(frame) + len(batch)), copy=False)
+    return appended, pd.DataFrame(batch_columns, index=index, copy=False)
+
+
+# Categorical dtype with the values of `values` it lacks appended (sorted,
+# as ordered_categorical() places values missing from a column's order)
+def _extended_dtype(dtype, values):
+    known = set(dtype.categories)
+    extra = [value for value in pd.unique(values.dropna()) if value not in known]
+    if not extra:
+        return dtype
+    try:
+        extra.sort()
+    except TypeError:
+        extra.sort(key=str)
+    return pd.CategoricalDtype(list(dtype.categories) + extra, ordered=dtype.ordered)
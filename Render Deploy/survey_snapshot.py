@@ -0,0 +1,144 @@
+import argparse
+import json
+import mmap
+import os
+import pickle
+import platform
+import struct
+import sys
+import numpy as np
+import pandas as pd
+from survey_data import atomic_write
+
+# Compiled dataset loaded at startup instead of rebuilding it from the
+# workbooks, relative to the data directory
+SNAPSHOT_FILE = os.environ.get('SURVEY_SNAPSHOT', 'survey.snapshot')
+
+# Bump this whenever the layout of the snapshot file changes
+SNAPSHOT_FORMAT_VERSION = 5
+
+SNAPSHOT_MAGIC = b'SURVEYSN'
+
+# Array buffers start on this boundary in the file, so the mapped arrays are
+# aligned like freshly allocated ones
+BUFFER_ALIGNMENT = 64
+
+
+# Runtime versions a snapshot is only valid for: the pickled pandas and numpy
+# objects are not portable across releases
+def runtime_versions():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+    }
+
+
+# Write `obj` (the processed dataset) to one snapshot file.
+#
+# Layout: magic, header length, JSON header, pickle, array buffers. The
+# object is pickled with protocol 5 and every numpy buffer is taken out of
+# the pickle (out-of-band) and written raw at an aligned offset, so
+# read_snapshot() can hand the pickle memory-mapped views of the file
+# instead of copies. `stamp` (see survey_data.source_stamp) records the
+# source files it was built from.
+def write_snapshot(obj, path, version=None, stamp=None):
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+
+    header = dict(runtime_versions(), format_version=SNAPSHOT_FORMAT_VERSION, version=version, stamp=stamp,
+                  pickle_size=len(payload), buffers=[])
+    # The offsets depend on the header's own size, so lay the file out twice:
+    # the second pass uses a header long enough for the final offsets
+    header_size = 0
+    while True:
+        offset = len(SNAPSHOT_MAGIC) + 8 + header_size + len(payload)
+        header['buffers'] = []
+        for raw in raws:
+            offset = _align(offset)
+            header['buffers'].append([offset, raw.nbytes])
+            offset += raw.nbytes
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) <= header_size:
+            break
+        header_size = len(encoded)
+    encoded = encoded.ljust(header_size)
+
+    def write(p):
+        with open(p, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', header_size))
+            f.write(encoded)
+            f.write(payload)
+            for (offset, _), raw in zip(header['buffers'], raws):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(raw)
+    atomic_write(path, write)
+    return os.path.getsize(path)
+
+
+# Load a snapshot written by write_snapshot(). The arrays are read-only views
+# of the mapped file, so loading costs the same whatever the dataset size and
+# forked server workers share the pages. Returns None when the file is
+# missing, unreadable or was written for another dataset `version` or
+# another pandas/numpy/Python. With `stamp` instead of `version`, the sizes
+# and mtimes of the sources it was built from are compared, which needs no
+# hashing of the workbooks.
+def read_snapshot(path, version=None, stamp=None):
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        header = _read_header(mapped)
+    except (ValueError, struct.error):
+        header = None
+    expected = dict(runtime_versions(), format_version=SNAPSHOT_FORMAT_VERSION)
+    if (header is None or any(header.get(key) != value for key, value in expected.items())
+            or (version is not None and header.get('version') != version)
+            or (stamp is not None and header.get('stamp') != stamp)):
+        mapped.close()
+        return None
+    try:
+        view = memoryview(mapped)
+        payload_start = len(SNAPSHOT_MAGIC) + 8 + header['header_size']
+        payload = view[payload_start:payload_start + header['pickle_size']]
+        buffers = [view[offset:offset + size] for offset, size in header['buffers']]
+        return pickle.loads(payload, buffers=buffers)
+    except (ValueError, KeyError, TypeError, pickle.UnpicklingError):
+        return None
+
+
+def _read_header(mapped):
+    if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        return None
+    start = len(SNAPSHOT_MAGIC) + 8
+    header_size, = struct.unpack('<Q', mapped[len(SNAPSHOT_MAGIC):start])
+    return dict(json.loads(mapped[start:start + header_size]), header_size=header_size)
+
+
+def _align(offset):
+    return -(-offset // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+
+# Compile the snapshot ahead of time (before building the app bundles or as
+# the Render build step): python survey_snapshot.py
+if __name__ == '__main__':
+    from survey_dataset import dataset_stamp, load_dataset
+
+    parser = argparse.ArgumentParser(description="Build the survey dataset from the workbooks and write "
+                                                 "the snapshot the app loads at startup")
+    parser.add_argument('--data-dir', default='.', help="folder holding the workbooks")
+    parser.add_argument('--output', help=f"snapshot file (default: {SNAPSHOT_FILE} in the data folder)")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the workbooks in chunks whatever their size (see survey_stream.py)")
+    args = parser.parse_args()
+
+    timings = {}
+    dataset = load_dataset(args.data_dir, timings=timings, use_snapshot=False, stream=args.stream or None)
+    output = args.output or os.path.join(args.data_dir, SNAPSHOT_FILE)
+    size = write_snapshot(dataset, output, dataset.version, dataset_stamp(args.data_dir))
+    print(f"Built dataset {dataset.version} in {sum(timings.values()):.2f}s; "
+          f"wrote {output} ({size / 2 ** 20:.1f} MiB)", file=sys.stderr)
@@ -0,0 +1,465 @@
+import hashlib
+import os
+import pickle
+import re
+import types
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from survey_data import CACHE_DIR, atomic_write, pool_context
+
+# Direct yes/no answers
+YES_PATTERNS = [
+    r'\byes\b', r'\byeah\b', r'\bep\b', r'\bsure\b', r'\bdefinitely\b', 
+    r'\babsolutely\b', r'\bagree\b', r'\bwould\b', r'\bpositive\b', r'\baffirmative\b',
+    r'\bi think so\b', r'\bi would\b', r'\bi do\b', r'\bi believe so\b'
+]
+
+NO_PATTERNS = [
+    r'\bno\b', r'\bnope\b', r'\bnah\b', r'\bnever\b', r'\bdisagree\b', 
+    r'\bwouldn\'t\b', r'\bwould not\b', r'\bnegative\b', r'\bnot\b', 
+    r'\bi don\'t\b', r'\bi do not\b', r'\bi wouldn\'t\b', r'\bi would not\b'
+]
+
+DEPENDS_PATTERNS = ['it depends', 'depends']
+
+# Question-specific context analysis. 'fallback' lists the keyword checks used
+# for otherwise ambiguous answers, in the order they are tried.
+QUESTION_RULES = {
+    'Q8': {  # Is curry a soup?
+        'yes_contexts': [
+            r'is a soup', r'type of soup', r'soup-like', r'similar to soup', 
+            r'considered a soup', r'classified as soup', r'soup category'
+        ],
+        'no_contexts': [
+            r'not a soup', r'isn\'t a soup', r'is not a soup', r'different from soup',
+            r'stew', r'sauce', r'dish', r'not soup', r'wouldn\'t classify'
+        ],
+        'fallback': [
+            ('No', ['stew', 'sauce', 'dish', 'not liquid enough']),
+            ('Yes', ['liquid', 'broth', 'bowl'])
+        ]
+    },
+    'Q9': {  # Is pizza crust-to-crust a sandwich?
+        'yes_contexts': [
+            r'is a sandwich', r'sandwich-like', r'would be a sandwich', 
+            r'technically a sandwich', r'fits the definition', r'meets the criteria'
+        ],
+        'no_contexts': [
+            r'not a sandwich', r'isn\'t a sandwich', r'is not a sandwich', 
+            r'wouldn\'t be a sandwich', r'would not be a sandwich', r'just pizza'
+        ],
+        'fallback': [
+            ('Yes', ['bread', 'filling', 'between']),
+            ('No', ['still pizza', 'just pizza', 'not bread'])
+        ]
+    }
+}
+
+LABEL_EMOJIS = {
+    'Yes': '✅',
+    'No': '❌',
+    'It depends': '🤔',
+    'Ambiguous': '❓'
+}
+
+
+# Split a rule pattern into (literal, needs leading \b, needs trailing \b).
+# Every rule is a literal phrase, optionally wrapped in \b, which is what lets
+# PatternMatcher find all of them in a single pass.
+def _parse_literal_pattern(pattern):
+    lead = pattern.startswith(r'\b')
+    trail = pattern.endswith(r'\b') and len(pattern) > 2
+    body = pattern[2 if lead else 0:len(pattern) - 2 if trail else len(pattern)]
+    literal = ''
+    for escaped, plain in re.findall(r'\\(.)|(.)', body, re.DOTALL):
+        if (escaped and escaped.isalnum()) or (plain and plain in '.^$*+?{}[]|()\\'):
+            raise ValueError(f"Unsupported classification pattern: {pattern!r}")
+        literal += escaped or plain
+    if not literal:
+        raise ValueError(f"Unsupported classification pattern: {pattern!r}")
+    if lead and not re.match(r'\w', literal[0]):
+        raise ValueError(f"Leading \\b must precede a word character: {pattern!r}")
+    return literal, lead, trail
+
+
+# Scans a text once and reports, for every named group of patterns, how many
+# of the group's patterns occur in it (the same number the old per-pattern
+# `sum(1 for p in patterns if re.search(p, text))` gave).
+#
+# All patterns are compiled into one regex shaped like a trie and wrapped in a
+# lookahead, so matches are reported at every start position, including
+# overlapping ones such as "would", "i would" and "i would not". Phrases that
+# start at the same position are prefixes of each other and sit on one trie
+# path, where each end of a phrase is an (optionally \b-guarded) empty capture
+# group.
+class PatternMatcher:
+    def __init__(self, groups):
+        self.group_names = list(groups)
+        # Per-group regexes for the column-at-a-time path in classify_responses
+        self.group_patterns = {name: [re.compile(p) for p in groups[name]] for name in groups}
+        self.group_regexes = {
+            name: re.compile('|'.join(f'(?:{p})' for p in groups[name])) if groups[name] else None
+            for name in groups
+        }
+        terminals = {}
+        self.owners = []
+        self.needs_lead = []
+        trie = {}
+        for group_index, name in enumerate(self.group_names):
+            for pattern in groups[name]:
+                literal, lead, trail = _parse_literal_pattern(pattern)
+                key = (literal, lead, trail)
+                if key not in terminals:
+                    terminals[key] = len(self.owners)
+                    self.owners.append([])
+                    self.needs_lead.append(lead)
+                    node = trie
+                    for ch in literal:
+                        node = node.setdefault(ch, {})
+                    node.setdefault(None, []).append((terminals[key], trail))
+                self.owners[terminals[key]].append(group_index)
+
+        body = self._node_regex(trie)
+        # Group 1 records whether the position follows a non-word character,
+        # i.e. whether a leading \b holds for a phrase starting there
+        self.regex = re.compile(r'(?=(?:((?<!\w)))?' + body + ')') if body else None
+        self.group_terminals = [None] * (self.regex.groups + 1 if self.regex else 1)
+        for name, index in (self.regex.groupindex.items() if self.regex else []):
+            self.group_terminals[index] = int(name[1:])
+
+    @classmethod
+    def _node_regex(cls, node):
+        branches = [re.escape(ch) + cls._node_regex(child)
+                    for ch, child in sorted((k, v) for k, v in node.items() if k is not None)]
+        children = '(?:' + '|'.join(branches) + ')' if branches else ''
+        ends = node.get(None)
+        if not ends:
+            return children
+        # Phrases without a trailing \b always match here; ones with it only
+        # when the next character is a boundary
+        plain = ''.join(f'(?P<t{i}>)' for i, trail in ends if not trail)
+        guarded_ids = [i for i, trail in ends if trail]
+        guarded = ''
+        if guarded_ids:
+            guarded = f'(?P<t{guarded_ids[0]}>\\b)' + ''.join(f'(?P<t{i}>)' for i in guarded_ids[1:])
+        if plain:
+            here = plain + (f'(?:{guarded})?' if guarded else '')
+            return here + (f'(?:{children})?' if children else '')
+        if not children:
+            return guarded
+        # Either a longer phrase continues, or the \b-guarded phrase ending
+        # here must have matched for the position to count
+        return f'(?:{guarded})?(?:{children}|(?(t{guarded_ids[0]})|(?!)))'
+
+    # Return a list with the hit count of each group, in group_names order
+    def scan(self, text):
+        counts = [0] * len(self.group_names)
+        if self.regex is None:
+            return counts
+        seen = set()
+        for match in self.regex.finditer(text):
+            values = match.groups()
+            after_boundary = values[0] is not None
+            for index in range(1, len(values)):
+                if values[index] is None:
+                    continue
+                terminal = self.group_terminals[index + 1]
+                if terminal in seen or (self.needs_lead[terminal] and not after_boundary):
+                    continue
+                seen.add(terminal)
+                for owner in self.owners[terminal]:
+                    counts[owner] += 1
+        return counts
+
+
+_matchers = {}
+
+
+# One compiled matcher per question, built on first use
+def get_matcher(question_id):
+    matcher = _matchers.get(question_id)
+    if matcher is None:
+        rules = QUESTION_RULES.get(question_id, {})
+        groups = {
+            'yes': YES_PATTERNS,
+            'no': NO_PATTERNS,
+            'yes_contexts': rules.get('yes_contexts', []),
+            'no_contexts': rules.get('no_contexts', []),
+            'depends': DEPENDS_PATTERNS
+        }
+        for index, (label, words) in enumerate(rules.get('fallback', [])):
+            groups[f'fallback_{index}'] = words
+        matcher = _matchers[question_id] = PatternMatcher(groups)
+    return matcher
+
+
+# Function to analyze text responses and classify as Yes or No
+def analyze_text_response(text, question_id):
+    if pd.isna(text) or not isinstance(text, str):
+        return None, None
+    
+    text = text.lower().strip()
+    matcher = get_matcher(question_id)
+    hits = dict(zip(matcher.group_names, matcher.scan(text)))
+    
+    # Check for direct yes/no answers and contextual clues
+    is_yes = hits['yes'] > 0
+    is_no = hits['no'] > 0
+    context_yes = hits['yes_contexts'] > 0
+    context_no = hits['no_contexts'] > 0
+    
+    # Determine the final classification
+    if (is_yes and not is_no) or (context_yes and not context_no):
+        label = "Yes"
+    elif (is_no and not is_yes) or (context_no and not context_yes):
+        label = "No"
+    elif hits['depends'] > 0:
+        label = "It depends"
+    else:
+        # For ambiguous responses, fall back to question-specific keywords
+        fallback = QUESTION_RULES.get(question_id, {}).get('fallback', [])
+        for index, (fallback_label, _) in enumerate(fallback):
+            if hits[f'fallback_{index}'] > 0:
+                return fallback_label, LABEL_EMOJIS[fallback_label]
+        
+        # If still ambiguous, make a best guess based on the overall tone
+        yes_score = hits['yes'] + hits['yes_contexts']
+        no_score = hits['no'] + hits['no_contexts']
+        
+        if yes_score > no_score:
+            label = "Yes"
+        elif no_score > yes_score:
+            label = "No"
+        else:
+            label = "Ambiguous"
+    return label, LABEL_EMOJIS[label]
+
+
+# Classify a whole column of responses at once. Produces the same labels as
+# calling analyze_text_response on every element, but each distinct answer is
+# classified once and every rule is evaluated with one str.contains pass over
+# the column; the decision tree is then combined with NumPy boolean algebra.
+# Returns (classifications, emojis) as object Series aligned with `series`.
+def classify_responses(series, question_id):
+    series = pd.Series(series, dtype=object) if not isinstance(series, pd.Series) else series
+    codes, uniques = pd.factorize(series.astype(object))
+    texts = pd.Series(uniques, dtype=object).str.lower().str.strip()
+    valid = texts.notna().to_numpy()
+    matcher = get_matcher(question_id)
+    
+    hits = {}
+    
+    def any_hit(group):
+        regex = matcher.group_regexes[group]
+        if regex is None:
+            hits[group] = np.zeros(len(texts), dtype=bool)
+        else:
+            hits[group] = texts.str.contains(regex, na=False).to_numpy()
+        return hits[group]
+    
+    # Number of distinct patterns of `groups` found in each row of `rows`.
+    # A group only needs per-pattern counting where its combined regex hit.
+    def score(groups, rows):
+        total = np.zeros(len(texts), dtype=np.int64)
+        for group in groups:
+            selected = rows & hits[group]
+            if not selected.any():
+                continue
+            subset = texts[selected]
+            for pattern in matcher.group_patterns[group]:
+                total[selected] += subset.str.contains(pattern, na=False).to_numpy()
+        return total[rows]
+    
+    is_yes = any_hit('yes')
+    is_no = any_hit('no')
+    context_yes = any_hit('yes_contexts')
+    context_no = any_hit('no_contexts')
+    
+    yes = valid & ((is_yes & ~is_no) | (context_yes & ~context_no))
+    no = valid & ~yes & ((is_no & ~is_yes) | (context_no & ~context_yes))
+    depends = valid & ~yes & ~no & any_hit('depends')
+    
+    labels = np.full(len(texts), None, dtype=object)
+    labels[yes] = "Yes"
+    labels[no] = "No"
+    labels[depends] = "It depends"
+    
+    # Question-specific keywords, tried in order on what is still undecided
+    undecided = valid & ~yes & ~no & ~depends
+    fallback = QUESTION_RULES.get(question_id, {}).get('fallback', [])
+    for index, (fallback_label, _) in enumerate(fallback):
+        matched = undecided & any_hit(f'fallback_{index}')
+        labels[matched] = fallback_label
+        undecided &= ~matched
+    
+    # Overall tone for whatever is left; only these rows need per-pattern counts
+    if undecided.any():
+        yes_score = score(['yes', 'yes_contexts'], undecided)
+        no_score = score(['no', 'no_contexts'], undecided)
+        labels[undecided] = np.where(yes_score > no_score, "Yes",
+                                     np.where(no_score > yes_score, "No", "Ambiguous"))
+    
+    emojis = np.array([LABEL_EMOJIS.get(label) for label in labels], dtype=object)
+    
+    # Missing answers have code -1, which picks the trailing None
+    row_labels = np.append(labels, None)[codes]
+    row_emojis = np.append(emojis, None)[codes]
+    return (pd.Series(row_labels, index=series.index, dtype=object),
+            pd.Series(row_emojis, index=series.index, dtype=object))
+
+
+# Worker processes used to classify large columns. 1 keeps everything in the
+# current process; 0 means one worker per CPU core.
+CLASSIFY_WORKERS = int(os.environ.get('SURVEY_CLASSIFY_WORKERS', '1'))
+
+# Columns with fewer distinct answers than this are not worth a process pool
+PARALLEL_MIN_TEXTS = 20000
+
+
+def _classify_chunk(args):
+    texts, question_id = args
+    labels, emojis = classify_responses(pd.Series(texts, dtype=object), question_id)
+    return labels.tolist(), emojis.tolist()
+
+
+# Same as classify_responses, but the distinct answers are split into chunks
+# that are classified in a ProcessPoolExecutor. Chunks are gathered in
+# submission order, so the result is identical to the serial one. Without a
+# safe way to start the pool (see pool_context()) the column is classified
+# in this process.
+def classify_responses_parallel(series, question_id, workers=None, chunks_per_worker=4):
+    workers = CLASSIFY_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    series = series if isinstance(series, pd.Series) else pd.Series(series, dtype=object)
+    codes, uniques = pd.factorize(series.astype(object))
+    context = pool_context()
+    if workers <= 1 or len(uniques) < PARALLEL_MIN_TEXTS or context is None:
+        return classify_responses(series, question_id)
+    
+    chunks = np.array_split(np.asarray(uniques, dtype=object), workers * chunks_per_worker)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = list(pool.map(_classify_chunk, [(chunk.tolist(), question_id) for chunk in chunks]))
+    
+    labels = np.array([label for chunk_labels, _ in results for label in chunk_labels] + [None], dtype=object)
+    emojis = np.array([emoji for _, chunk_emojis in results for emoji in chunk_emojis] + [None], dtype=object)
+    return (pd.Series(labels[codes], index=series.index, dtype=object),
+            pd.Series(emojis[codes], index=series.index, dtype=object))
+
+
+# Fingerprint of the classification rules. It covers the pattern tables and the
+# compiled code of analyze_text_response and PatternMatcher (bytecode plus
+# every constant), so editing a pattern or the decision logic changes it and
+# previously stored results are ignored.
+def _code_fingerprint(code, digest):
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_fingerprint(const, digest)
+        elif isinstance(const, frozenset):
+            # Set literals have no stable repr order across runs
+            digest.update(repr(sorted(const, key=repr)).encode('utf-8'))
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+
+def ruleset_version():
+    digest = hashlib.sha256()
+    rules = (YES_PATTERNS, NO_PATTERNS, DEPENDS_PATTERNS, QUESTION_RULES, LABEL_EMOJIS)
+    digest.update(repr(rules).encode('utf-8'))
+    # Both the per-answer path and the vectorized one ClassificationStore
+    # uses, so editing either decision tree invalidates stored labels
+    for func in (_parse_literal_pattern, PatternMatcher.__init__, PatternMatcher._node_regex, PatternMatcher.scan,
+                 get_matcher, analyze_text_response, classify_responses, _classify_chunk,
+                 classify_responses_parallel):
+        _code_fingerprint(func.__code__, digest)
+    return digest.hexdigest()[:16]
+
+
+# analyze_text_response only looks at the lower-cased, stripped text, so two
+# answers that normalize to the same string always get the same label
+def normalize_text(text):
+    return text.lower().strip()
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+# Persistent store of classification results keyed by
+# (question_id, normalized-text hash) for one rule-set version. Each version
+# lives in its own file, so changing the rules starts from an empty store and
+# old files are removed on the next save.
+class ClassificationStore:
+    def __init__(self, cache_dir=None, version=None):
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.version = version or ruleset_version()
+        self.path = os.path.join(self.cache_dir, f"classifications-{self.version}.pkl")
+        self.results = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self.results = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.results = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            def write(p):
+                with open(p, 'wb') as f:
+                    pickle.dump(self.results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            atomic_write(self.path, write)
+            for name in os.listdir(self.cache_dir):
+                if name.startswith('classifications-') and name.endswith('.pkl') \
+                        and name != os.path.basename(self.path):
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            # Read-only installs keep working, they just classify on every start
+            return
+        self.dirty = False
+
+    # Classify a column of responses, running the classifier only for texts
+    # that are not in the store yet. Returns (classifications, emojis) as
+    # Series aligned with `texts`. `workers` is passed on to
+    # classify_responses_parallel.
+    def classify(self, texts, question_id, workers=None):
+        texts = texts if isinstance(texts, pd.Series) else pd.Series(texts, dtype=object)
+        codes, uniques = pd.factorize(texts.astype(object))
+        # One extra slot at the end so missing answers (code -1) map to None
+        labels = np.full(len(uniques) + 1, None, dtype=object)
+        emojis = np.full(len(uniques) + 1, None, dtype=object)
+        keys = [(question_id, text_key(text)) if isinstance(text, str) else None for text in uniques]
+        
+        unseen = []
+        for index, key in enumerate(keys):
+            if key is None:
+                continue
+            result = self.results.get(key)
+            if result is None:
+                unseen.append(index)
+            else:
+                labels[index], emojis[index] = result
+                self.hits += 1
+        
+        if unseen:
+            new_labels, new_emojis = classify_responses_parallel(
+                pd.Series(uniques[unseen], dtype=object), question_id, workers=workers)
+            for index, label, emoji in zip(unseen, new_labels, new_emojis):
+                labels[index] = label
+                emojis[index] = emoji
+                self.results[keys[index]] = (label, emoji)
+            self.misses += len(unseen)
+            self.dirty = True
+        
+        return (pd.Series(labels[codes], index=texts.index, dtype=object),
+                pd.Series(emojis[codes], index=texts.index, dtype=object))
@@ -0,0 +1,309 @@
+import itertools
+import re
+from collections import Counter
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import growable_arrays
+
+# Words are runs of letters/digits; matching ignores case
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+# Split a text into its distinct lower-case words
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+# Inverted index over a column of free-text answers.
+#
+# For every word it keeps the sorted positions of the rows containing it
+# (its postings list). All postings live in one array, with `indptr` giving
+# the slice of each word, so a lookup is a dictionary access plus a slice.
+# Identical answers are tokenized once and share their postings.
+#
+# Appended batches are indexed on their own and kept in `parts`, indexes of
+# later rows, each smaller than the one before it; a part is merged into the
+# previous one once it has grown as large. A word's postings are the
+# concatenation of its postings in every part.
+class InvertedIndex:
+    def __init__(self, texts):
+        self.n_rows = len(texts)
+        codes, uniques = pd.factorize(texts)
+
+        # (word, distinct answer) pairs
+        self.vocabulary = {}
+        pair_terms = []
+        pair_docs = []
+        for doc, text in enumerate(uniques):
+            for term in set(tokenize(text)):
+                pair_terms.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                pair_docs.append(doc)
+        pair_terms = np.asarray(pair_terms, dtype=np.int64)
+        pair_docs = np.asarray(pair_docs, dtype=np.int64)
+
+        # Rows of each distinct answer, as slices of one array grouped by answer
+        doc_rows = np.argsort(codes, kind='stable')
+        doc_rows = doc_rows[codes[doc_rows] >= 0]
+        doc_bounds = np.searchsorted(codes[doc_rows], np.arange(len(uniques) + 1))
+        doc_starts = doc_bounds[:-1]
+        doc_sizes = np.diff(doc_bounds)
+
+        # Expand every pair into the rows of its answer, then order the rows
+        # by word and position with a single sort of (word, row) keys
+        sizes = doc_sizes[pair_docs]
+        offsets = np.repeat(doc_starts[pair_docs] - (np.cumsum(sizes) - sizes), sizes)
+        rows = doc_rows[offsets + np.arange(sizes.sum())]
+        stride = max(self.n_rows, 1)
+        keys = np.repeat(pair_terms, sizes) * stride + rows
+        keys.sort()
+        self.rows = keys % stride
+        self.indptr = np.searchsorted(keys, np.arange(len(self.vocabulary) + 1) * stride)
+        self.parts = []
+
+    # Index over the rows of this one followed by `texts` (a batch of new
+    # respondents). Only the batch is tokenized and it becomes a new part,
+    # so the rows already indexed are not copied (merging parts of similar
+    # sizes adds a logarithmic factor). Returns a new index and leaves this
+    # one untouched.
+    def extend(self, texts):
+        batch = InvertedIndex(texts)
+        batch.rows += self.n_rows
+        parts = [self._first_part()] + self.parts + [batch]
+        while len(parts) > 1 and len(parts[-2].rows) <= len(parts[-1].rows):
+            newer = parts.pop()
+            parts[-1] = parts[-1]._merge(newer)
+        index = parts[0]
+        index.parts = parts[1:]
+        index.n_rows = self.n_rows + batch.n_rows
+        return index
+
+    def _first_part(self):
+        part = InvertedIndex.__new__(InvertedIndex)
+        part.n_rows = self.n_rows
+        part.vocabulary = self.vocabulary
+        part.rows = self.rows
+        part.indptr = self.indptr
+        part.parts = []
+        return part
+
+    # One part holding the postings of this one followed by those of
+    # `newer`, a part of later rows. Its postings are inserted at the end of
+    # their words' lists, so the lists stay sorted without re-sorting.
+    def _merge(self, newer):
+        index = InvertedIndex.__new__(InvertedIndex)
+        index.n_rows = self.n_rows + newer.n_rows
+        index.vocabulary = dict(self.vocabulary)
+        index.parts = []
+        term_ids = np.array([index.vocabulary.setdefault(term, len(index.vocabulary)) for term in newer.vocabulary],
+                            dtype=np.int64)
+
+        # Newer postings ordered by their word's id in the merged vocabulary
+        terms = np.repeat(term_ids, np.diff(newer.indptr))
+        order = np.argsort(terms, kind='stable')
+        terms = terms[order]
+        rows = newer.rows[order]
+
+        known_terms = len(self.indptr) - 1
+        positions = np.where(terms < known_terms, self.indptr[np.minimum(terms, known_terms - 1) + 1], len(self.rows))
+        index.rows = np.insert(self.rows, positions, rows)
+        sizes = np.bincount(terms, minlength=len(index.vocabulary))
+        sizes[:known_terms] += np.diff(self.indptr)
+        index.indptr = np.concatenate([[0], np.cumsum(sizes)])
+        return index
+
+    # Sorted row positions of the rows containing `term`
+    def postings(self, term):
+        lists = [part._part_postings(term) for part in [self] + self.parts]
+        return np.concatenate(lists) if len(lists) > 1 else lists[0]
+
+    def _part_postings(self, term):
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return self.rows[:0]
+        return self.rows[self.indptr[term_id]:self.indptr[term_id + 1]]
+
+    # Sorted row positions of the rows containing every word of `query`.
+    # Returns None when the query has no words (nothing to search for).
+    def search(self, query):
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        lists = sorted((self.postings(term) for term in terms), key=len)
+        result = lists[0]
+        for postings in lists[1:]:
+            if len(result) == 0:
+                break
+            result = intersect_sorted(result, postings)
+        return result
+
+
+# Intersection of two sorted arrays of distinct positions, looking up the
+# shorter one in the longer one
+def intersect_sorted(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    found = np.searchsorted(b, a)
+    found[found == len(b)] = 0
+    return a[b[found] == a]
+
+
+# Common English words left out of the term counts
+STOP_WORDS = frozenset("""
+a about after all also am an and any are as at be because been but by can could did do does doesn't
+don't for from had has have he her his how i if in into is isn't it it's its just like me more most
+my no not of on one only or other our out so some such than that that's the their them then there
+these they this to too up very was we were what when which who why will with would you your
+""".split()) | frozenset(['doesn', 'don', 'isn', 's', 't'])
+
+
+# Words and two-word phrases of a text, skipping stop words (a phrase is
+# two consecutive words, neither of them a stop word)
+def text_terms(text, stop_words=STOP_WORDS):
+    words = tokenize(text)
+    terms = [word for word in words if word not in stop_words]
+    terms.extend(
+        f"{first} {second}" for first, second in zip(words, words[1:])
+        if first not in stop_words and second not in stop_words
+    )
+    return terms
+
+
+# Sparse document-term count matrix over a column of free-text answers.
+#
+# Rows are the distinct answers and columns the words/phrases, stored
+# CSR-style (indptr, indices, data). Each respondent points at the row of
+# their answer, so the term counts of any set of respondents are one
+# weighted row-sum: count how many selected respondents gave each answer,
+# then add up those rows with a single scipy.sparse product. indptr and
+# indices are int32 while they fit, the index dtype scipy picks, so the
+# arrays are wrapped without a copy. Terms used by fewer than `min_count` respondents
+# overall are left out of the counts; they cannot make a meaningful "top
+# terms" list. They stay in the matrix so that extend() can count them once
+# new respondents use them too.
+class TermMatrix:
+    def __init__(self, texts, min_count=2, stop_words=STOP_WORDS):
+        self.min_count = min_count
+        self.stop_words = stop_words
+        self.doc_codes, uniques = pd.factorize(texts)
+        doc_sizes = np.bincount(self.doc_codes[self.doc_codes >= 0], minlength=len(uniques))
+
+        vocabulary = {}
+        indptr, indices, data = _count_terms(uniques, vocabulary, stop_words)
+
+        # Number the terms from the most used down, which keeps the busiest
+        # counters close together in memory during the row-sums
+        terms = np.array(list(vocabulary), dtype=object)
+        doc_of_entry = np.repeat(np.arange(len(uniques)), np.diff(indptr))
+        users = np.bincount(indices, weights=doc_sizes[doc_of_entry], minlength=len(terms))
+        order = np.argsort(-users, kind='stable')
+        new_ids = np.empty(len(terms), dtype=np.int64)
+        new_ids[order] = np.arange(len(terms))
+        self.terms = terms[order]
+        self.vocabulary = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.users = users[order]
+        self.kept = self.users >= min_count
+        index_dtype = _index_dtype(indptr[-1], len(terms))
+        self.indices = new_ids[indices].astype(index_dtype)
+        self.data = data.astype(np.float64)
+        self.indptr = indptr.astype(index_dtype)
+        self.n_docs = len(uniques)
+        self.totals = self._sum(doc_sizes)
+
+    # Matrix over the respondents of this one followed by `texts` (a batch of
+    # new respondents). The batch's distinct answers become new rows of the
+    # matrix and its new terms new columns; only the batch is tokenized.
+    # The arrays grow in place (see growable_arrays.py) and so does the
+    # vocabulary, which only extend() reads; the per-term totals are
+    # recomputed. Returns a new matrix and leaves this one untouched.
+    def extend(self, texts):
+        codes, uniques = pd.factorize(texts)
+        doc_sizes = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        # Terms after the first len(self.terms) were added by another
+        # extend() of this matrix
+        vocabulary = self.vocabulary
+        if len(vocabulary) != len(self.terms):
+            vocabulary = dict(itertools.islice(vocabulary.items(), len(self.terms)))
+        indptr, indices, data = _count_terms(uniques, vocabulary, self.stop_words)
+        new_terms = list(itertools.islice(reversed(vocabulary), len(vocabulary) - len(self.terms)))[::-1]
+        doc_of_entry = np.repeat(np.arange(len(uniques)), np.diff(indptr))
+
+        matrix = TermMatrix.__new__(TermMatrix)
+        matrix.min_count = self.min_count
+        matrix.stop_words = self.stop_words
+        matrix.doc_codes = growable_arrays.append(self.doc_codes, np.where(codes >= 0, codes + self.n_docs, -1))
+        matrix.terms = growable_arrays.append(self.terms, np.array(new_terms, dtype=object))
+        matrix.vocabulary = vocabulary
+        padding = len(vocabulary) - len(self.terms)
+        matrix.users = np.pad(self.users, (0, padding)) + np.bincount(
+            indices, weights=doc_sizes[doc_of_entry], minlength=len(vocabulary))
+        matrix.kept = matrix.users >= self.min_count
+        index_dtype = _index_dtype(self.indptr[-1] + len(indices), len(vocabulary))
+        # Past the int32 range the arrays are widened, which copies them once
+        old_indices, old_indptr = self.indices, self.indptr
+        if index_dtype != old_indices.dtype:
+            old_indices, old_indptr = old_indices.astype(index_dtype), old_indptr.astype(index_dtype)
+        matrix.indices = growable_arrays.append(old_indices, indices.astype(index_dtype))
+        matrix.data = growable_arrays.append(self.data, data.astype(np.float64))
+        matrix.indptr = growable_arrays.append(old_indptr, (indptr[1:] + self.indptr[-1]).astype(index_dtype))
+        matrix.n_docs = self.n_docs + len(uniques)
+        matrix.totals = np.pad(self.totals, (0, padding)) + np.bincount(
+            indices, weights=data * doc_sizes[doc_of_entry], minlength=len(vocabulary))
+        return matrix
+
+    # The matrix as a scipy.sparse.csr_matrix over the same arrays
+    def sparse(self):
+        return scipy.sparse.csr_matrix((self.data, self.indices, self.indptr),
+                                       shape=(self.n_docs, len(self.terms)), copy=False)
+
+    # Term counts for the documents weighted by `doc_weights`
+    def _sum(self, doc_weights):
+        return self.sparse().T @ doc_weights
+
+    # Term counts over the respondents at the given row positions (all
+    # respondents when None), zero for terms below `min_count`
+    def term_counts(self, rows=None):
+        if rows is None:
+            return self.totals * self.kept
+        codes = self.doc_codes[rows]
+        return self._sum(np.bincount(codes[codes >= 0], minlength=self.n_docs).astype(np.float64)) * self.kept
+
+    # The `n` most frequent terms among the given rows as (term, count)
+    # pairs, most frequent first (ties in alphabetical order)
+    def top_terms(self, rows=None, n=10):
+        counts = self.term_counts(rows)
+        if n <= 0:
+            return []
+        # Only terms at least as frequent as the n-th largest count can make
+        # the list, so just those few are sorted
+        if len(counts) > n:
+            threshold = max(np.partition(counts, len(counts) - n)[len(counts) - n], 1)
+        else:
+            threshold = 1
+        candidates = np.flatnonzero(counts >= threshold)
+        ranked = sorted(candidates, key=lambda i: (-counts[i], self.terms[i]))[:n]
+        return [(self.terms[i], int(counts[i])) for i in ranked]
+
+
+# Smallest of the index dtypes scipy.sparse uses that holds `n_entries`
+# entries over `n_terms` terms
+def _index_dtype(n_entries, n_terms):
+    return np.int32 if max(n_entries, n_terms) <= np.iinfo(np.int32).max else np.int64
+
+
+# CSR rows (indptr, indices, data) of the word/phrase counts of `texts`, one
+# row per text. Terms are numbered through `vocabulary`, which new terms are
+# added to.
+def _count_terms(texts, vocabulary, stop_words=STOP_WORDS):
+    indptr = [0]
+    indices = []
+    data = []
+    for text in texts:
+        counts = Counter(text_terms(text, stop_words))
+        indices.extend(vocabulary.setdefault(term, len(vocabulary)) for term in counts)
+        data.extend(counts.values())
+        indptr.append(len(indices))
+    return (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64),
+            np.asarray(data, dtype=np.int64))
@@ -1,282 +1,174 @@
 import pandas as pd
 import numpy as np
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
 from dash import Dash, html, dcc, callback, Output, Input, State
 import dash_bootstrap_components as dbc
-import re
+from flask import Response, abort, request
+import json
+import gc
+import logging
+import hmac
+from survey_data import remap_labels
+from survey_dataset import load_dataset, share_dataset, demographic_mappings, FILTER_COLUMNS
+from dataset_watcher import DatasetWatcher
+from survey_ingest import INGEST_TOKEN
+from shared_arrays import SHARE_ARRAYS
+from survey_index import cube_value_counts, cube_group_sizes
+from result_cache import LRUCache, canonical_selections, create_shared_backend
+from text_search import intersect_sorted, tokenize
+from metrics import MetricsRegistry
 
-# Load data
-questions_df = pd.read_excel('Questions.xlsx')
-numeric_df = pd.read_excel('Chat Data Numeric.xlsx')
-text_df = pd.read_excel('Chat Data Text.xlsx')
+# Timings of the load stages and callbacks, served on /metrics
+metrics = MetricsRegistry()
 
-# Create a mapping of question IDs to their text
-question_mapping = dict(zip(questions_df['Question_ID'], questions_df['Question_Text']))
+# Load and process the survey data (parsed workbooks and classification
+# results are cached in .survey_cache/ after the first run)
+def load_survey_data():
+    timings = {}
+    dataset = load_dataset(timings=timings)
+    for stage, seconds in timings.items():
+        metrics.observe('survey_load_stage_seconds', seconds, "Time spent in each stage of loading the survey data",
+                        stage=stage)
+    return dataset
 
-# Function to analyze text responses and classify as Yes or No
-def analyze_text_response(text, question_id):
-    if pd.isna(text) or not isinstance(text, str):
-        return None, None
-    
-    text = text.lower().strip()
-    
-    # Define yes/no patterns
-    yes_patterns = [
-        r'\byes\b', r'\byeah\b', r'\bep\b', r'\bsure\b', r'\bdefinitely\b', 
-        r'\babsolutely\b', r'\bagree\b', r'\bwould\b', r'\bpositive\b', r'\baffirmative\b',
-        r'\bi think so\b', r'\bi would\b', r'\bi do\b', r'\bi believe so\b'
-    ]
-    
-    no_patterns = [
-        r'\bno\b', r'\bnope\b', r'\bnah\b', r'\bnever\b', r'\bdisagree\b', 
-        r'\bwouldn\'t\b', r'\bwould not\b', r'\bnegative\b', r'\bnot\b', 
-        r'\bi don\'t\b', r'\bi do not\b', r'\bi wouldn\'t\b', r'\bi would not\b'
-    ]
-    
-    # Question-specific context analysis
-    if question_id == 'Q8':  # Is curry a soup?
-        # Additional context for curry question
-        yes_contexts = [
-            r'is a soup', r'type of soup', r'soup-like', r'similar to soup', 
-            r'considered a soup', r'classified as soup', r'soup category'
-        ]
-        no_contexts = [
-            r'not a soup', r'isn\'t a soup', r'is not a soup', r'different from soup',
-            r'stew', r'sauce', r'dish', r'not soup', r'wouldn\'t classify'
-        ]
-    elif question_id == 'Q9':  # Is pizza crust-to-crust a sandwich?
-        # Additional context for pizza sandwich question
-        yes_contexts = [
-            r'is a sandwich', r'sandwich-like', r'would be a sandwich', 
-            r'technically a sandwich', r'fits the definition', r'meets the criteria'
-        ]
-        no_contexts = [
-            r'not a sandwich', r'isn\'t a sandwich', r'is not a sandwich', 
-            r'wouldn\'t be a sandwich', r'would not be a sandwich', r'just pizza'
-        ]
-    else:
-        yes_contexts = []
-        no_contexts = []
-    
-    # Check for direct yes/no answers
-    is_yes = any(re.search(pattern, text) for pattern in yes_patterns)
-    is_no = any(re.search(pattern, text) for pattern in no_patterns)
-    
-    # Check for contextual clues
-    context_yes = any(re.search(pattern, text) for pattern in yes_contexts)
-    context_no = any(re.search(pattern, text) for pattern in no_contexts)
-    
-    # Determine the final classification
-    if (is_yes and not is_no) or (context_yes and not context_no):
-        return "Yes", "✅"
-    elif (is_no and not is_yes) or (context_no and not context_yes):
-        return "No", "❌"
-    elif "it depends" in text or "depends" in text:
-        return "It depends", "🤔"
-    else:
-        # For ambiguous responses, do a more detailed analysis
-        if question_id == 'Q8':
-            if any(word in text for word in ['stew', 'sauce', 'dish', 'not liquid enough']):
-                return "No", "❌"
-            elif any(word in text for word in ['liquid', 'broth', 'bowl']):
-                return "Yes", "✅"
-        elif question_id == 'Q9':
-            if any(word in text for word in ['bread', 'filling', 'between']):
-                return "Yes", "✅"
-            elif any(word in text for word in ['still pizza', 'just pizza', 'not bread']):
-                return "No", "❌"
-        
-        # If still ambiguous, make a best guess based on the overall tone
-        yes_score = sum(1 for pattern in yes_patterns + yes_contexts if re.search(pattern, text))
-        no_score = sum(1 for pattern in no_patterns + no_contexts if re.search(pattern, text))
-        
-        if yes_score > no_score:
-            return "Yes", "✅"
-        elif no_score > yes_score:
-            return "No", "❌"
-        else:
-            return "Ambiguous", "❓"
+# The dataset being served. The watcher rebuilds it in the background when
+# new survey files are dropped in and swaps it in whole; callbacks read
+# dataset_watcher.current once per request and pass that dataset down. Its
+# reload messages go to stderr.
+watcher_log = logging.getLogger('dataset_watcher')
+if not watcher_log.handlers:
+    watcher_log.addHandler(logging.StreamHandler())
+    watcher_log.setLevel(logging.INFO)
+dataset_watcher = DatasetWatcher(load_survey_data(), loader=load_survey_data)
 
-# Process text responses for Q8 and Q9
-for question_id in ['Q8', 'Q9']:
-    text_column = f"{question_id}_text"
-    if text_column in text_df.columns:
-        # Create new columns for classification and emoji
-        classification_column = f"{question_id}_classification"
-        emoji_column = f"{question_id}_emoji"
-        
-        # Apply the analysis function to each text response
-        classifications = []
-        emojis = []
-        
-        for text in text_df[text_column]:
-            classification, emoji = analyze_text_response(text, question_id)
-            classifications.append(classification)
-            emojis.append(emoji)
-        
-        text_df[classification_column] = classifications
-        text_df[emoji_column] = emojis
+# Map the filter dropdown values onto the columns they filter
+def build_filter_selections(age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses):
+    return dict(zip(FILTER_COLUMNS, [age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses]))
 
-# Create a mapping for demographic variables
-demographic_mappings = {
-    'GENDER': {
-        1: 'Male',
-        2: 'Female',
-        'Male': 'Male',
-        'Female': 'Female'
-    },
-    'REGION': {
-        1: 'ATL',
-        2: 'QC',
-        3: 'ON',
-        4: 'MB',
-        5: 'SK',
-        6: 'AB',
-        7: 'BC',
-        'AB': 'Alberta',
-        'BC': 'British Columbia',
-        'MB': 'Manitoba',
-        'ON': 'Ontario',
-        'QC': 'Quebec',
-        'SK': 'Saskatchewan',
-        'ATL': 'Atlantic Provinces'
-    },
-    'REGION_DISPLAY': {
-        'AB': 'Alberta',
-        'BC': 'British Columbia',
-        'MB': 'Manitoba',
-        'ON': 'Ontario',
-        'QC': 'Quebec',
-        'SK': 'Saskatchewan',
-        'ATL': 'Atlantic Provinces'
-    },
-    'EDUCATION': {
-        1: 'Elementary/High School (Partial)',
-        2: 'High School Graduate',
-        3: 'College/Trade School (Partial)',
-        4: 'College/Trade School Graduate',
-        5: 'University (Partial)',
-        6: 'Bachelor\'s Degree',
-        7: 'Graduate Degree (Master\'s/PhD)',
-        'Some elementary or high school': 'Elementary/High School (Partial)',
-        'High school graduate': 'High School Graduate',
-        'Some college/trade school': 'College/Trade School (Partial)',
-        'Graduated from college/trade school': 'College/Trade School Graduate',
-        'Some university': 'University (Partial)',
-        'University undergraduate degree, such as a bachelor\'s degree': 'Bachelor\'s Degree',
-        'University graduate degree, such as a master\'s or PhD': 'Graduate Degree (Master\'s/PhD)'
-    },
-    'EDUCATION_ORDER': [
-        'Elementary/High School (Partial)',
-        'High School Graduate',
-        'College/Trade School (Partial)',
-        'College/Trade School Graduate',
-        'University (Partial)',
-        'Bachelor\'s Degree',
-        'Graduate Degree (Master\'s/PhD)'
-    ],
-    'HHINCOME': {
-        1: 'Under $25,000',
-        2: '$25,000 to less than $50,000',
-        3: '$50,000 to less than $100,000',
-        4: '$100,000 to less than $150,000',
-        5: '$150,000 to less than $200,000',
-        6: 'Over $200,000',
-        7: 'Don\'t know / Rather not say',
-        'Under $25,000': 'Under $25,000',
-        '$25,000 to less than $50,000': '$25,000 to less than $50,000',
-        '$50,000 to less than $100,000': '$50,000 to less than $100,000',
-        '$100,000 to less than $150,000': '$100,000 to less than $150,000',
-        '$150,000 to less than $200,000': '$150,000 to less than $200,000',
-        'Over $200,000': 'Over $200,000',
-        'Don\'t know / Rather not say': 'Don\'t know / Rather not say'
-    },
-    'HHINCOME_ORDER': [
-        'Under $25,000',
-        '$25,000 to less than $50,000',
-        '$50,000 to less than $100,000',
-        '$100,000 to less than $150,000',
-        '$150,000 to less than $200,000',
-        'Over $200,000',
-        'Don\'t know / Rather not say'
-    ],
-    'AGE_GROUP_ORDER': [
-        'Under 18',
-        '18-24',
-        '25-29',
-        '30-34',
-        '35-39',
-        '40-44',
-        '45-49',
-        '50-54',
-        '55-59',
-        '60-64',
-        '65-69',
-        '70-74',
-        '75+'
-    ],
-    'ETHNICITYROLL23': {
-        1: 'First Nations',
-        2: 'White',
-        3: 'South Asian',
-        4: 'Chinese',
-        5: 'Black',
-        6: 'Filipino',
-        7: 'Arab/West Asian',
-        8: 'Latin American',
-        9: 'Southeast Asian',
-        10: 'East Asian',
-        11: 'Multiple visible minorities',
-        'White': 'White',
-        'Black': 'Black',
-        'Chinese': 'Chinese',
-        'South Asian': 'South Asian',
-        'East Asian': 'East Asian',
-        'Southeast Asian': 'Southeast Asian',
-        'Filipino': 'Filipino',
-        'Latin American': 'Latin American',
-        'Arab/West Asian': 'Arab/West Asian',
-        'First Nations': 'First Nations',
-        'Multiple visible minorities': 'Multiple visible minorities'
-    },
-    'PMARITALSTATUS': {
-        1: 'Single, never married',
-        2: 'Married',
-        3: 'Common law',
-        4: 'Separated',
-        5: 'Widowed',
-        6: 'Divorced',
-        'Married': 'Married',
-        'Single, never married': 'Single, never married',
-        'Divorced': 'Divorced',
-        'Separated': 'Separated',
-        'Widowed': 'Widowed',
-        'Common law': 'Common law'
-    }
-}
+# Results of both data callbacks (figures, text sections and the count cube
+# selections behind them), shared across users and requests. Keys start with
+# the version of the dataset they were computed from, a fingerprint of the
+# workbooks, question schema and classification rules. With
+# SURVEY_SHARED_CACHE set, results are also shared between worker processes.
+result_cache = LRUCache(shared=create_shared_backend(), namespace=dataset_watcher.current.version)
 
-# Convert text demographic values to be consistent with numeric_df
-for col in ['GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']:
-    if col in text_df.columns:
-        text_df[col] = text_df[col].map(lambda x: demographic_mappings[col].get(x, x))
+# Results of a replaced dataset can never be hit again, so drop them
+def dataset_swapped(old, new):
+    result_cache.namespace = new.version
+    result_cache.clear()
 
-# Convert numeric demographic codes to text labels in numeric_df
-for col in ['GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']:
-    if col in numeric_df.columns:
-        numeric_df[col] = numeric_df[col].map(lambda x: demographic_mappings[col].get(x, x))
+dataset_watcher.on_swap = dataset_swapped
 
-# Create age groups
-numeric_df['AGE_GROUP'] = pd.cut(
-    numeric_df['AGE'], 
-    bins=[0, 18, 24, 29, 34, 39, 44, 49, 54, 59, 64, 69, 74, 100],
-    labels=['Under 18', '18-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75+']
-)
+# Count cube cells for a question and filter selection. Every chart type of
+# the same question, filters and grouping reuses the same cells, so they are
+# cached separately from the figures. Callers must not modify the result.
+def select_counts(dataset, cubes, question_id, selections, group_columns):
+    kind = 'text' if cubes is dataset.text_cubes else 'numeric'
+    cache_key = ('counts', dataset.version, kind, question_id, canonical_selections(selections), tuple(group_columns))
+    return result_cache.get_or_compute(
+        cache_key, lambda: cubes[question_id].select(selections, group_columns))
+
+# Positions of the text_df rows that match the filters and have a text
+# answer for the question, narrowed to the answers containing every word of
+# `search` when given. With `collapse_duplicates`, only the first matching
+# response of each near-duplicate cluster is kept. Cached per filter
+# selection, search and switch, so every page of the responses list is a
+# slice of the same array.
+def text_response_rows(dataset, question_id, selections, search=None, collapse_duplicates=False):
+    terms = tuple(sorted(set(tokenize(search or ''))))
+    
+    def compute():
+        if collapse_duplicates:
+            rows = text_response_rows(dataset, question_id, selections, search)
+            _, first = np.unique(dataset.text_duplicate_clusters[question_id].labels[rows], return_index=True)
+            return rows[np.sort(first)]
+        row_mask = dataset.text_filter_index.mask({col: values for col, values in selections.items() if col in dataset.text_filter_index.columns})
+        row_mask &= dataset.text_answered[question_id]
+        rows = np.flatnonzero(row_mask)
+        if terms:
+            rows = intersect_sorted(rows, dataset.text_search_indexes[question_id].search(' '.join(terms)))
+        return rows
+    cache_key = ('text_rows', dataset.version, question_id, canonical_selections(selections), terms,
+                 bool(collapse_duplicates))
+    return result_cache.get_or_compute(cache_key, compute)
+
+# Gather the given rows of the requested text_df columns only
+def gather_text_rows(dataset, positions, columns):
+    return pd.DataFrame({col: dataset.text_df[col].take(positions) for col in columns})
+
+# Individual text responses shown per page of the responses list
+RESPONSES_PAGE_SIZE = 50
+
+# Words/phrases listed in the top terms panel
+TOP_TERMS_COUNT = 10
 
 # Initialize the Dash app
-app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY, dbc.icons.BOOTSTRAP])
+# The responses pagination is created by a callback, so its callback is
+# registered before the component exists in the layout
+app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY, dbc.icons.BOOTSTRAP],
+           suppress_callback_exceptions=True)
 server = app.server
 
+# Result cache statistics and dataset sizes, read at every scrape of /metrics
+def metrics_gauges():
+    dataset = dataset_watcher.current
+    stats = result_cache.stats()
+    gauges = [
+        (f"survey_result_cache_{key}", f"Result cache {key.replace('_', ' ')}", {}, stats[key])
+        for key in ['entries', 'bytes', 'hits', 'misses', 'evictions', 'hit_rate', 'shared_hits', 'shared_errors']
+    ]
+    gauges.append(('survey_dataset_reloads', "Times new survey files were loaded without a restart",
+                   {}, dataset_watcher.reloads))
+    gauges.append(('survey_dataset_reload_errors', "Reloads of changed survey files that failed",
+                   {}, dataset_watcher.reload_errors))
+    gauges.append(('survey_dataset_appends', "Batches of new respondents appended by this process",
+                   {}, dataset_watcher.appends))
+    gauges.append(('survey_dataset_rows', "Respondents in each frame of the loaded dataset",
+                   {'frame': 'numeric'}, len(dataset.numeric_df)))
+    gauges.append(('survey_dataset_rows', "Respondents in each frame of the loaded dataset",
+                   {'frame': 'text'}, len(dataset.text_df)))
+    for question_id, answered in dataset.text_answered.items():
+        gauges.append(('survey_text_responses', "Respondents with a free-text answer to each question",
+                       {'question': question_id}, answered.sum()))
+    return gauges
+
+metrics.add_gauges(metrics_gauges)
+
+# Latency histograms and gauges in the Prometheus text format
+@server.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Append new respondents without reprocessing the loaded ones. The body is
+# {"numeric": [...], "text": [...]}, lists of {column: value} rows shaped
+# like the numeric and text workbooks. Needs SURVEY_INGEST_TOKEN as a bearer
+# token and is not served without it.
+@server.route('/ingest', methods=['POST'])
+def ingest_endpoint():
+    if not INGEST_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {INGEST_TOKEN}"):
+        abort(401)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return Response(json.dumps({'error': "Expected a JSON object"}), status=400, mimetype='application/json')
+    try:
+        numeric_batch = pd.DataFrame.from_records(payload.get('numeric') or [])
+        text_batch = pd.DataFrame.from_records(payload.get('text') or [])
+        dataset = dataset_watcher.append(numeric_batch, text_batch)
+    except (ValueError, TypeError) as e:
+        return Response(json.dumps({'error': str(e)}), status=400, mimetype='application/json')
+    result = {'version': dataset.version, 'numeric_rows': len(dataset.numeric_df), 'text_rows': len(dataset.text_df)}
+    return Response(json.dumps(result), mimetype='application/json')
+
+# Watch the survey files from the process serving the requests (each
+# gunicorn worker starts its own watcher)
+@server.before_request
+def start_dataset_watcher():
+    dataset_watcher.ensure_running()
+
 # Custom CSS for better styling
 app.index_string = '''
 <!DOCTYPE html>
@@ -388,319 +280,231 @@ app.index_string = '''
 </html>
 '''
 
-# Define the layout
-app.layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.H1("Survey Data Visualization Dashboard", className="dashboard-title text-center my-4"),
-            html.P("Explore and analyze survey responses with interactive visualizations", className="dashboard-subtitle text-center mb-4")
-        ])
-    ]),
+# Define the layout, built on every page load so the question and filter
+# dropdowns list what the dataset currently served contains
+def serve_layout():
+    dataset = dataset_watcher.current
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.H1("Survey Data Visualization Dashboard", className="dashboard-title text-center my-4"),
+                html.P("Explore and analyze survey responses with interactive visualizations", className="dashboard-subtitle text-center mb-4")
+            ])
+        ]),
     
-    dbc.Row([
-        # Left sidebar for filters
-        dbc.Col([
-            html.Div([
-                html.H4("Filters", className="section-title"),
-                
+        dbc.Row([
+            # Left sidebar for filters
+            dbc.Col([
                 html.Div([
-                    html.H5("Question Selection", className="filter-label mt-3"),
-                    dcc.Dropdown(
-                        id='question-dropdown',
-                        options=[
-                            {'label': 'Q1: Is a hot dog a sandwich?', 'value': 'Q1'},
-                            {'label': 'Q2: Does a ripped hot dog bun become a sandwich?', 'value': 'Q2'},
-                            {'label': 'Q3: Minimum ingredients for a sandwich', 'value': 'Q3'},
-                            {'label': 'Q4: When is a taco considered a sandwich?', 'value': 'Q4'},
-                            {'label': 'Q5: Most important characteristic of soup', 'value': 'Q5'},
-                            {'label': 'Q6: Is cereal with milk a type of soup?', 'value': 'Q6'},
-                            {'label': 'Q7: Open-faced vs. regular sandwich preference', 'value': 'Q7'},
-                            {'label': 'Q8: Is curry a soup?', 'value': 'Q8'},
-                            {'label': 'Q9: Is folded pizza a sandwich?', 'value': 'Q9'},
-                            {'label': 'Q10: Importance of chef\'s intent for sandwiches', 'value': 'Q10'}
-                        ],
-                        value='Q1',
-                        clearable=False,
-                        className="mb-3",
-                        style={'lineHeight': '1.5', 'fontSize': '14px'}
-                    ),
-                    
-                    html.H5("Demographics", className="filter-label mt-3"),
-                    
-                    html.Label("Age Group", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='age-group-dropdown',
-                        options=[{'label': age_group, 'value': age_group} 
-                                for age_group in sorted(numeric_df['AGE_GROUP'].unique()) if pd.notna(age_group)],
-                        multi=True,
-                        placeholder="Select age groups...",
-                        className="mb-2"
-                    ),
+                    html.H4("Filters", className="section-title"),
+                
+                    html.Div([
+                        html.H5("Question Selection", className="filter-label mt-3"),
+                        dcc.Dropdown(
+                            id='question-dropdown',
+                            options=dataset.questions.dropdown_options(),
+                            value=dataset.questions.ids()[0],
+                            clearable=False,
+                            className="mb-3",
+                            style={'lineHeight': '1.5', 'fontSize': '14px'}
+                        ),
                     
-                    html.Label("Gender", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='gender-dropdown',
-                        options=[{'label': gender, 'value': gender} 
-                                for gender in sorted(numeric_df['GENDER'].unique()) if pd.notna(gender)],
-                        multi=True,
-                        placeholder="Select genders...",
-                        className="mb-2"
-                    ),
+                        html.H5("Demographics", className="filter-label mt-3"),
                     
-                    html.Label("Region", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='region-dropdown',
-                        options=[{'label': demographic_mappings['REGION_DISPLAY'].get(region, region), 'value': region} 
-                                for region in sorted(numeric_df['REGION'].unique()) if pd.notna(region)],
-                        multi=True,
-                        placeholder="Select regions...",
-                        className="mb-2"
-                    ),
+                        html.Label("Age Group", className="filter-label mt-2"),
+                        dcc.Dropdown(
+                            id='age-group-dropdown',
+                            options=[{'label': age_group, 'value': age_group} 
+                                    for age_group in dataset.filter_values['AGE_GROUP']],
+                            multi=True,
+                            placeholder="Select age groups...",
+                            className="mb-2"
+                        ),
                     
-                    html.Label("Education", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='education-dropdown',
-                        options=[{'label': education, 'value': education} 
-                                for education in demographic_mappings['EDUCATION_ORDER'] 
-                                if education in numeric_df['EDUCATION'].unique()],
-                        multi=True,
-                        placeholder="Select education levels...",
-                        className="mb-2"
-                    ),
+                        html.Label("Gender", className="filter-label mt-2"),
+                        dcc.Dropdown(
+                            id='gender-dropdown',
+                            options=[{'label': gender, 'value': gender} 
+                                    for gender in dataset.filter_values['GENDER']],
+                            multi=True,
+                            placeholder="Select genders...",
+                            className="mb-2"
+                        ),
                     
-                    html.Label("Household Income", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='income-dropdown',
-                        options=[{'label': income, 'value': income} 
-                                for income in demographic_mappings['HHINCOME_ORDER'] 
-                                if income in numeric_df['HHINCOME'].unique()],
-                        multi=True,
-                        placeholder="Select income ranges...",
-                        className="mb-2"
-                    ),
+                        html.Label("Region", className="filter-label mt-2"),
+                        dcc.Dropdown(
+                            id='region-dropdown',
+                            options=[{'label': demographic_mappings['REGION_DISPLAY'].get(region, region), 'value': region} 
+                                    for region in dataset.filter_values['REGION']],
+                            multi=True,
+                            placeholder="Select regions...",
+                            className="mb-2"
+                        ),
                     
-                    html.Label("Ethnicity", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='ethnicity-dropdown',
-                        options=[{'label': ethnicity, 'value': ethnicity} 
-                                for ethnicity in sorted(numeric_df['ETHNICITYROLL23'].unique()) if pd.notna(ethnicity)],
-                        multi=True,
-                        placeholder="Select ethnicities...",
-                        className="mb-2"
-                    ),
+                        html.Label("Education", className="filter-label mt-2"),
+                        dcc.Dropdown(
+                            id='education-dropdown',
+                            options=[{'label': education, 'value': education} 
+                                    for education in demographic_mappings['EDUCATION_ORDER'] 
+                                    if education in dataset.filter_values['EDUCATION']],
+                            multi=True,
+                            placeholder="Select education levels...",
+                            className="mb-2"
+                        ),
                     
-                    html.Label("Marital Status", className="filter-label mt-2"),
-                    dcc.Dropdown(
-                        id='marital-dropdown',
-                        options=[{'label': status, 'value': status} 
-                                for status in sorted(numeric_df['PMARITALSTATUS'].unique()) if pd.notna(status)],
-                        multi=True,
-                        placeholder="Select marital statuses...",
-                        className="mb-3"
-                    ),
+                        html.Label("Household Income", className="filter-label mt-2"),
+                        dcc.Dropdown(
+                            id='income-dropdown',
+                            options=[{'label': income, 'value': income} 
+                                    for income in demographic_mappings['HHINCOME_ORDER'] 
+                                    if income in dataset.filter_values['HHINCOME']],
+                            multi=True,
+                            placeholder="Select income ranges...",
+                            className="mb-2"
+                        ),
                     
-                    html.Button(
-                        [html.I(className="bi bi-funnel me-2"), "Apply Filters"], 
-                        id='apply-button', 
-                        className="btn btn-primary apply-button mt-3 w-100"
-                    )
-                ])
-            ], className="filter-card")
-        ], width=3, className="mb-4"),
-        
-        # Right side for visualization
-        dbc.Col([
-            html.Div([
-                dbc.Row([
-                    dbc.Col([
-                        html.H4("Visualization Options", className="section-title"),
-                        html.Label("Chart Type", className="filter-label"),
+                        html.Label("Ethnicity", className="filter-label mt-2"),
                         dcc.Dropdown(
-                            id='chart-type-dropdown',
-                            options=[
-                                {'label': 'Bar Chart', 'value': 'bar'},
-                                {'label': 'Pie Chart', 'value': 'pie'},
-                                {'label': 'Donut Chart', 'value': 'donut'},
-                                {'label': 'Horizontal Bar Chart', 'value': 'hbar'},
-                                {'label': 'Stacked Bar Chart', 'value': 'stacked_bar'}
-                            ],
-                            value='bar',
-                            clearable=False
-                        )
-                    ], width=6),
+                            id='ethnicity-dropdown',
+                            options=[{'label': ethnicity, 'value': ethnicity} 
+                                    for ethnicity in dataset.filter_values['ETHNICITYROLL23']],
+                            multi=True,
+                            placeholder="Select ethnicities...",
+                            className="mb-2"
+                        ),
                     
-                    dbc.Col([
-                        html.H4("Secondary Filter", className="section-title"),
-                        html.Label("Group By", className="filter-label"),
+                        html.Label("Marital Status", className="filter-label mt-2"),
                         dcc.Dropdown(
-                            id='group-by-dropdown',
-                            options=[
-                                {'label': 'None', 'value': 'none'},
-                                {'label': 'Age Group', 'value': 'AGE_GROUP'},
-                                {'label': 'Gender', 'value': 'GENDER'},
-                                {'label': 'Region', 'value': 'REGION'},
-                                {'label': 'Education', 'value': 'EDUCATION'},
-                                {'label': 'Income', 'value': 'HHINCOME'},
-                                {'label': 'Ethnicity', 'value': 'ETHNICITYROLL23'},
-                                {'label': 'Marital Status', 'value': 'PMARITALSTATUS'}
-                            ],
-                            value='none',
-                            clearable=False
+                            id='marital-dropdown',
+                            options=[{'label': status, 'value': status} 
+                                    for status in dataset.filter_values['PMARITALSTATUS']],
+                            multi=True,
+                            placeholder="Select marital statuses...",
+                            className="mb-3"
+                        ),
+                    
+                        html.Button(
+                            [html.I(className="bi bi-funnel me-2"), "Apply Filters"], 
+                            id='apply-button', 
+                            className="btn btn-primary apply-button mt-3 w-100"
                         )
-                    ], width=6)
-                ], className="mb-4"),
-                
-                dbc.Row([
-                    dbc.Col([
-                        html.Div(id='question-text', className="question-box")
                     ])
-                ], className="mb-3"),
+                ], className="filter-card")
+            ], width=3, className="mb-4"),
+        
+            # Right side for visualization
+            dbc.Col([
+                html.Div([
+                    dbc.Row([
+                        dbc.Col([
+                            html.H4("Visualization Options", className="section-title"),
+                            html.Label("Chart Type", className="filter-label"),
+                            dcc.Dropdown(
+                                id='chart-type-dropdown',
+                                options=[
+                                    {'label': 'Bar Chart', 'value': 'bar'},
+                                    {'label': 'Pie Chart', 'value': 'pie'},
+                                    {'label': 'Donut Chart', 'value': 'donut'},
+                                    {'label': 'Horizontal Bar Chart', 'value': 'hbar'},
+                                    {'label': 'Stacked Bar Chart', 'value': 'stacked_bar'}
+                                ],
+                                value='bar',
+                                clearable=False
+                            )
+                        ], width=6),
+                    
+                        dbc.Col([
+                            html.H4("Secondary Filter", className="section-title"),
+                            html.Label("Group By", className="filter-label"),
+                            dcc.Dropdown(
+                                id='group-by-dropdown',
+                                options=[
+                                    {'label': 'None', 'value': 'none'},
+                                    {'label': 'Age Group', 'value': 'AGE_GROUP'},
+                                    {'label': 'Gender', 'value': 'GENDER'},
+                                    {'label': 'Region', 'value': 'REGION'},
+                                    {'label': 'Education', 'value': 'EDUCATION'},
+                                    {'label': 'Income', 'value': 'HHINCOME'},
+                                    {'label': 'Ethnicity', 'value': 'ETHNICITYROLL23'},
+                                    {'label': 'Marital Status', 'value': 'PMARITALSTATUS'}
+                                ],
+                                value='none',
+                                clearable=False
+                            )
+                        ], width=6)
+                    ], className="mb-4"),
                 
-                dbc.Row([
-                    dbc.Col([
-                        dcc.Graph(id='visualization-graph', style={'height': '50vh'}, className="shadow-sm")
-                    ])
-                ]),
+                    dbc.Row([
+                        dbc.Col([
+                            html.Div(id='question-text', className="question-box")
+                        ])
+                    ], className="mb-3"),
                 
-                # Text responses section
-                dbc.Row([
-                    dbc.Col([
-                        html.Div(id='text-responses-section', className="mt-4")
+                    dbc.Row([
+                        dbc.Col([
+                            dcc.Graph(id='visualization-graph', style={'height': '50vh'}, className="shadow-sm")
+                        ])
+                    ]),
+                
+                    # Text responses section
+                    dbc.Row([
+                        dbc.Col([
+                            # Word search over the Q8/Q9 text responses
+                            html.Div([
+                                dbc.Row([
+                                    dbc.Col([
+                                        dbc.InputGroup([
+                                            dbc.InputGroupText(html.I(className="bi bi-search")),
+                                            dbc.Input(id='text-search-input', type='search', debounce=True,
+                                                      placeholder="Search responses (e.g. stew, bread) and press Enter")
+                                        ])
+                                    ], md=8),
+                                    dbc.Col([
+                                        dbc.Switch(id='collapse-duplicates-switch', label="Collapse near-duplicate responses",
+                                                   value=False, className="mt-2")
+                                    ], md=4)
+                                ])
+                            ], id='text-search-container', className="mt-4", style={'display': 'none'}),
+                            html.Div(id='text-responses-section', className="mt-4"),
+                            # Question and filters behind the text responses shown,
+                            # used to load further pages of responses
+                            dcc.Store(id='text-responses-query')
+                        ])
                     ])
-                ])
-            ], className="dashboard-container")
-        ], width=9)
-    ])
-], fluid=True, className="px-4 py-3")
+                ], className="dashboard-container")
+            ], width=9)
+        ])
+    ], fluid=True, className="px-4 py-3")
+
+app.layout = serve_layout
 
 # Define callback to update the question text
 @app.callback(
     Output('question-text', 'children'),
     Input('question-dropdown', 'value')
 )
+@metrics.timed_callback('update_question_text')
 def update_question_text(question_id):
-    if question_id in question_mapping:
-        question_text = question_mapping[question_id]
-        
-        # Format the question display based on question ID
-        if question_id == 'Q1':
-            return html.Div([
-                html.H5("Question 1:", className="mb-2 fw-bold"),
-                html.P("Is a hot dog a sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("Yes"),
-                    html.Li("No"),
-                    html.Li("It depends"),
-                    html.Li("I refuse to answer")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q2':
-            return html.Div([
-                html.H5("Question 2:", className="mb-2 fw-bold"),
-                html.P("If the bottom of a hot dog bun rips, does it become a sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("Yes"),
-                    html.Li("No")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q3':
-            return html.Div([
-                html.H5("Question 3:", className="mb-2 fw-bold"),
-                html.P("What is the minimum number of ingredients required for something to be considered a sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("0 (bread is a sandwich by itself)"),
-                    html.Li("1 (e.g. buttered toast)"),
-                    html.Li("2 (e.g. PB&J)"),
-                    html.Li("3 or more")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q4':
-            return html.Div([
-                html.H5("Question 4:", className="mb-2 fw-bold"),
-                html.P("Is a taco more likely to be considered a sandwich in which of the following scenarios?", className="mb-3"),
-                html.Ul([
-                    html.Li("Hard shell"),
-                    html.Li("Soft shell"),
-                    html.Li("Only if the bottom cracks or rips"),
-                    html.Li("Under no conditions should a taco be considered a sandwich")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q5':
-            return html.Div([
-                html.H5("Question 5:", className="mb-2 fw-bold"),
-                html.P("What is the most important characteristic for something to be considered soup?", className="mb-3"),
-                html.Ul([
-                    html.Li("The broth"),
-                    html.Li("The consistency"),
-                    html.Li("The way it's served"),
-                    html.Li("The primary flavour profile"),
-                    html.Li("Something else")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q6':
-            return html.Div([
-                html.H5("Question 6:", className="mb-2 fw-bold"),
-                html.P("Is cereal with milk a type of soup?", className="mb-3"),
-                html.Ul([
-                    html.Li("Yes"),
-                    html.Li("No"),
-                    html.Li("It depends")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q7':
-            return html.Div([
-                html.H5("Question 7:", className="mb-2 fw-bold"),
-                html.P("How likely are you to order an open-faced sandwich compared to a regular sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("Much more"),
-                    html.Li("A little more"),
-                    html.Li("It makes no difference"),
-                    html.Li("A little less"),
-                    html.Li("Much less")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q8':
-            return html.Div([
-                html.H5("Question 8:", className="mb-2 fw-bold"),
-                html.P("Is curry a soup?", className="mb-3"),
-                html.Ul([
-                    html.Li("Yes"),
-                    html.Li("No"),
-                    html.Li("It depends")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q9':
-            return html.Div([
-                html.H5("Question 9:", className="mb-2 fw-bold"),
-                html.P("Is a pizza folded crust-to-crust a sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("Yes"),
-                    html.Li("No"),
-                    html.Li("It depends")
-                ], className="ms-4")
-            ])
-        elif question_id == 'Q10':
-            return html.Div([
-                html.H5("Question 10:", className="mb-2 fw-bold"),
-                html.P("How important is the chef's intent when determining if something is a sandwich?", className="mb-3"),
-                html.Ul([
-                    html.Li("0 - Not at all"),
-                    html.Li("1"),
-                    html.Li("2"),
-                    html.Li("3"),
-                    html.Li("4"),
-                    html.Li("5 - It's the only thing that matters")
-                ], className="ms-4")
-            ])
-        else:
-            return f"Question: {question_text}"
-    return "Select a question"
+    question = dataset_watcher.current.questions.get(question_id)
+    if question is None:
+        return "Select a question"
+    if not question.options:
+        return f"Question: {question.text}"
+    return html.Div([
+        html.H5(question.heading, className="mb-2 fw-bold"),
+        html.P(question.text, className="mb-3"),
+        html.Ul([html.Li(option) for option in question.options], className="ms-4")
+    ])
 
 # Define callback to update the text responses section
 @app.callback(
-    Output('text-responses-section', 'children'),
+    [Output('text-responses-section', 'children'),
+     Output('text-responses-query', 'data'),
+     Output('text-search-container', 'style')],
     [Input('apply-button', 'n_clicks'),
-     Input('question-dropdown', 'value')],
+     Input('question-dropdown', 'value'),
+     Input('text-search-input', 'value'),
+     Input('collapse-duplicates-switch', 'value')],
     [State('age-group-dropdown', 'value'),
      State('gender-dropdown', 'value'),
      State('region-dropdown', 'value'),
@@ -709,68 +513,78 @@ def update_question_text(question_id):
      State('ethnicity-dropdown', 'value'),
      State('marital-dropdown', 'value')]
 )
-def update_text_responses(n_clicks, question_id, age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses):
-    # Only show text responses for Q8 and Q9
-    if question_id not in ['Q8', 'Q9']:
+@metrics.timed_callback('update_text_responses')
+def update_text_responses(n_clicks, question_id, search, collapse_duplicates, age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses):
+    selections = build_filter_selections(
+        age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses)
+    collapse_duplicates = bool(collapse_duplicates)
+    dataset = dataset_watcher.current
+    search_style = {} if question_id in dataset.text_search_indexes else {'display': 'none'}
+    cache_key = ('text_responses', dataset.version, question_id, canonical_selections(selections),
+                 tuple(sorted(set(tokenize(search or '')))), collapse_duplicates)
+    section = result_cache.get_or_compute(
+        cache_key, lambda: render_text_responses(dataset, question_id, selections, search, collapse_duplicates))
+    query = {'question_id': question_id, 'selections': selections, 'search': search,
+             'collapse_duplicates': collapse_duplicates}
+    return section, query, search_style
+
+# Define callback to load another page of the text responses list
+@app.callback(
+    Output('text-responses-page', 'children'),
+    Input('text-responses-pagination', 'active_page'),
+    State('text-responses-query', 'data'),
+    prevent_initial_call=True
+)
+@metrics.timed_callback('update_text_responses_page')
+def update_text_responses_page(active_page, query):
+    if not query or not active_page:
+        return []
+    dataset = dataset_watcher.current
+    question_id = query['question_id']
+    rows = text_response_rows(dataset, question_id, query['selections'], query.get('search'),
+                              query.get('collapse_duplicates'))
+    return render_response_page(dataset, question_id, rows, active_page)
+
+# Build the text responses section for a question, filter selection,
+# optional word search and duplicate collapsing
+def render_text_responses(dataset, question_id, selections, search=None, collapse_duplicates=False):
+    # Only show text responses for the free-text questions (Q8 and Q9)
+    if question_id not in dataset.text_question_ids:
         return html.Div()
     
     # Get the text column for the selected question
     text_column = f"{question_id}_text"
     classification_column = f"{question_id}_classification"
-    emoji_column = f"{question_id}_emoji"
     
-    if text_column not in text_df.columns:
+    if text_column not in dataset.text_df.columns:
         return html.Div([
             html.H4("Text Responses", className="section-title mt-3"),
             html.P("No text responses available for this question.", className="text-muted")
         ])
     
-    # Start with the full dataset
-    filtered_df = text_df.copy()
-    
-    # Apply demographic filters if they are selected
-    if age_groups and len(age_groups) > 0:
-        # Create age groups in text_df
-        filtered_df['AGE_GROUP'] = pd.cut(
-            filtered_df['AGE'], 
-            bins=[0, 18, 24, 29, 34, 39, 44, 49, 54, 59, 64, 69, 74, 100],
-            labels=['Under 18', '18-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75+']
-        )
-        filtered_df = filtered_df[filtered_df['AGE_GROUP'].isin(age_groups)]
-    
-    if genders and len(genders) > 0:
-        filtered_df = filtered_df[filtered_df['GENDER'].isin(genders)]
+    stages = metrics.stages('update_text_responses')
     
-    if regions and len(regions) > 0:
-        filtered_df = filtered_df[filtered_df['REGION'].isin(regions)]
+    # Get the filtered rows that have a text response (matching the search)
+    rows = text_response_rows(dataset, question_id, selections, search, collapse_duplicates)
+    stages.lap('filter')
     
-    if educations and len(educations) > 0:
-        filtered_df = filtered_df[filtered_df['EDUCATION'].isin(educations)]
-    
-    if incomes and len(incomes) > 0:
-        filtered_df = filtered_df[filtered_df['HHINCOME'].isin(incomes)]
-    
-    if ethnicities and len(ethnicities) > 0:
-        filtered_df = filtered_df[filtered_df['ETHNICITYROLL23'].isin(ethnicities)]
-    
-    if marital_statuses and len(marital_statuses) > 0:
-        filtered_df = filtered_df[filtered_df['PMARITALSTATUS'].isin(marital_statuses)]
-    
-    # Get text responses with classifications and emojis
-    responses_df = filtered_df[[text_column, classification_column, emoji_column]].dropna(subset=[text_column])
-    
-    if responses_df.empty:
+    if len(rows) == 0:
+        message = "No text responses available for the selected filters."
+        if tokenize(search or ''):
+            message = f"No text responses match \"{search}\" with the selected filters."
         return html.Div([
             html.H4("Text Responses", className="section-title mt-3"),
-            html.P("No text responses available for the selected filters.", className="text-muted")
+            html.P(message, className="text-muted")
         ])
     
-    # Create a summary of Yes/No responses
-    yes_count = sum(responses_df[classification_column] == "Yes")
-    no_count = sum(responses_df[classification_column] == "No")
-    depends_count = sum(responses_df[classification_column] == "It depends")
-    ambiguous_count = sum(responses_df[classification_column] == "Ambiguous")
-    other_count = len(responses_df) - yes_count - no_count - depends_count - ambiguous_count
+    # Create a summary of Yes/No responses over all filtered responses
+    classifications = dataset.text_df[classification_column].take(rows)
+    yes_count = (classifications == "Yes").sum()
+    no_count = (classifications == "No").sum()
+    depends_count = (classifications == "It depends").sum()
+    ambiguous_count = (classifications == "Ambiguous").sum()
+    other_count = len(rows) - yes_count - no_count - depends_count - ambiguous_count
+    stages.lap('summary')
     
     # Create a summary table with improved styling
     summary_table = html.Div([
@@ -784,42 +598,102 @@ def update_text_responses(n_clicks, question_id, age_groups, genders, regions, e
             html.Div([
                 html.Div([html.Span("Yes "), html.Span("✅", style={'fontSize': '1.2em'})], style={'flex': '40%'}),
                 html.Div(yes_count, style={'flex': '30%', 'textAlign': 'center'}),
-                html.Div(f"{yes_count / len(responses_df) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
+                html.Div(f"{yes_count / len(rows) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
             ], className="d-flex p-2", style={'backgroundColor': '#e6ffe6'}),
             
             html.Div([
                 html.Div([html.Span("No "), html.Span("❌", style={'fontSize': '1.2em'})], style={'flex': '40%'}),
                 html.Div(no_count, style={'flex': '30%', 'textAlign': 'center'}),
-                html.Div(f"{no_count / len(responses_df) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
+                html.Div(f"{no_count / len(rows) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
             ], className="d-flex p-2", style={'backgroundColor': '#ffe6e6'}),
             
             html.Div([
                 html.Div([html.Span("It depends "), html.Span("🤔", style={'fontSize': '1.2em'})], style={'flex': '40%'}),
                 html.Div(depends_count, style={'flex': '30%', 'textAlign': 'center'}),
-                html.Div(f"{depends_count / len(responses_df) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
+                html.Div(f"{depends_count / len(rows) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
             ], className="d-flex p-2", style={'backgroundColor': '#fff9e6'}),
             
             html.Div([
                 html.Div([html.Span("Ambiguous "), html.Span("❓", style={'fontSize': '1.2em'})], style={'flex': '40%'}),
                 html.Div(ambiguous_count, style={'flex': '30%', 'textAlign': 'center'}),
-                html.Div(f"{ambiguous_count / len(responses_df) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
+                html.Div(f"{ambiguous_count / len(rows) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
             ], className="d-flex p-2", style={'backgroundColor': '#f2f2f2'}),
             
             html.Div([
                 html.Div([html.Span("Other "), html.Span("⚪", style={'fontSize': '1.2em'})], style={'flex': '40%'}),
                 html.Div(other_count, style={'flex': '30%', 'textAlign': 'center'}),
-                html.Div(f"{other_count / len(responses_df) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
+                html.Div(f"{other_count / len(rows) * 100:.1f}%", style={'flex': '30%', 'textAlign': 'center'})
             ], className="d-flex p-2", style={'backgroundColor': '#f9f9f9', 'borderRadius': '0 0 6px 6px'})
         ], className="mb-4", style={'border': '1px solid #ddd', 'borderRadius': '6px', 'overflow': 'hidden'})
     ])
     
+    # Most frequent words and phrases among the same responses
+    top_terms = dataset.text_term_matrices[question_id].top_terms(rows, TOP_TERMS_COUNT)
+    stages.lap('terms')
+    top_terms_panel = html.Div([
+        html.Div([
+            html.Div("Top Terms", className="fw-bold", style={'flex': '70%', 'textAlign': 'left'}),
+            html.Div("Mentions", className="fw-bold", style={'flex': '30%', 'textAlign': 'center'})
+        ], className="d-flex p-2", style={'backgroundColor': '#f2f2f2', 'borderRadius': '6px 6px 0 0'})
+    ] + [
+        html.Div([
+            html.Div(term, style={'flex': '70%'}),
+            html.Div(count, style={'flex': '30%', 'textAlign': 'center'})
+        ], className="d-flex p-2", style={'borderTop': '1px solid #eee'})
+        for term, count in top_terms
+    ], className="mb-4", style={'border': '1px solid #ddd', 'borderRadius': '6px', 'overflow': 'hidden'})
+    
+    # Only the first page of responses is sent with the section; the
+    # pagination loads the others on demand
+    page_count = -(-len(rows) // RESPONSES_PAGE_SIZE)
+    pagination = []
+    if page_count > 1:
+        pagination = [dbc.Pagination(id='text-responses-pagination', max_value=page_count, active_page=1,
+                                     fully_expanded=False, first_last=True, previous_next=True,
+                                     size="sm", className="mt-3 justify-content-center")]
+    
+    # Tell how many responses the duplicate switch folded away
+    collapsed_note = []
+    if collapse_duplicates:
+        collapsed = len(text_response_rows(dataset, question_id, selections, search)) - len(rows)
+        collapsed_note = [html.P(f"{collapsed} near-duplicate responses collapsed into their first occurrence.",
+                                 className="text-muted small")]
+    
+    first_page = render_response_page(dataset, question_id, rows, 1)
+    stages.lap('render')
+    
+    # Show the responses in a scrollable container with improved styling
+    return html.Div([
+        html.Div([
+            html.H4("AI Analysis of Text Responses", className="section-title mt-3 mb-4"),
+            html.Div([
+                html.H5("Summary", className="filter-label mb-3"),
+                dbc.Row([
+                    dbc.Col(summary_table, md=7),
+                    dbc.Col(top_terms_panel, md=5)
+                ]),
+                html.H5(f"Individual Responses ({len(rows)})", className="filter-label mb-3")
+            ] + collapsed_note + [
+                html.Div([
+                    html.Div(first_page, id='text-responses-page')
+                ], style={'maxHeight': '500px', 'overflowY': 'auto', 'padding': '10px', 'backgroundColor': '#f8f9fa', 'borderRadius': '6px'})
+            ] + pagination)
+        ], className="dashboard-container")
+    ])
+
+# Build the response cards for one page (1-based) of the filtered rows
+def render_response_page(dataset, question_id, rows, page):
+    text_column = f"{question_id}_text"
+    classification_column = f"{question_id}_classification"
+    emoji_column = f"{question_id}_emoji"
+    
+    start = (page - 1) * RESPONSES_PAGE_SIZE
+    page_df = gather_text_rows(dataset, rows[start:start + RESPONSES_PAGE_SIZE],
+                               [text_column, classification_column, emoji_column])
+    
     # Create a list of text responses with classification badges
     list_items = []
-    for _, row in responses_df.iterrows():
-        response = row[text_column]
-        classification = row[classification_column]
-        emoji = row[emoji_column]
-        
+    for response, classification, emoji in zip(page_df[text_column], page_df[classification_column], page_df[emoji_column]):
         # Choose badge color based on classification
         badge_color = {
             'Yes': 'success',
@@ -839,21 +713,7 @@ def update_text_responses(n_clicks, question_id, age_groups, genders, regions, e
                 ], className="p-3")
             ], className="response-card mb-2", style={'backgroundColor': 'white', 'border': '1px solid #eee'})
         )
-    
-    # Show all responses in a scrollable container with improved styling
-    return html.Div([
-        html.Div([
-            html.H4("AI Analysis of Text Responses", className="section-title mt-3 mb-4"),
-            html.Div([
-                html.H5("Summary", className="filter-label mb-3"),
-                summary_table,
-                html.H5(f"Individual Responses ({len(list_items)})", className="filter-label mb-3"),
-                html.Div([
-                    html.Div(list_items)
-                ], style={'maxHeight': '500px', 'overflowY': 'auto', 'padding': '10px', 'backgroundColor': '#f8f9fa', 'borderRadius': '6px'})
-            ])
-        ], className="dashboard-container")
-    ])
+    return list_items
 
 # Define callback to update the visualization
 @app.callback(
@@ -870,73 +730,52 @@ def update_text_responses(n_clicks, question_id, age_groups, genders, regions, e
     State('chart-type-dropdown', 'value'),
     State('group-by-dropdown', 'value')
 )
+@metrics.timed_callback('update_visualization')
 def update_visualization(n_clicks, question_id, age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses, chart_type, group_by):
-    # Start with the full dataset
-    filtered_df = numeric_df.copy()
-    
-    # Apply demographic filters if they are selected
-    if age_groups and len(age_groups) > 0:
-        filtered_df = filtered_df[filtered_df['AGE_GROUP'].isin(age_groups)]
-    
-    if genders and len(genders) > 0:
-        filtered_df = filtered_df[filtered_df['GENDER'].isin(genders)]
-    
-    if regions and len(regions) > 0:
-        # For numeric_df, we need to map region codes to region names for filtering
-        filtered_df = filtered_df[filtered_df['REGION'].isin(regions)]
-    
-    if educations and len(educations) > 0:
-        filtered_df = filtered_df[filtered_df['EDUCATION'].isin(educations)]
-    
-    if incomes and len(incomes) > 0:
-        filtered_df = filtered_df[filtered_df['HHINCOME'].isin(incomes)]
-    
-    if ethnicities and len(ethnicities) > 0:
-        filtered_df = filtered_df[filtered_df['ETHNICITYROLL23'].isin(ethnicities)]
+    selections = build_filter_selections(
+        age_groups, genders, regions, educations, incomes, ethnicities, marital_statuses)
+    dataset = dataset_watcher.current
+    cache_key = ('visualization', dataset.version, question_id, canonical_selections(selections), chart_type,
+                 group_by)
+
+    def compute():
+        fig = render_visualization(dataset, question_id, selections, chart_type, group_by)
+        with metrics.time('survey_callback_stage_seconds', callback='update_visualization', stage='serialize'):
+            return figure_json(fig)
+    return result_cache.get_or_compute(cache_key, compute)
+
+# Figures are cached in the JSON form Dash sends to the browser. Unlike a
+# pickled go.Figure, this survives the shared cache unchanged (pickling drops
+# empty layout objects such as facet annotation fonts).
+def figure_json(fig):
+    return json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+
+# Plotly Express makes a group for every category of a categorical column,
+# including categories the chart does not contain, so charts get plain values
+def chart_frame(df):
+    return df.astype({col: object for col in df.select_dtypes('category').columns})
+
+# Build the figure for a question, filter selection, chart type and grouping
+def render_visualization(dataset, question_id, selections, chart_type, group_by):
+    stages = metrics.stages('update_visualization')
     
-    if marital_statuses and len(marital_statuses) > 0:
-        filtered_df = filtered_df[filtered_df['PMARITALSTATUS'].isin(marital_statuses)]
+    # Only the demographic used for grouping is needed from the count cube
+    group_columns = [group_by] if group_by != 'none' else []
     
-    # For Q8 and Q9, use the AI classification results
-    if question_id in ['Q8', 'Q9']:
-        # Get the filtered text data with classifications
-        filtered_text_df = text_df.copy()
-        
-        # Apply the same demographic filters
-        if age_groups and len(age_groups) > 0:
-            filtered_text_df['AGE_GROUP'] = pd.cut(
-                filtered_text_df['AGE'], 
-                bins=[0, 18, 24, 29, 34, 39, 44, 49, 54, 59, 64, 69, 74, 100],
-                labels=['Under 18', '18-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75+']
-            )
-            filtered_text_df = filtered_text_df[filtered_text_df['AGE_GROUP'].isin(age_groups)]
-        
-        if genders and len(genders) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['GENDER'].isin(genders)]
-        
-        if regions and len(regions) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['REGION'].isin(regions)]
-        
-        if educations and len(educations) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['EDUCATION'].isin(educations)]
-        
-        if incomes and len(incomes) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['HHINCOME'].isin(incomes)]
-        
-        if ethnicities and len(ethnicities) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['ETHNICITYROLL23'].isin(ethnicities)]
-        
-        if marital_statuses and len(marital_statuses) > 0:
-            filtered_text_df = filtered_text_df[filtered_text_df['PMARITALSTATUS'].isin(marital_statuses)]
-        
+    # For the free-text questions (Q8 and Q9), use the AI classification results
+    if question_id in dataset.text_question_ids:
         classification_column = f"{question_id}_classification"
         
-        if classification_column in filtered_text_df.columns:
+        if question_id in dataset.text_cubes:
+            # Get the classification counts for the filtered respondents
+            counts_df = select_counts(dataset, dataset.text_cubes, question_id, selections, group_columns)
+            
             # Filter out rows with None or NaN classifications
-            filtered_text_df = filtered_text_df.dropna(subset=[classification_column])
+            counts_df = counts_df.dropna(subset=[classification_column])
+            stages.lap('filter')
             
             # If there's no data after filtering, show an empty chart with a message
-            if filtered_text_df.empty:
+            if counts_df.empty:
                 return go.Figure().update_layout(
                     title=f"No data available for {question_id} with the selected filters",
                     xaxis_title="No data available",
@@ -949,44 +788,14 @@ def update_visualization(n_clicks, question_id, age_groups, genders, regions, ed
                 )
             
             if group_by != 'none':
-                # Group by classification and the selected demographic
-                if group_by == 'AGE_GROUP':
-                    # Create age groups if not already created
-                    if 'AGE_GROUP' not in filtered_text_df.columns:
-                        filtered_text_df['AGE_GROUP'] = pd.cut(
-                            filtered_text_df['AGE'], 
-                            bins=[0, 18, 24, 29, 34, 39, 44, 49, 54, 59, 64, 69, 74, 100],
-                            labels=['Under 18', '18-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54', '55-59', '60-64', '65-69', '70-74', '75+']
-                        )
-                    # For age group, use the ordered list from demographic_mappings
-                    grouped_data = filtered_text_df.groupby([classification_column, group_by], observed=True).size().reset_index(name='count')
-                    # Create a categorical type with the ordered age groups
-                    age_order = pd.CategoricalDtype(categories=demographic_mappings['AGE_GROUP_ORDER'], ordered=True)
-                    grouped_data[group_by] = pd.Categorical(grouped_data[group_by], categories=age_order.categories, ordered=True)
-                    # Sort by the age order
-                    grouped_data = grouped_data.sort_values(group_by)
-                elif group_by == 'EDUCATION':
-                    # For education, use the ordered list from demographic_mappings
-                    grouped_data = filtered_text_df.groupby([classification_column, group_by], observed=True).size().reset_index(name='count')
-                    # Create a categorical type with the ordered education levels
-                    education_order = pd.CategoricalDtype(categories=demographic_mappings['EDUCATION_ORDER'], ordered=True)
-                    grouped_data[group_by] = pd.Categorical(grouped_data[group_by], categories=education_order.categories, ordered=True)
-                    # Sort by the education order
-                    grouped_data = grouped_data.sort_values(group_by)
-                elif group_by == 'HHINCOME':
-                    # For income, use the ordered list from demographic_mappings
-                    grouped_data = filtered_text_df.groupby([classification_column, group_by], observed=True).size().reset_index(name='count')
-                    # Create a categorical type with the ordered income levels
-                    income_order = pd.CategoricalDtype(categories=demographic_mappings['HHINCOME_ORDER'], ordered=True)
-                    grouped_data[group_by] = pd.Categorical(grouped_data[group_by], categories=income_order.categories, ordered=True)
-                    # Sort by the income order
-                    grouped_data = grouped_data.sort_values(group_by)
-                else:
-                    # For other demographics, group by the values directly
-                    grouped_data = filtered_text_df.groupby([classification_column, group_by], observed=True).size().reset_index(name='count')
-                    # Use the display labels for regions if needed
-                    if group_by == 'REGION':
-                        grouped_data[group_by] = grouped_data[group_by].map(lambda x: demographic_mappings['REGION_DISPLAY'].get(x, x))
+                # Group by the selected demographic and classification. Both are
+                # ordered categoricals, so groups come out in the survey's order.
+                grouped_data = chart_frame(
+                    cube_group_sizes(counts_df, [group_by, classification_column]).reset_index(name='count'))
+                # Use the display labels for regions if needed
+                if group_by == 'REGION':
+                    grouped_data[group_by] = remap_labels(grouped_data[group_by], demographic_mappings['REGION_DISPLAY'])
+                stages.lap('group')
                 
                 # Create the visualization based on chart type
                 if chart_type == 'bar':
@@ -1006,14 +815,13 @@ def update_visualization(n_clicks, question_id, age_groups, genders, regions, ed
                         fig.update_traces(hole=0.4)
             else:
                 # No grouping, just count by classification
-                classification_counts = filtered_text_df[classification_column].value_counts().reset_index()
+                classification_counts = chart_frame(cube_value_counts(counts_df, classification_column).reset_index())
                 classification_counts.columns = [classification_column, 'count']
                 
                 # Add emojis to the classification labels
                 emoji_map = {'Yes': '✅ Yes', 'No': '❌ No', 'It depends': '🤔 It depends', 'Ambiguous': '❓ Ambiguous'}
-                classification_counts[classification_column] = classification_counts[classification_column].map(
-                    lambda x: emoji_map.get(x, x)
-                )
+                classification_counts[classification_column] = remap_labels(classification_counts[classification_column], emoji_map)
+                stages.lap('group')
                 
                 if chart_type == 'bar':
                     fig = px.bar(classification_counts, x=classification_column, y='count',
@@ -1039,83 +847,41 @@ def update_visualization(n_clicks, question_id, age_groups, genders, regions, ed
                 plot_bgcolor='rgba(0,0,0,0.05)',
                 paper_bgcolor='rgba(0,0,0,0)'
             )
+            stages.lap('figure')
             
             return fig
     
     # For other questions, use the original visualization logic
     # Check if the question exists in the dataset
-    if question_id not in filtered_df.columns:
+    if question_id not in dataset.numeric_cubes:
         return go.Figure().update_layout(
             title=f"Question {question_id} data not found",
             xaxis_title="No data available",
             yaxis_title="Count"
         )
     
-    # Create a mapping for answer values if needed
-    answer_mapping = {}
+    # Labels of the answer codes, from the question registry
+    answer_mapping = dataset.questions.get(question_id).answers
     
-    # For Q1 (Is a hot dog a sandwich?)
-    if question_id == 'Q1':
-        answer_mapping = {1: 'Yes', 2: 'No', 3: 'It depends', 4: 'I refuse to answer'}
-    # For Q2 (If the bottom of a hot dog bun rips...)
-    elif question_id == 'Q2':
-        answer_mapping = {1: 'Yes', 2: 'No'}
-    # For Q3 (Minimum number of ingredients...)
-    elif question_id == 'Q3':
-        answer_mapping = {1: '0 (bread is a sandwich by itself)', 2: '1 (e.g. buttered toast)', 
-                         3: '2 (e.g. PB&J)', 4: '3 or more'}
-    # For Q4 (Is a taco more likely to be considered a sandwich...)
-    elif question_id == 'Q4':
-        answer_mapping = {1: 'Hard shell', 2: 'Soft shell', 3: 'Only if the bottom cracks or rips', 
-                         4: 'Under no conditions should a taco be considered a sandwich'}
-    # For Q5 (Most important characteristic for soup...)
-    elif question_id == 'Q5':
-        answer_mapping = {1: 'The broth', 2: 'The consistency', 3: 'The way it\'s served', 
-                         4: 'The primary flavour profile', 5: 'Something else'}
-    # For Q6 (Is cereal with milk a type of soup?)
-    elif question_id == 'Q6':
-        answer_mapping = {1: 'Yes', 2: 'No', 3: 'It depends'}
-    # For Q7 (Open-faced sandwich ordering likelihood...)
-    elif question_id == 'Q7':
-        answer_mapping = {1: 'Much more', 2: 'A little more', 3: 'It makes no difference', 
-                         4: 'A little less', 5: 'Much less'}
-    # For Q10 (Chef's intent importance...)
-    elif question_id == 'Q10':
-        answer_mapping = {1: '0 - Not at all', 2: '1', 3: '2', 4: '3', 5: '4', 6: '5 - It\'s the only thing that matters'}
+    # Get the answer counts for the filtered respondents
+    counts_df = select_counts(dataset, dataset.numeric_cubes, question_id, selections, group_columns)
+    stages.lap('filter')
     
     # Map the answer values to their text representations if available
     if answer_mapping:
-        filtered_df['answer_text'] = filtered_df[question_id].map(answer_mapping)
+        counts_df = counts_df.assign(answer_text=counts_df[question_id].map(answer_mapping))
     else:
-        filtered_df['answer_text'] = filtered_df[question_id].astype(str)
+        counts_df = counts_df.assign(answer_text=counts_df[question_id].astype(str))
     
     if group_by != 'none':
-        # Group by answer and the selected demographic
-        if group_by == 'AGE_GROUP':
-            # For age group, we already have the labels
-            grouped_data = filtered_df.groupby(['answer_text', group_by], observed=True).size().reset_index(name='count')
-        elif group_by == 'EDUCATION':
-            # For education, use the ordered list from demographic_mappings
-            grouped_data = filtered_df.groupby(['answer_text', group_by], observed=True).size().reset_index(name='count')
-            # Create a categorical type with the ordered education levels
-            education_order = pd.CategoricalDtype(categories=demographic_mappings['EDUCATION_ORDER'], ordered=True)
-            grouped_data[group_by] = pd.Categorical(grouped_data[group_by], categories=education_order.categories, ordered=True)
-            # Sort by the education order
-            grouped_data = grouped_data.sort_values(group_by)
-        elif group_by == 'HHINCOME':
-            # For income, use the ordered list from demographic_mappings
-            grouped_data = filtered_df.groupby(['answer_text', group_by], observed=True).size().reset_index(name='count')
-            # Create a categorical type with the ordered income levels
-            income_order = pd.CategoricalDtype(categories=demographic_mappings['HHINCOME_ORDER'], ordered=True)
-            grouped_data[group_by] = pd.Categorical(grouped_data[group_by], categories=income_order.categories, ordered=True)
-            # Sort by the income order
-            grouped_data = grouped_data.sort_values(group_by)
-        else:
-            # For other demographics, map the codes to labels
-            grouped_data = filtered_df.groupby(['answer_text', group_by], observed=True).size().reset_index(name='count')
-            # Map the demographic codes to their display labels
-            if group_by in demographic_mappings:
-                grouped_data[group_by] = grouped_data[group_by].map(lambda x: demographic_mappings[group_by].get(x, x))
+        # Group by the selected demographic and answer. Both are ordered
+        # categoricals, so groups come out in the survey's order.
+        grouped_data = chart_frame(
+            cube_group_sizes(counts_df, [group_by, 'answer_text']).reset_index(name='count'))
+        # Map the demographic codes to their display labels
+        if group_by in demographic_mappings:
+            grouped_data[group_by] = remap_labels(grouped_data[group_by], demographic_mappings[group_by])
+        stages.lap('group')
         
         # Create the visualization based on chart type
         if chart_type == 'bar':
@@ -1135,8 +901,9 @@ def update_visualization(n_clicks, question_id, age_groups, genders, regions, ed
                 fig.update_traces(hole=0.4)
     else:
         # No grouping, just count by answer
-        answer_counts = filtered_df['answer_text'].value_counts().reset_index()
+        answer_counts = chart_frame(cube_value_counts(counts_df, 'answer_text').reset_index())
         answer_counts.columns = ['answer_text', 'count']
+        stages.lap('group')
         
         if chart_type == 'bar':
             fig = px.bar(answer_counts, x='answer_text', y='count',
@@ -1162,26 +929,62 @@ def update_visualization(n_clicks, question_id, age_groups, genders, regions, ed
         plot_bgcolor='rgba(0,0,0,0.05)',
         paper_bgcolor='rgba(0,0,0,0)'
     )
+    stages.lap('figure')
     
     return fig
 
+# With gunicorn's preload (see gunicorn.conf.py) the dataset is built once in
+# the master process; its arrays then move to read-only shared memory, which
+# the forked workers map instead of each holding a private copy. One chart is
+# rendered first so plotly's lazily loaded validators and templates are
+# shared too, and gc.freeze() keeps the workers' garbage collector from
+# writing to the objects built here.
+def prepare_for_workers(dataset):
+    shared_store = share_dataset(dataset)
+    print(f"Shared {shared_store.shared_bytes / 2 ** 20:.1f} MiB of survey data "
+          f"in {shared_store.shared_arrays} arrays")
+    figure_json(render_visualization(dataset, dataset.questions.ids()[0], build_filter_selections(*[None] * 7), 'bar', 'none'))
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+if SHARE_ARRAYS:
+    prepare_for_workers(dataset_watcher.current)
+
+# Called by gunicorn's master once it is ready (see gunicorn.conf.py): a
+# reloader forked from the master watches the survey files for all workers
+# and sends the master a HUP with each new dataset. `after_fork` runs in the
+# reloader.
+def watch_in_master(after_fork=None):
+    dataset_watcher.run_in_master(after_fork)
+
+# Called by gunicorn's master on a HUP, before it replaces the workers: the
+# dataset the reloader built is mapped and shared once here, so the new
+# workers fork from it
+def reload_in_master():
+    dataset = dataset_watcher.take_reloaded()
+    if dataset is not None and SHARE_ARRAYS:
+        prepare_for_workers(dataset)
+
 # Run the app
 if __name__ == '__main__':
+    dataset = dataset_watcher.current
+    
     # Debug information
     print("=== Numeric DataFrame Columns ===")
-    print(numeric_df.columns.tolist())
+    print(dataset.numeric_df.columns.tolist())
     print("\n=== Text DataFrame Columns ===")
-    print(text_df.columns.tolist())
+    print(dataset.text_df.columns.tolist())
     
     print("\n=== Numeric DataFrame Data Types ===")
-    print(numeric_df.dtypes)
+    print(dataset.numeric_df.dtypes)
     print("\n=== Text DataFrame Data Types ===")
-    print(text_df.dtypes)
+    print(dataset.text_df.dtypes)
     
     print("\n=== Sample of Numeric DataFrame ===")
-    print(numeric_df[['AGE_GROUP', 'GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']].head())
+    print(dataset.numeric_df[['AGE_GROUP', 'GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']].head())
     
     print("\n=== Sample of Text DataFrame ===")
-    print(text_df[['GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']].head())
+    print(dataset.text_df[['GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']].head())
     
     app.run_server(debug=True) 
\ No newline at end of file
@@ -1,11 +1,15 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import os
+
+# The compiled dataset (python survey_snapshot.py), bundled when it was built
+SNAPSHOT_DATAS = [('survey.snapshot', '.')] if os.path.exists('survey.snapshot') else []
 
 a = Analysis(
     ['app.py'],
     pathex=[],
     binaries=[],
-    datas=[('Questions.xlsx', '.'), ('Chat Data Numeric.xlsx', '.'), ('Chat Data Text.xlsx', '.')],
+    datas=[('Questions.xlsx', '.'), ('questions.json', '.'), ('Chat Data Numeric.xlsx', '.'), ('Chat Data Text.xlsx', '.')] + SNAPSHOT_DATAS,
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
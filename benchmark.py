@@ -0,0 +1,266 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import plotly
+from survey_data import read_excel_cached
+from survey_dataset import QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE, FILTER_COLUMNS, build_dataset
+from synthetic_survey import SurveyProfile, generate_frames, write_workbooks
+from result_cache import LRUCache
+
+# Respondent counts benchmarked by default (pass --rows 10000000 for the
+# largest exports; that needs several GB of memory)
+DEFAULT_ROWS = [100000, 1000000]
+
+# Above this size the workbooks are not written and read back: openpyxl
+# needs minutes per million rows, and the parsed copy is what later starts use
+MAX_EXCEL_ROWS = 50000
+
+CHART_TYPES = ['bar', 'pie', 'donut', 'hbar', 'stacked_bar']
+GROUP_BYS = ['none'] + FILTER_COLUMNS
+
+# Filter selections every callback is timed with
+FILTER_SCENARIOS = {
+    'unfiltered': {},
+    'filtered': {'AGE_GROUP': ['25-29', '30-34', '35-39'], 'GENDER': ['Female'],
+                 'EDUCATION': ["Bachelor's Degree", "Graduate Degree (Master's/PhD)"]},
+}
+
+# Word searched for in the text responses benchmark
+SEARCH_TERM = 'soup'
+
+# Shares of the respondents the top terms panel is timed over, and the time
+# it should answer in whatever the share
+TOP_TERMS_SHARES = [0.01, 0.1, 0.3, 0.5, 0.7, 0.9]
+TOP_TERMS_REPEATS = 5
+TOP_TERMS_TARGET_MS = 50
+
+
+# Summary of a list of durations in seconds, reported in milliseconds
+def summarize(samples):
+    if not samples:
+        return {'calls': 0}
+    values = np.asarray(samples) * 1000
+    return {
+        'calls': len(values),
+        'total_ms': round(float(values.sum()), 3),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+
+# Call `func` and return (result, seconds taken)
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Seconds Dash spends turning a callback result into the response body
+def serialize_time(result):
+    start = time.perf_counter()
+    json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder)
+    return time.perf_counter() - start
+
+
+def filter_values(selections):
+    return [selections.get(col) for col in FILTER_COLUMNS]
+
+
+# Time the callbacks of `app` against its current dataset. Every call is made
+# twice: the first runs against an empty result cache (cold), the second is
+# served from it (warm).
+def benchmark_callbacks(app):
+    results = {}
+    dataset = app.dataset_watcher.current
+
+    cold, warm, serialize = [], [], []
+    by_chart_type = {chart_type: [] for chart_type in CHART_TYPES}
+    by_group_by = {group_by: [] for group_by in GROUP_BYS}
+    for selections in FILTER_SCENARIOS.values():
+        for question_id in dataset.questions.ids():
+            for chart_type in CHART_TYPES:
+                for group_by in GROUP_BYS:
+                    args = (1, question_id, *filter_values(selections), chart_type, group_by)
+                    figure, seconds = timed_call(app.update_visualization, *args)
+                    cold.append(seconds)
+                    by_chart_type[chart_type].append(seconds)
+                    by_group_by[group_by].append(seconds)
+                    warm.append(timed_call(app.update_visualization, *args)[1])
+                    serialize.append(serialize_time(figure))
+    results['update_visualization'] = {
+        'cold': summarize(cold),
+        'warm': summarize(warm),
+        'serialize': summarize(serialize),
+        'cold_by_chart_type': {key: summarize(value) for key, value in by_chart_type.items()},
+        'cold_by_group_by': {key: summarize(value) for key, value in by_group_by.items()},
+    }
+
+    cold, warm, serialize, pages = [], [], [], []
+    for selections in FILTER_SCENARIOS.values():
+        for question_id in dataset.text_question_ids:
+            for search in [None, SEARCH_TERM]:
+                for collapse in [False, True]:
+                    args = (1, question_id, search, collapse, *filter_values(selections))
+                    (section, query, _), seconds = timed_call(app.update_text_responses, *args)
+                    cold.append(seconds)
+                    warm.append(timed_call(app.update_text_responses, *args)[1])
+                    serialize.append(serialize_time(section))
+                    pages.append(timed_call(app.update_text_responses_page, 2, query)[1])
+    results['update_text_responses'] = {
+        'cold': summarize(cold),
+        'warm': summarize(warm),
+        'serialize': summarize(serialize),
+    }
+    results['update_text_responses_page'] = {'cold': summarize(pages)}
+
+    results['update_question_text'] = {
+        'cold': summarize([timed_call(app.update_question_text, question_id)[1]
+                           for question_id in dataset.questions.ids()])
+    }
+    return results
+
+
+# Time the top terms of each text question over random selections of
+# respondents, and whether the slowest call kept within TOP_TERMS_TARGET_MS
+def benchmark_top_terms(app, seed):
+    rng = np.random.default_rng(seed)
+    results = {}
+    for question_id, matrix in app.dataset_watcher.current.text_term_matrices.items():
+        by_share = {}
+        for share in TOP_TERMS_SHARES:
+            samples = []
+            for _ in range(TOP_TERMS_REPEATS):
+                rows = np.flatnonzero(rng.random(len(matrix.doc_codes)) < share)
+                samples.append(timed_call(matrix.top_terms, rows, app.TOP_TERMS_COUNT)[1])
+            by_share[f"{share:.0%}"] = summarize(samples)
+        slowest = max(summary['max_ms'] for summary in by_share.values())
+        results[question_id] = {'by_share': by_share, 'target_ms': TOP_TERMS_TARGET_MS,
+                                'within_target': slowest <= TOP_TERMS_TARGET_MS}
+        if slowest > TOP_TERMS_TARGET_MS:
+            print(f"Top terms of {question_id} took up to {slowest:.1f} ms, over the {TOP_TERMS_TARGET_MS} ms target",
+                  file=sys.stderr)
+    return results
+
+
+# Generate `rows` respondents, time the load pipeline on them, then time the
+# callbacks with the synthetic dataset swapped into the app
+def benchmark_size(app, rows, profile, seed, work_dir):
+    report = {'rows': rows}
+    start = time.perf_counter()
+    questions_df, numeric_df, text_df = generate_frames(rows, seed, profile)
+    report['generate_s'] = round(time.perf_counter() - start, 3)
+
+    load = {}
+    cache_dir = os.path.join(work_dir, f"cache-{rows}")
+    if rows <= MAX_EXCEL_ROWS:
+        data_dir = os.path.join(work_dir, f"data-{rows}")
+        write_workbooks(data_dir, questions_df, numeric_df, text_df)
+        for label in ['read_excel', 'read_cached']:
+            start = time.perf_counter()
+            frames = [read_excel_cached(os.path.join(data_dir, name), cache_dir)
+                      for name in [QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE]]
+            load[label] = time.perf_counter() - start
+        questions_df, numeric_df, text_df = frames
+
+    # The classification store and near-duplicate clusters start empty, so
+    # every stage does its full work
+    start = time.perf_counter()
+    dataset = build_dataset(questions_df, numeric_df, text_df, cache_dir=cache_dir, timings=load)
+    load['build_total'] = time.perf_counter() - start
+    report['load_s'] = {stage: round(seconds, 3) for stage, seconds in load.items()}
+    report['distinct_texts'] = {
+        question_id: int(text_df[f"{question_id}_text"].nunique()) for question_id in dataset.text_question_ids
+    }
+
+    app.dataset_watcher.swap(dataset)
+    app.result_cache = LRUCache(max_entries=100000, shared=None, namespace=f"benchmark-{rows}")
+    report['callbacks'] = benchmark_callbacks(app)
+    report['top_terms'] = benchmark_top_terms(app, seed)
+    return report
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+# Flatten a report into {"rows.path.to.value": number} for comparisons
+def flatten(report, prefix=''):
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+# Print the timings of two reports side by side, slowest changes first
+def compare_reports(old, new, min_ratio=1.1):
+    old_values = flatten(old['results'])
+    new_values = flatten(new['results'])
+    lines = []
+    for key in sorted(set(old_values) & set(new_values)):
+        if not (key.endswith('_ms') or '.load_s.' in key) or key.endswith('total_ms'):
+            continue
+        before, after = old_values[key], new_values[key]
+        ratio = after / before if before else float('inf') if after else 1.0
+        if ratio >= min_ratio or ratio <= 1 / min_ratio:
+            lines.append((ratio, key, before, after))
+    for ratio, key, before, after in sorted(lines, reverse=True):
+        print(f"{ratio:7.2f}x  {key}: {before} -> {after}")
+    if not lines:
+        print(f"No timing changed by more than {min_ratio:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's load pipeline and callbacks "
+                                                 "on synthetic surveys")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="respondent counts to run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-report.json', help="where to write the JSON report")
+    parser.add_argument('--compare', metavar='REPORT', help="earlier report to compare the new one against")
+    args = parser.parse_args()
+
+    # Importing the app loads the real workbooks; the benchmark then swaps
+    # in each synthetic dataset
+    import app
+
+    profile = SurveyProfile.load()
+    report = {'environment': environment(), 'seed': args.seed, 'results': {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            print(f"Benchmarking {rows} respondents...", file=sys.stderr)
+            report['results'][str(rows)] = benchmark_size(app, rows, profile, args.seed, work_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
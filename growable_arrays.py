@@ -0,0 +1,52 @@
+import weakref
+import numpy as np
+
+# Room left at the end of a new buffer, as a fraction of what it holds
+GROWTH = 0.25
+
+# Smallest number of spare items a new buffer gets
+MIN_SPARE = 1024
+
+# Items handed out of each buffer append() allocated, by id() of the buffer
+_used = {}
+
+
+# `array` followed by `added`, without copying `array` when it can be
+# avoided.
+#
+# The result is a view of a buffer with spare room at its end. Appending to
+# that view again writes into the spare room, so a column grown batch by
+# batch costs the size of the batches rather than the size of the column
+# each time (buffers grow by GROWTH when full). Shorter views of the same
+# buffer, such as the columns of an older dataset version, stay valid:
+# nothing they cover is written. Only the longest view handed out of a
+# buffer grows in place; appending to any other array copies it into a new
+# buffer.
+#
+# The result keeps the dtype of `array`. Raises TypeError when `added` cannot
+# be cast to it safely: widening would rewrite the items already held (into
+# floats, or into ints for datetimes stored as objects), so callers convert
+# the new items first.
+def append(array, added):
+    added = np.asarray(added)
+    if len(added) and not np.can_cast(added.dtype, array.dtype):
+        raise TypeError(f"Cannot append {added.dtype} items to a {array.dtype} array")
+    size = len(array) + len(added)
+    buffer = array.base if extendable(array) else None
+    if buffer is None or len(buffer) < size:
+        buffer = np.empty(size + max(int(size * GROWTH), MIN_SPARE), dtype=array.dtype)
+        buffer[:len(array)] = array
+        weakref.finalize(buffer, _used.pop, id(buffer), None)
+    buffer[len(array):size] = added
+    _used[id(buffer)] = size
+    return buffer[:size]
+
+
+# Whether `array` is the longest view append() has handed out of its
+# buffer, so that it can grow (and its last items be rewritten) in place
+# without touching any other view
+def extendable(array):
+    buffer = array.base
+    return (isinstance(buffer, np.ndarray) and _used.get(id(buffer)) == len(array) and array.ndim == 1
+            and array.flags.c_contiguous and array.flags.writeable
+            and array.__array_interface__['data'][0] == buffer.__array_interface__['data'][0])
@@ -1,19 +1,26 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+import os
+
 block_cipher = None
 
+# The compiled dataset (python survey_snapshot.py), bundled when it was built
+SNAPSHOT_DATAS = [('survey.snapshot', '.')] if os.path.exists('survey.snapshot') else []
+
 a = Analysis(
     ['app_launcher.py'],
     pathex=[],
     binaries=[],
     datas=[
         ('Questions.xlsx', '.'),
+        ('questions.json', '.'),
         ('Chat Data Numeric.xlsx', '.'),
         ('Chat Data Text.xlsx', '.')
-    ],
+    ] + SNAPSHOT_DATAS,
     hiddenimports=[
         'pandas',
         'numpy',
+        'scipy.sparse',
         'plotly',
         'dash',
         'dash_bootstrap_components',
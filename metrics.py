@@ -0,0 +1,133 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond cache hits
+# to the slowest load stages
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# Cumulative histogram of observed durations for one label set
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Records timings of the callbacks and load stages and renders them in the
+# Prometheus text exposition format. Thread-safe, since Flask may run
+# callbacks concurrently. Each process keeps its own numbers; with several
+# gunicorn workers every worker reports the requests it served.
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._help = {}
+        self._gauge_sources = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+                if help_text:
+                    self._help.setdefault(name, help_text)
+            histogram.observe(seconds)
+
+    # Time the block into the `name` histogram
+    @contextmanager
+    def time(self, name, help_text='', **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help_text, **labels)
+
+    # Decorator timing every call of a callback
+    def timed_callback(self, callback_name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time('survey_callback_seconds', "Time spent in each Dash callback",
+                               callback=callback_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # A StageTimer for the stages of one callback call
+    def stages(self, callback_name):
+        return StageTimer(self, callback_name)
+
+    # Register a function returning [(name, help, labels dict, value), ...],
+    # evaluated at every scrape (cache statistics, dataset sizes)
+    def add_gauges(self, source):
+        self._gauge_sources.append(source)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                by_name.setdefault(name, []).append((labels, histogram))
+            for name, series in by_name.items():
+                lines.append(f"# HELP {name} {self._help.get(name, '')}".rstrip())
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+        gauges = {}
+        for source in self._gauge_sources:
+            for name, help_text, labels, value in source():
+                gauges.setdefault(name, [help_text, []])[1].append((tuple(sorted(labels.items())), value))
+        for name, (help_text, series) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}".rstrip())
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series:
+                lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+        return '\n'.join(lines) + '\n'
+
+
+# Splits one callback call into consecutive stages: each lap() records the
+# time since the previous lap (or since the timer was created) under a stage
+# name, in the survey_callback_stage_seconds histogram
+class StageTimer:
+    def __init__(self, registry, callback_name):
+        self.registry = registry
+        self.callback_name = callback_name
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.registry.observe('survey_callback_stage_seconds', now - self.last,
+                              "Time spent in each stage of the Dash callbacks",
+                              callback=self.callback_name, stage=stage)
+        self.last = now
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
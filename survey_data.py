@@ -0,0 +1,185 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# Folder holding the parsed copies of the Excel workbooks. The .xlsx files stay
+# the source of truth; this folder can be deleted at any time.
+CACHE_DIR = os.environ.get('SURVEY_CACHE_DIR', '.survey_cache')
+
+# Bump this whenever the layout of the cached files changes
+CACHE_FORMAT_VERSION = 1
+
+
+# Compute a SHA-256 digest of a file without loading it all into memory
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Write a file next to its final location first, then swap it in, so a crash
+# or a second process never sees a half-written cache file
+def atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Multiprocessing context for a process pool started from the calling
+# thread, or None when the work should stay in this process.
+#
+# Workers are forked where we can: they inherit the compiled matchers and,
+# unlike spawn, do not re-import the script that started the pool (app.py
+# loads the whole dataset at import). A fork copies every lock as it is at
+# that moment, though, so it is only safe while no other thread runs. From
+# the dataset watcher's thread, a threaded server or a gunicorn worker, a
+# lock held elsewhere would stay held in the children, so None is returned.
+def pool_context():
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    if threading.current_thread() is not threading.main_thread() or threading.active_count() > 1:
+        return None
+    return multiprocessing.get_context('fork')
+
+
+# Read an Excel workbook, reusing a binary copy of the parsed frame when the
+# workbook has not changed since the copy was written.
+#
+# The cache entry is trusted when the workbook's size and mtime match the
+# recorded ones. If only the mtime moved (file copied or touched), the content
+# hash decides whether the entry is still valid, so we only pay for openpyxl
+# when the data really changed.
+def read_excel_cached(path, cache_dir=None, **read_kwargs):
+    cache_dir = cache_dir or CACHE_DIR
+    stat = os.stat(path)
+    data_path, meta_path = _cache_paths(path, cache_dir)
+
+    meta = _read_meta(meta_path) if os.path.exists(data_path) else None
+
+    expected = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'pandas_version': pd.__version__,
+        'read_kwargs': repr(sorted(read_kwargs.items())),
+    }
+    digest = None
+    if meta is not None and all(meta.get(k) == v for k, v in expected.items()):
+        if meta.get('size') != stat.st_size or meta.get('mtime_ns') != stat.st_mtime_ns:
+            digest = file_digest(path)
+        if digest is None or digest == meta.get('sha256'):
+            try:
+                df = pd.read_pickle(data_path)
+            except Exception:
+                df = None
+            if df is not None:
+                if digest is not None:
+                    # Same content under a new mtime: refresh the stamp so the
+                    # next start takes the fast path again
+                    meta.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                    _write_meta(meta_path, meta)
+                return df
+
+    df = pd.read_excel(path, **read_kwargs)
+
+    meta = dict(expected, source=os.path.abspath(path), size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns, sha256=digest or file_digest(path))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(data_path, lambda p: df.to_pickle(p, protocol=5))
+        _write_meta(meta_path, meta)
+    except OSError:
+        # A read-only install (e.g. inside an app bundle) just runs uncached
+        pass
+    return df
+
+
+# Replace codes/labels with the labels in `mapping`, leaving values it does
+# not know unchanged. The mapping is looked up once per distinct value and
+# the result is spread over the rows by position, so large columns cost one
+# factorize and one take rather than a Python call per cell.
+def remap_labels(values, mapping):
+    codes, uniques = pd.factorize(values)
+    table = np.empty(len(uniques) + 1, dtype=object)
+    table[:-1] = [mapping.get(value, value) for value in uniques]
+    table[-1] = np.nan
+    return pd.Series(table[codes], index=values.index, name=values.name)
+
+
+# Store a column as an ordered categorical. Categories follow `order` where
+# given; values missing from it are kept (appended in sorted order) so no
+# data is silently turned into NaN.
+def ordered_categorical(values, order=None):
+    order = list(order or [])
+    known = set(order)
+    extra = [value for value in pd.unique(values.dropna()) if value not in known]
+    try:
+        extra.sort()
+    except TypeError:
+        # Mixed codes and labels: fall back to sorting by their text
+        extra.sort(key=str)
+    return values.astype(pd.CategoricalDtype(order + extra, ordered=True))
+
+
+# SHA-256 of a source file, taken from its cache entry when the file's size
+# and mtime still match, so callers can fingerprint the data cheaply
+def source_digest(path, cache_dir=None):
+    stat = os.stat(path)
+    meta = _read_meta(_cache_paths(path, cache_dir or CACHE_DIR)[1])
+    if meta is not None and meta.get('size') == stat.st_size and meta.get('mtime_ns') == stat.st_mtime_ns:
+        return meta['sha256']
+    return file_digest(path)
+
+
+# Name, size and mtime of each source file plus `extra`: a stamp that is
+# cheap to take and changes whenever a file is replaced or edited in place
+def source_stamp(paths, *extra):
+    stamp = []
+    for path in paths:
+        stat = os.stat(path)
+        stamp.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return stamp + [str(value) for value in extra]
+
+
+# Fingerprint of a set of source files: changes whenever any of them does
+def dataset_fingerprint(paths, *extra, cache_dir=None):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(source_digest(path, cache_dir).encode('ascii'))
+    for value in extra:
+        digest.update(str(value).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _cache_paths(path, cache_dir):
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    base_name = f"{os.path.splitext(os.path.basename(path))[0]}-{key}"
+    return (os.path.join(cache_dir, f"{base_name}.pkl"),
+            os.path.join(cache_dir, f"{base_name}.json"))
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    def write(p):
+        with open(p, 'w') as f:
+            json.dump(meta, f, indent=2)
+    try:
+        atomic_write(meta_path, write)
+    except OSError:
+        pass
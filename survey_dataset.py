@@ -0,0 +1,453 @@
+import os
+import shutil
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from survey_data import (CACHE_DIR, read_excel_cached, dataset_fingerprint, ordered_categorical, remap_labels,
+                         source_stamp)
+from text_analysis import ClassificationStore, ruleset_version, LABEL_EMOJIS
+from survey_index import FilterIndex, CountCube
+from text_search import InvertedIndex, TermMatrix
+from near_duplicates import cached_near_duplicates
+from question_registry import QUESTIONS_SCHEMA_PATH, load_question_registry
+from shared_arrays import SharedArrayStore
+from survey_snapshot import SNAPSHOT_FILE, read_snapshot
+from survey_stream import ColumnStore, publish_column_store, read_chunks, read_column_store, should_stream
+
+# Source workbooks, relative to the data directory
+QUESTIONS_FILE = 'Questions.xlsx'
+NUMERIC_FILE = 'Chat Data Numeric.xlsx'
+TEXT_FILE = 'Chat Data Text.xlsx'
+
+# Create a mapping for demographic variables
+demographic_mappings = {
+    'GENDER': {
+        1: 'Male',
+        2: 'Female',
+        'Male': 'Male',
+        'Female': 'Female'
+    },
+    'REGION': {
+        1: 'ATL',
+        2: 'QC',
+        3: 'ON',
+        4: 'MB',
+        5: 'SK',
+        6: 'AB',
+        7: 'BC',
+        'AB': 'Alberta',
+        'BC': 'British Columbia',
+        'MB': 'Manitoba',
+        'ON': 'Ontario',
+        'QC': 'Quebec',
+        'SK': 'Saskatchewan',
+        'ATL': 'Atlantic Provinces'
+    },
+    'REGION_DISPLAY': {
+        'AB': 'Alberta',
+        'BC': 'British Columbia',
+        'MB': 'Manitoba',
+        'ON': 'Ontario',
+        'QC': 'Quebec',
+        'SK': 'Saskatchewan',
+        'ATL': 'Atlantic Provinces'
+    },
+    'EDUCATION': {
+        1: 'Elementary/High School (Partial)',
+        2: 'High School Graduate',
+        3: 'College/Trade School (Partial)',
+        4: 'College/Trade School Graduate',
+        5: 'University (Partial)',
+        6: 'Bachelor\'s Degree',
+        7: 'Graduate Degree (Master\'s/PhD)',
+        'Some elementary or high school': 'Elementary/High School (Partial)',
+        'High school graduate': 'High School Graduate',
+        'Some college/trade school': 'College/Trade School (Partial)',
+        'Graduated from college/trade school': 'College/Trade School Graduate',
+        'Some university': 'University (Partial)',
+        'University undergraduate degree, such as a bachelor\'s degree': 'Bachelor\'s Degree',
+        'University graduate degree, such as a master\'s or PhD': 'Graduate Degree (Master\'s/PhD)'
+    },
+    'EDUCATION_ORDER': [
+        'Elementary/High School (Partial)',
+        'High School Graduate',
+        'College/Trade School (Partial)',
+        'College/Trade School Graduate',
+        'University (Partial)',
+        'Bachelor\'s Degree',
+        'Graduate Degree (Master\'s/PhD)'
+    ],
+    'HHINCOME': {
+        1: 'Under $25,000',
+        2: '$25,000 to less than $50,000',
+        3: '$50,000 to less than $100,000',
+        4: '$100,000 to less than $150,000',
+        5: '$150,000 to less than $200,000',
+        6: 'Over $200,000',
+        7: 'Don\'t know / Rather not say',
+        'Under $25,000': 'Under $25,000',
+        '$25,000 to less than $50,000': '$25,000 to less than $50,000',
+        '$50,000 to less than $100,000': '$50,000 to less than $100,000',
+        '$100,000 to less than $150,000': '$100,000 to less than $150,000',
+        '$150,000 to less than $200,000': '$150,000 to less than $200,000',
+        'Over $200,000': 'Over $200,000',
+        'Don\'t know / Rather not say': 'Don\'t know / Rather not say'
+    },
+    'HHINCOME_ORDER': [
+        'Under $25,000',
+        '$25,000 to less than $50,000',
+        '$50,000 to less than $100,000',
+        '$100,000 to less than $150,000',
+        '$150,000 to less than $200,000',
+        'Over $200,000',
+        'Don\'t know / Rather not say'
+    ],
+    'AGE_GROUP_ORDER': [
+        'Under 18',
+        '18-24',
+        '25-29',
+        '30-34',
+        '35-39',
+        '40-44',
+        '45-49',
+        '50-54',
+        '55-59',
+        '60-64',
+        '65-69',
+        '70-74',
+        '75+'
+    ],
+    'ETHNICITYROLL23': {
+        1: 'First Nations',
+        2: 'White',
+        3: 'South Asian',
+        4: 'Chinese',
+        5: 'Black',
+        6: 'Filipino',
+        7: 'Arab/West Asian',
+        8: 'Latin American',
+        9: 'Southeast Asian',
+        10: 'East Asian',
+        11: 'Multiple visible minorities',
+        'White': 'White',
+        'Black': 'Black',
+        'Chinese': 'Chinese',
+        'South Asian': 'South Asian',
+        'East Asian': 'East Asian',
+        'Southeast Asian': 'Southeast Asian',
+        'Filipino': 'Filipino',
+        'Latin American': 'Latin American',
+        'Arab/West Asian': 'Arab/West Asian',
+        'First Nations': 'First Nations',
+        'Multiple visible minorities': 'Multiple visible minorities'
+    },
+    'PMARITALSTATUS': {
+        1: 'Single, never married',
+        2: 'Married',
+        3: 'Common law',
+        4: 'Separated',
+        5: 'Widowed',
+        6: 'Divorced',
+        'Married': 'Married',
+        'Single, never married': 'Single, never married',
+        'Divorced': 'Divorced',
+        'Separated': 'Separated',
+        'Widowed': 'Widowed',
+        'Common law': 'Common law'
+    }
+}
+
+# Demographic columns stored as codes in the numeric workbook and as labels
+# (or codes) in the text workbook
+DEMOGRAPHIC_COLUMNS = ['GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']
+
+# Upper bounds of the age groups in AGE_GROUP_ORDER
+AGE_BINS = [0, 18, 24, 29, 34, 39, 44, 49, 54, 59, 64, 69, 74, 100]
+
+# Columns the demographic filters act on, in the order of the filter dropdowns
+FILTER_COLUMNS = ['AGE_GROUP', 'GENDER', 'REGION', 'EDUCATION', 'HHINCOME', 'ETHNICITYROLL23', 'PMARITALSTATUS']
+
+
+# Add the time spent in the block to timings[name] (when timings is given)
+@contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+# Derived columns, computed once at load for every frame so callbacks only
+# ever read them
+def add_derived_columns(df):
+    if 'AGE' in df.columns:
+        df['AGE_GROUP'] = pd.cut(df['AGE'], bins=AGE_BINS, labels=demographic_mappings['AGE_GROUP_ORDER'])
+
+
+# Classify the free-text answers of raw rows and remap and derive their
+# demographic columns, in place. build_dataset() runs this on whole
+# workbooks, streaming and appends on one chunk or batch at a time; either
+# frame may be None.
+def process_rows(numeric_df, text_df, text_question_ids, classification_store, timings=None):
+    with timed(timings, 'classification'):
+        # Process the free-text responses (Q8 and Q9)
+        for question_id in text_question_ids if text_df is not None else []:
+            text_column = f"{question_id}_text"
+            if text_column in text_df.columns:
+                # Apply the analysis function to each text response (answers
+                # seen on a previous start come straight from the store)
+                classifications, emojis = classification_store.classify(text_df[text_column], question_id)
+                text_df[f"{question_id}_classification"] = classifications
+                text_df[f"{question_id}_emoji"] = emojis
+
+    frames = [df for df in [text_df, numeric_df] if df is not None]
+    with timed(timings, 'remap'):
+        # Convert demographic codes and labels to the labels used by both frames
+        for df in frames:
+            for col in DEMOGRAPHIC_COLUMNS:
+                if col in df.columns:
+                    df[col] = remap_labels(df[col], demographic_mappings[col])
+
+    with timed(timings, 'derived'):
+        for df in frames:
+            add_derived_columns(df)
+
+
+# Everything the callbacks read: the processed frames, the question registry
+# and the indexes and aggregates built over them
+class SurveyDataset:
+    def __init__(self, questions, numeric_df, text_df, version=None):
+        self.questions = questions
+        self.numeric_df = numeric_df
+        self.text_df = text_df
+        self.version = version
+        # Version of the workbooks the dataset was built from, and the
+        # number of respondent batches appended to it since (survey_ingest.py)
+        self.base_version = version
+        self.batches = 0
+        self.text_question_ids = questions.text_question_ids()
+        self.filter_values = {}
+        self.text_filter_index = None
+        self.text_answered = {}
+        self.numeric_cubes = {}
+        self.text_cubes = {}
+        self.text_search_indexes = {}
+        self.text_term_matrices = {}
+        self.text_duplicate_clusters = {}
+
+
+# Turn the raw workbook frames into a SurveyDataset: classify the free-text
+# answers, map demographic codes to labels, derive age groups, store the
+# filter and answer columns as ordered categoricals and build the indexes.
+# The frames are modified in place. Classification results and near-duplicate
+# clusters are cached in `cache_dir` (.survey_cache/ by default). Seconds
+# spent in each stage are added to `timings` when a dict is given. With
+# `processed`, the frames have been through process_rows() already (as
+# stream_frames() returns them).
+def build_dataset(questions_df, numeric_df, text_df, classification_store=None, schema_path=None,
+                  version=None, cache_dir=None, timings=None, processed=False):
+    with timed(timings, 'questions'):
+        # Every question with its labels, type and answer codes, compiled
+        # once from Questions.xlsx and the questions.json schema
+        questions = load_question_registry(questions_df, schema_path, text_columns=text_df.columns)
+        text_question_ids = questions.text_question_ids()
+
+    if not processed:
+        # Classification results persisted across restarts
+        if classification_store is None:
+            classification_store = ClassificationStore(cache_dir)
+        process_rows(numeric_df, text_df, text_question_ids, classification_store, timings)
+        with timed(timings, 'classification'):
+            classification_store.save()
+
+    with timed(timings, 'categoricals'):
+        # Store demographics and answers as ordered categoricals, so filters
+        # and group-bys work on integer codes and results come out in the
+        # survey's own order (other columns are ordered alphabetically)
+        category_orders = {
+            'AGE_GROUP': demographic_mappings['AGE_GROUP_ORDER'],
+            'EDUCATION': demographic_mappings['EDUCATION_ORDER'],
+            'HHINCOME': demographic_mappings['HHINCOME_ORDER']
+        }
+        classification_columns = [f"{question_id}_classification" for question_id in text_question_ids]
+        for col in classification_columns:
+            category_orders[col] = list(LABEL_EMOJIS)
+        for df in [numeric_df, text_df]:
+            for col in FILTER_COLUMNS + questions.ids() + classification_columns:
+                if col in df.columns:
+                    df[col] = ordered_categorical(df[col], category_orders.get(col))
+
+    dataset = SurveyDataset(questions, numeric_df, text_df, version)
+    build_indexes(dataset, cache_dir, timings)
+    return dataset
+
+
+# Build the indexes and aggregates of a dataset whose frames are processed
+def build_indexes(dataset, cache_dir=None, timings=None):
+    numeric_df, text_df = dataset.numeric_df, dataset.text_df
+    text_ids = [question_id for question_id in dataset.text_question_ids if f"{question_id}_text" in text_df.columns]
+
+    with timed(timings, 'filter_options'):
+        # Values present in each filter column, listed by the filter dropdowns
+        dataset.filter_values = {
+            col: sorted(value for value in numeric_df[col].unique() if pd.notna(value))
+            for col in FILTER_COLUMNS if col in numeric_df.columns
+        }
+
+    with timed(timings, 'filter_index'):
+        # Build the filter index once so callbacks only combine precomputed bitsets
+        dataset.text_filter_index = FilterIndex(text_df, FILTER_COLUMNS)
+        # Rows with a text answer, kept as plain booleans: scanning the text
+        # column itself touches every string object (their reference counts),
+        # which copies them into each forked worker
+        dataset.text_answered = {
+            question_id: text_df[f"{question_id}_text"].notna().to_numpy() for question_id in text_ids
+        }
+
+    with timed(timings, 'count_cubes'):
+        # Pre-aggregated answer counts for every question, crossed with the
+        # filter columns, so charts never have to touch individual respondents
+        dataset.numeric_cubes = {
+            question_id: CountCube(numeric_df[question_id], {col: numeric_df[col] for col in FILTER_COLUMNS})
+            for question_id in dataset.questions.ids() if question_id in numeric_df.columns
+        }
+        dataset.text_cubes = {
+            question_id: CountCube(text_df[f"{question_id}_classification"],
+                                   {col: text_df[col] for col in FILTER_COLUMNS})
+            for question_id in dataset.text_question_ids if f"{question_id}_classification" in text_df.columns
+        }
+
+    with timed(timings, 'search_index'):
+        # Word index over the free-text answers for the response search box
+        dataset.text_search_indexes = {
+            question_id: InvertedIndex(text_df[f"{question_id}_text"]) for question_id in text_ids
+        }
+
+    with timed(timings, 'term_matrix'):
+        # Word/phrase counts of the free-text answers for the top terms panel
+        dataset.text_term_matrices = {
+            question_id: TermMatrix(text_df[f"{question_id}_text"]) for question_id in text_ids
+        }
+
+    with timed(timings, 'near_duplicates'):
+        # Near-duplicate cluster of every free-text answer (the position of
+        # the cluster's first row), for the "collapse duplicates" switch,
+        # and the LSH buckets that appended answers are matched against.
+        # Computed once per dataset and kept in .survey_cache/.
+        dataset.text_duplicate_clusters = {
+            question_id: cached_near_duplicates(text_df[f"{question_id}_text"], cache_dir) for question_id in text_ids
+        }
+    return dataset
+
+
+# Move the dataset's numeric buffers (frame columns, categorical codes and
+# the arrays of the indexes) into read-only shared memory. Done in the
+# gunicorn master before it forks, so the workers share one copy.
+def share_dataset(dataset, store=None):
+    store = store or SharedArrayStore()
+    store.share_object(dataset)
+    return store
+
+
+# Numeric and text frames processed chunk by chunk: every chunk of
+# `chunk_rows` rows is read, run through process_rows() and spilled to a
+# ColumnStore under .survey_cache/stream-<version>/ before the next one is
+# read, so the raw rows of one chunk are all that is held while streaming.
+# The frames are then read back from the stores with their number columns
+# and codes memory-mapped. The stores are kept for later starts on the same
+# data; stores of other versions are removed.
+def stream_frames(questions_df, paths, version, schema_path=None, cache_dir=None, chunk_rows=None,
+                  classification_store=None):
+    cache_dir = cache_dir or CACHE_DIR
+    directory = os.path.join(cache_dir, f"stream-{version}")
+    names = ['numeric', 'text']
+    frames = [read_column_store(os.path.join(directory, name)) for name in names]
+    if any(frame is None for frame in frames):
+        staging = f"{directory}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        if classification_store is None:
+            classification_store = ClassificationStore(cache_dir)
+        for name, path in zip(names, paths):
+            store = ColumnStore(os.path.join(staging, name))
+            for chunk in read_chunks(path, chunk_rows):
+                if name == 'text':
+                    if store.columns is None:
+                        questions = load_question_registry(questions_df, schema_path, text_columns=chunk.columns)
+                        text_ids = questions.text_question_ids()
+                        store.text_columns = {f"{question_id}_text" for question_id in text_ids}
+                    process_rows(None, chunk, text_ids, classification_store)
+                else:
+                    process_rows(chunk, None, [], classification_store)
+                store.append(chunk)
+            store.close()
+        classification_store.save()
+        for entry in os.listdir(cache_dir):
+            if entry.startswith('stream-') and not entry.endswith('.tmp'):
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+        publish_column_store(staging, directory)
+        frames = [read_column_store(os.path.join(directory, name)) for name in names]
+
+    # Values come back as categoricals; keep that only for the columns
+    # build_dataset() makes categorical and give the others plain values
+    questions = load_question_registry(questions_df, schema_path, text_columns=frames[1].columns)
+    categorical = set(FILTER_COLUMNS) | set(questions.ids())
+    categorical.update(f"{question_id}_classification" for question_id in questions.text_question_ids())
+    for frame in frames:
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.CategoricalDtype) and col not in categorical:
+                frame[col] = np.asarray(frame[col])
+    return frames
+
+
+def _source_paths(data_dir, schema_path=None):
+    paths = [os.path.join(data_dir, name) for name in (QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE)]
+    schema_path = schema_path or os.path.join(data_dir, QUESTIONS_SCHEMA_PATH)
+    return paths + ([schema_path] if os.path.exists(schema_path) else [])
+
+
+# Sizes and mtimes of the files the dataset in `data_dir` is built from and
+# the classification rules, as recorded in a snapshot of it
+def dataset_stamp(data_dir='.', schema_path=None):
+    return source_stamp(_source_paths(data_dir, schema_path), ruleset_version())
+
+
+# Read the three workbooks from `data_dir` (parsed copies are cached in
+# .survey_cache/ after the first run) and build the dataset. Its version is a
+# fingerprint of the workbooks, the question schema and the classification
+# rules. When a snapshot compiled for that version exists (see
+# survey_snapshot.py) it is mapped instead and nothing is rebuilt. Workbooks
+# of SURVEY_STREAM_MIN_MB or more (or any, with `stream`) are streamed with
+# stream_frames() rather than read whole.
+def load_dataset(data_dir='.', cache_dir=None, schema_path=None, timings=None, use_snapshot=True, stream=None):
+    paths = [os.path.join(data_dir, name) for name in (QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE)]
+    schema_path = schema_path or os.path.join(data_dir, QUESTIONS_SCHEMA_PATH)
+    sources = _source_paths(data_dir, schema_path)
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    if use_snapshot and os.path.exists(snapshot_path):
+        with timed(timings, 'snapshot'):
+            # Unchanged sizes and mtimes are trusted; only otherwise are the
+            # workbooks hashed to tell whether their contents changed
+            dataset = read_snapshot(snapshot_path, stamp=source_stamp(sources, ruleset_version()))
+            if dataset is None:
+                version = dataset_fingerprint(sources, ruleset_version(), cache_dir=cache_dir)
+                dataset = read_snapshot(snapshot_path, version)
+        if dataset is not None:
+            return dataset
+        print(f"{snapshot_path} does not match the data files; rebuilding "
+              f"(run python survey_snapshot.py to update it)")
+    if stream or (stream is None and should_stream(paths[1:])):
+        with timed(timings, 'read_excel'):
+            questions_df = read_excel_cached(paths[0], cache_dir)
+        version = dataset_fingerprint(sources, ruleset_version(), cache_dir=cache_dir)
+        with timed(timings, 'stream'):
+            numeric_df, text_df = stream_frames(questions_df, paths[1:], version, schema_path, cache_dir)
+        return build_dataset(questions_df, numeric_df, text_df, schema_path=schema_path, version=version,
+                             cache_dir=cache_dir, timings=timings, processed=True)
+    with timed(timings, 'read_excel'):
+        questions_df, numeric_df, text_df = [read_excel_cached(path, cache_dir) for path in paths]
+    version = dataset_fingerprint(sources, ruleset_version(), cache_dir=cache_dir)
+    return build_dataset(questions_df, numeric_df, text_df, schema_path=schema_path, version=version,
+                         cache_dir=cache_dir, timings=timings)
@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+import growable_arrays
+
+
+# Precomputed bitmap index over the demographic columns of a frame.
+#
+# For every (column, value) pair it keeps the matching rows as a packed bitset
+# (one bit per row). A filter request is then an OR of the selected values'
+# bitsets within each column and an AND across columns, which yields the row
+# mask without building any intermediate DataFrame.
+class FilterIndex:
+    def __init__(self, df, columns):
+        self.n_rows = len(df)
+        self.bitmaps = {}
+        for column in columns:
+            if column not in df.columns:
+                continue
+            codes, values = pd.factorize(df[column])
+            self.bitmaps[column] = {
+                value: np.packbits(codes == code) for code, value in enumerate(values)
+            }
+
+    @property
+    def columns(self):
+        return list(self.bitmaps)
+
+    # Packed bitset of the rows whose `column` is one of `values`
+    def _column_bits(self, column, values):
+        bitmaps = self.bitmaps[column]
+        bits = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in set(values):
+            value_bits = bitmaps.get(value)
+            if value_bits is not None:
+                np.bitwise_or(bits, value_bits, out=bits)
+        return bits
+
+    # Boolean row mask for {column: selected values}. Columns with no
+    # selection (None or empty) do not filter, matching the dashboard's
+    # "nothing selected means everyone" behaviour.
+    def mask(self, selections):
+        bits = None
+        for column, values in selections.items():
+            if not values:
+                continue
+            column_bits = self._column_bits(column, values)
+            if bits is None:
+                bits = column_bits
+            else:
+                np.bitwise_and(bits, column_bits, out=bits)
+        if bits is None:
+            return np.ones(self.n_rows, dtype=bool)
+        return np.unpackbits(bits, count=self.n_rows).astype(bool)
+
+    # Index over the rows of this one followed by the rows of `df` (a batch
+    # of new respondents). Only the batch is scanned; the batch's bits are
+    # added at the end of each bitset in place (see growable_arrays.py), so
+    # the rows already indexed are not copied. Returns a new index and
+    # leaves this one answering for its own rows.
+    def extend(self, df):
+        index = FilterIndex.__new__(FilterIndex)
+        index.n_rows = self.n_rows + len(df)
+        index.bitmaps = {}
+        for column, bitmaps in self.bitmaps.items():
+            codes, values = pd.factorize(df[column])
+            batch_codes = dict(zip(values, range(len(values))))
+            extended = {}
+            for value in list(bitmaps) + [value for value in values if value not in bitmaps]:
+                batch_bits = codes == batch_codes.get(value, -2)
+                extended[value] = _append_bits(bitmaps.get(value), self.n_rows, batch_bits)
+            index.bitmaps[column] = extended
+        return index
+
+
+# Packed bitset of `n_rows` rows (all clear when `bits` is None) followed by
+# the rows of the boolean array `added`
+def _append_bits(bits, n_rows, added):
+    if bits is None:
+        bits = np.zeros((n_rows + 7) // 8, dtype=np.uint8)
+    used = n_rows % 8
+    if used == 0:
+        return growable_arrays.append(bits, np.packbits(added))
+    # The last byte is partly filled: repack it together with the new rows.
+    # Only its padding bits change, which no reader of `n_rows` rows looks
+    # at, so it can be rewritten in place.
+    tail = np.unpackbits(bits[-1:], count=used).astype(bool)
+    packed = np.packbits(np.concatenate([tail, added]))
+    if growable_arrays.extendable(bits):
+        bits[-1] = packed[0]
+        return growable_arrays.append(bits, packed[1:])
+    return growable_arrays.append(bits[:-1], packed)
+
+
+# Pre-aggregated respondent counts for one answer column crossed with the
+# demographic columns.
+#
+# Conceptually this is an N-dimensional array of counts indexed by the answer
+# code and each demographic's category code. A dense array would need one cell
+# per combination of categories (millions per question), so only the observed
+# cells are stored, as parallel code arrays plus a count per cell. Any
+# filter/group-by request is answered by selecting cells and summing their
+# counts, so its cost depends on the number of distinct cells rather than on
+# the number of respondents.
+#
+# Each cell also remembers the position of its first respondent, which lets
+# value_counts-style results list tied answers in the same order pandas would
+# for the raw rows.
+#
+# The cells of appended batches are kept in `parts`, (cell codes, counts,
+# first rows) of later rows, each part smaller than the one before it: a new
+# part is merged into the previous one once it has grown as large, like the
+# digits of a binary counter. A cell can then appear in several parts, which
+# the cube_* functions below add up.
+class CountCube:
+    def __init__(self, answers, dimensions):
+        self.answer_name = answers.name
+        self.dimension_names = list(dimensions)
+        keys = [answers] + [dimensions[name] for name in self.dimension_names]
+
+        self.values = []
+        shifted_codes = []
+        for key in keys:
+            codes, values = pd.factorize(key)
+            self.values.append(values)
+            # Shift by one so missing values (-1) get their own coordinate 0
+            shifted_codes.append(codes.astype(np.int64) + 1)
+        self.shape = tuple(len(values) + 1 for values in self.values)
+
+        if len(answers):
+            flat = np.ravel_multi_index(shifted_codes, self.shape)
+            cells, first_rows, counts = np.unique(flat, return_index=True, return_counts=True)
+        else:
+            cells = first_rows = counts = np.zeros(0, dtype=np.int64)
+        self.cell_codes = np.unravel_index(cells, self.shape)
+        self.counts = counts
+        self.first_rows = first_rows
+        self.parts = []
+        self.n_rows = len(answers)
+
+    # Cube over the rows of this one followed by `answers` and `dimensions`
+    # (a batch of new respondents). Only the batch is factorized and counted
+    # and its cells become a new part, so the cost depends on the batch size
+    # rather than on the cells already counted (merging parts of similar
+    # sizes adds a logarithmic factor). Values the cube has not seen are
+    # numbered after the known ones, as a full rebuild would. Returns a new
+    # cube and leaves this one untouched.
+    def extend(self, answers, dimensions):
+        keys = [answers] + [dimensions[name] for name in self.dimension_names]
+        cube = CountCube.__new__(CountCube)
+        cube.answer_name = self.answer_name
+        cube.dimension_names = self.dimension_names
+        cube.values = []
+        shifted_codes = []
+        for values, key in zip(self.values, keys):
+            target = pd.Index(np.asarray(key, dtype=object))
+            codes = pd.Index(np.asarray(values, dtype=object)).get_indexer(target)
+            unseen = (codes < 0) & key.notna().to_numpy()
+            new_values = pd.unique(target[unseen]).tolist() if unseen.any() else []
+            if isinstance(key.dtype, pd.CategoricalDtype):
+                values = pd.CategoricalIndex(list(values) + new_values, dtype=key.dtype)
+            elif new_values:
+                values = values.append(pd.Index(new_values))
+            if new_values:
+                codes = pd.Index(np.asarray(values, dtype=object)).get_indexer(target)
+            cube.values.append(values)
+            shifted_codes.append(codes.astype(np.int64) + 1)
+        cube.shape = tuple(len(values) + 1 for values in cube.values)
+
+        if len(answers):
+            batch_flat = np.ravel_multi_index(shifted_codes, cube.shape)
+            batch_cells, batch_first, batch_counts = np.unique(batch_flat, return_index=True, return_counts=True)
+        else:
+            batch_cells = batch_first = batch_counts = np.zeros(0, dtype=np.int64)
+        parts = self._parts() + [(np.unravel_index(batch_cells, cube.shape), batch_counts, self.n_rows + batch_first)]
+        while len(parts) > 1 and len(parts[-2][1]) <= len(parts[-1][1]):
+            newer = parts.pop()
+            parts[-1] = _merge_cells(parts[-1], newer, cube.shape)
+        (cube.cell_codes, cube.counts, cube.first_rows), cube.parts = parts[0], parts[1:]
+        cube.n_rows = self.n_rows + len(answers)
+        return cube
+
+    # (cell codes, counts, first rows) of every part, oldest first
+    def _parts(self):
+        return [(self.cell_codes, self.counts, self.first_rows)] + list(self.parts)
+
+    # Cells matching {dimension: selected values}; unselected dimensions do
+    # not filter. Returns a boolean mask over the cells of `cell_codes` (the
+    # first part by default).
+    def cell_mask(self, selections, cell_codes=None):
+        cell_codes = self.cell_codes if cell_codes is None else cell_codes
+        mask = np.ones(len(cell_codes[0]), dtype=bool)
+        for name, selected in selections.items():
+            if not selected:
+                continue
+            position = self.dimension_names.index(name) + 1
+            selected = set(selected)
+            allowed = [code + 1 for code, value in enumerate(self.values[position]) if value in selected]
+            mask &= np.isin(cell_codes[position], allowed)
+        return mask
+
+    # Labels of the given cell codes for one column of the cube (the answer
+    # column or a dimension); missing values come back as NaN
+    def _labels(self, position, codes):
+        values = self.values[position]
+        codes = codes - 1
+        if (codes >= 0).all():
+            return values.take(codes)
+        if len(values) == 0:
+            return pd.Index(values.take([]).tolist() + [np.nan] * len(codes), dtype=values.dtype)
+        return values.take(codes, allow_fill=True, fill_value=np.nan)
+
+    # Selected cells as a small DataFrame with the answer column, the
+    # requested dimension columns, 'count' and 'first_row'
+    def select(self, selections, columns=()):
+        positions = [0] + [self.dimension_names.index(name) + 1 for name in columns]
+        selected = []
+        for cell_codes, counts, first_rows in self._parts():
+            mask = self.cell_mask(selections, cell_codes)
+            selected.append([cell_codes[position][mask] for position in positions] + [counts[mask], first_rows[mask]])
+        selected = [np.concatenate(arrays) if len(arrays) > 1 else arrays[0] for arrays in zip(*selected)]
+        data = {name: self._labels(position, codes)
+                for name, position, codes in zip([self.answer_name] + list(columns), positions, selected)}
+        data['count'] = selected[-2]
+        data['first_row'] = selected[-1]
+        return pd.DataFrame(data)
+
+
+# (cell codes, counts, first rows) of two parts of a cube's cells, `newer`
+# counting rows after those of `older`, merged into one. The codes of known
+# values never move, so the cells of both are in the same sorted order under
+# `shape`: the newer cells are looked up in the older ones, existing cells
+# get their counts raised (their first row is the older one) and new cells
+# are inserted in order.
+def _merge_cells(older, newer, shape):
+    old_codes, old_counts, old_first = older
+    new_codes, new_counts, new_first = newer
+    old_cells = np.ravel_multi_index(old_codes, shape)
+    new_cells = np.ravel_multi_index(new_codes, shape)
+    positions = np.searchsorted(old_cells, new_cells)
+    found = positions < len(old_cells)
+    found[found] = old_cells[positions[found]] == new_cells[found]
+    counts = old_counts.copy()
+    counts[positions[found]] += new_counts[found]
+    added = ~found
+    return (tuple(np.insert(codes, positions[added], codes_added[added])
+                  for codes, codes_added in zip(old_codes, new_codes)),
+            np.insert(counts, positions[added], new_counts[added]),
+            np.insert(old_first, positions[added], new_first[added]))
+
+
+# Equivalent of df[column].value_counts() computed from CountCube cells:
+# counts are summed per value, listed in order of first appearance and then
+# sorted the same way pandas sorts value_counts output
+def cube_value_counts(cells, column):
+    cells = cells.dropna(subset=[column])
+    totals = cells.groupby(column, sort=False, observed=True).agg(count=('count', 'sum'), first_row=('first_row', 'min'))
+    totals = totals.sort_values('first_row', kind='stable')
+    result = totals['count'].sort_values(ascending=False)
+    result.index.name = column
+    return result
+
+
+# Equivalent of df.groupby([...], observed=True).size() computed from
+# CountCube cells
+def cube_group_sizes(cells, columns):
+    return cells.groupby(columns, observed=True)['count'].sum()
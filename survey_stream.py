@@ -0,0 +1,332 @@
+import mmap
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+import openpyxl
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from survey_data import atomic_write
+
+# Rows read, processed and written at a time when streaming an export
+STREAM_CHUNK_ROWS = int(os.environ.get('SURVEY_STREAM_CHUNK_ROWS', '50000'))
+
+# Exports at least this large (in MiB) are streamed instead of read whole
+STREAM_MIN_MB = float(os.environ.get('SURVEY_STREAM_MIN_MB', '50'))
+
+# Distinct values a column of values may collect before it is stored as
+# text instead, which keeps nothing in memory per value
+STORE_MAX_VALUES = int(os.environ.get('SURVEY_STORE_MAX_VALUES', '10000'))
+
+# Bump this whenever the layout of the column store changes
+STORE_FORMAT_VERSION = 2
+
+
+# Whether any of the files is large enough to be streamed
+def should_stream(paths):
+    return any(os.path.exists(path) and os.path.getsize(path) >= STREAM_MIN_MB * 2 ** 20 for path in paths)
+
+
+# DataFrames of at most `chunk_rows` rows from an .xlsx workbook (its first
+# sheet, read with openpyxl in read-only mode), a .csv file or a .jsonl file.
+# Workbook values are converted the way pd.read_excel converts them, so the
+# chunks put together equal the frame it would return.
+def read_chunks(path, chunk_rows=None):
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        with pd.read_csv(path, chunksize=chunk_rows) as reader:
+            yield from reader
+    elif extension in ('.jsonl', '.ndjson'):
+        with pd.read_json(path, lines=True, chunksize=chunk_rows) as reader:
+            yield from reader
+    else:
+        yield from _excel_chunks(path, chunk_rows)
+
+
+def _excel_chunks(path, chunk_rows):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        header = None
+        rows = []
+        blank_rows = 0
+        yielded = False
+        for row in sheet.rows:
+            values = [_cell_value(cell) for cell in row]
+            while values and values[-1] == '':
+                values.pop()
+            if header is None:
+                header = values or None
+                continue
+            # Blank rows are kept unless nothing follows them, as read_excel does
+            if not values:
+                blank_rows += 1
+                continue
+            rows.extend([] for _ in range(blank_rows))
+            blank_rows = 0
+            rows.append(values)
+            if len(rows) >= chunk_rows:
+                yield _parse_rows(header, rows)
+                yielded = True
+                rows = []
+        if rows or not yielded:
+            yield _parse_rows(header or [], rows)
+    finally:
+        workbook.close()
+
+
+# Cell value as pandas' openpyxl reader returns it
+def _cell_value(cell):
+    if cell.value is None:
+        return ''
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+# Frame of workbook rows under `header`, with read_excel's column naming,
+# missing value and type inference rules
+def _parse_rows(header, rows):
+    if not header:
+        return pd.DataFrame()
+    width = max([len(header)] + [len(row) for row in rows])
+    data = [list(row) + [''] * (width - len(row)) for row in [header] + rows]
+    return TextParser(data, header=0).read()
+
+
+# A table written to a directory one chunk at a time and read back with
+# read_column_store(), so a table larger than memory can be built while
+# holding a single chunk.
+#
+# Every column gets its own files: numbers as float64, dates and times as
+# int64 nanoseconds, the columns listed in `text_columns` as UTF-8 bytes with
+# the end offset of every row, and other columns as int32 codes into their
+# distinct values. The distinct values are kept in memory while writing, so
+# a column of values that collects more than STORE_MAX_VALUES of them (IDs,
+# free text) is recoded as a text column, and its values come back as
+# strings. A number or date column that receives other values later on is
+# recoded as a column of values. The metadata is written last by close(), so
+# a directory without it holds an unfinished table.
+class ColumnStore:
+    def __init__(self, directory, text_columns=()):
+        self.directory = directory
+        self.text_columns = set(text_columns)
+        self.columns = None
+        self.kinds = {}
+        self.values = {}
+        self.missing = {}
+        self.integral = {}
+        self.n_rows = 0
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, position, suffix):
+        return os.path.join(self.directory, f"{position}.{suffix}")
+
+    def _open(self, position, suffix):
+        key = (position, suffix)
+        if key not in self._files:
+            self._files[key] = open(self._path(position, suffix), 'ab')
+        return self._files[key]
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+            for col in self.columns:
+                if col in self.text_columns:
+                    self.kinds[col] = 'text'
+                elif pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+                    self.kinds[col] = 'number'
+                    self.integral[col] = True
+                elif pd.api.types.is_datetime64_dtype(df[col]):
+                    self.kinds[col] = 'datetime'
+                else:
+                    self.kinds[col] = 'values'
+                    self.values[col] = {}
+                self.missing[col] = False
+        elif list(df.columns) != self.columns:
+            raise ValueError(f"Chunk columns {list(df.columns)} differ from the first chunk's {self.columns}")
+
+        for position, col in enumerate(self.columns):
+            series = df[col]
+            self.missing[col] = self.missing[col] or bool(series.isna().any())
+            if self.kinds[col] == 'number':
+                numbers = pd.to_numeric(series, errors='coerce')
+                if numbers.isna().sum() > series.isna().sum() or pd.api.types.is_bool_dtype(series):
+                    self._recode_as_values(position, col)
+                else:
+                    numbers = numbers.to_numpy(dtype=np.float64)
+                    finite = numbers[np.isfinite(numbers)]
+                    self.integral[col] = self.integral[col] and bool((finite == np.round(finite)).all())
+                    self._open(position, 'f8').write(numbers.tobytes())
+                    continue
+            if self.kinds[col] == 'datetime':
+                # A chunk of strings is not converted: read whole, the
+                # column would hold them as they are
+                if pd.api.types.is_datetime64_dtype(series) or series.isna().all():
+                    dates = pd.to_datetime(series).to_numpy(dtype='datetime64[ns]')
+                    self._open(position, 'i8').write(dates.view(np.int64).tobytes())
+                    continue
+                self._recode_as_values(position, col)
+            if self.kinds[col] == 'values':
+                codes = self._encode(col, series)
+                if len(self.values[col]) <= STORE_MAX_VALUES:
+                    self._open(position, 'codes').write(codes.tobytes())
+                    continue
+                self._recode_as_text(position, col)
+            self._write_text(position, series)
+        self.n_rows += len(df)
+
+    # int32 codes of a chunk of values, numbering new values as they appear
+    def _encode(self, col, values):
+        codes, uniques = pd.factorize(values)
+        known = self.values[col]
+        table = np.array([known.setdefault(value, len(known)) for value in uniques] + [-1], dtype=np.int32)
+        return table[codes]
+
+    def _write_text(self, position, texts):
+        missing = texts.isna().to_numpy()
+        encoded = [b'' if is_missing else str(text).encode('utf-8') for text, is_missing in zip(texts, missing)]
+        previous_end = self._open(position, 'utf8').tell()
+        ends = previous_end + np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        self._open(position, 'utf8').write(b''.join(encoded))
+        self._open(position, 'ends').write(ends.tobytes())
+        self._open(position, 'na').write(missing.astype(np.uint8).tobytes())
+
+    # Rewrite the numbers or dates written so far for `col` as codes of a
+    # values column, a block at a time
+    def _recode_as_values(self, position, col):
+        suffix, dtype = ('f8', np.float64) if self.kinds[col] == 'number' else ('i8', 'datetime64[ns]')
+        self._close_file(position, suffix)
+        path = self._path(position, suffix)
+        self.kinds[col] = 'values'
+        self.values[col] = {}
+        if self.n_rows:
+            numbers = np.memmap(path, dtype=dtype, mode='r', shape=(self.n_rows,))
+            for start in range(0, self.n_rows, 1 << 20):
+                block = numbers[start:start + (1 << 20)]
+                if suffix == 'f8':
+                    # Whole numbers go back to ints, as the workbook reader gave them
+                    block = [int(value) if value.is_integer() else value for value in block.tolist()]
+                else:
+                    block = list(pd.DatetimeIndex(block))
+                self._open(position, 'codes').write(self._encode(col, pd.Series(block, dtype=object)).tobytes())
+            del numbers
+        os.remove(path)
+
+    # Rewrite the codes written so far for `col` as a text column, a block at
+    # a time, and drop its distinct values
+    def _recode_as_text(self, position, col):
+        self._close_file(position, 'codes')
+        path = self._path(position, 'codes')
+        # Code -1 (missing) takes the last entry
+        values = pd.Series(list(self.values.pop(col)) + [np.nan], dtype=object)
+        self.kinds[col] = 'text'
+        if self.n_rows:
+            codes = np.memmap(path, dtype=np.int32, mode='r', shape=(self.n_rows,))
+            for start in range(0, self.n_rows, 1 << 20):
+                self._write_text(position, values.take(codes[start:start + (1 << 20)]))
+            del codes
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _close_file(self, position, suffix):
+        f = self._files.pop((position, suffix), None)
+        if f is not None:
+            f.close()
+
+    # Write the metadata that marks the table complete
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        meta = {
+            'format_version': STORE_FORMAT_VERSION,
+            'n_rows': self.n_rows,
+            'columns': [(col, self.kinds[col]) for col in self.columns or []],
+            'values': {col: list(values) for col, values in self.values.items()},
+            'missing': self.missing,
+            'integral': self.integral,
+        }
+        atomic_write(os.path.join(self.directory, 'meta.pkl'),
+                     lambda p: _write_pickle(p, meta))
+
+
+def _write_pickle(path, obj):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# The table a ColumnStore wrote to `directory`, or None when it is missing,
+# unfinished or of another format. Number and date columns and codes are
+# memory-mapped; values columns come back as categoricals (categories in
+# order of appearance) and text columns as Python strings. Number columns
+# get the dtype pandas gives a whole column: int64 for whole numbers with
+# no missing values, float64 otherwise.
+def read_column_store(directory):
+    try:
+        with open(os.path.join(directory, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if meta.get('format_version') != STORE_FORMAT_VERSION:
+        return None
+
+    n_rows = meta['n_rows']
+    columns = {}
+    for position, (col, kind) in enumerate(meta['columns']):
+        if kind == 'number':
+            numbers = _map_array(os.path.join(directory, f"{position}.f8"), np.float64, n_rows)
+            if meta['integral'][col] and not meta['missing'][col]:
+                numbers = numbers.astype(np.int64)
+            columns[col] = numbers
+        elif kind == 'datetime':
+            columns[col] = _map_array(os.path.join(directory, f"{position}.i8"), 'datetime64[ns]', n_rows)
+        elif kind == 'values':
+            codes = _map_array(os.path.join(directory, f"{position}.codes"), np.int32, n_rows)
+            categories = pd.Index(meta['values'][col])
+            if len(categories) and meta['missing'][col] and pd.api.types.is_numeric_dtype(categories) \
+                    and not pd.api.types.is_bool_dtype(categories):
+                categories = categories.astype(np.float64)
+            columns[col] = pd.Categorical.from_codes(codes, categories=categories)
+        else:
+            columns[col] = _read_texts(directory, position, n_rows)
+    return pd.DataFrame(columns, index=pd.RangeIndex(n_rows), copy=False)
+
+
+# Replace the store at `directory` with the finished one at `staging`,
+# unless another process finished it first
+def publish_column_store(staging, directory):
+    try:
+        os.rename(staging, directory)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _map_array(path, dtype, n_rows):
+    if n_rows == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n_rows,))
+
+
+def _read_texts(directory, position, n_rows):
+    texts = np.empty(n_rows, dtype=object)
+    if n_rows == 0:
+        return texts
+    ends = _map_array(os.path.join(directory, f"{position}.ends"), np.int64, n_rows)
+    missing = _map_array(os.path.join(directory, f"{position}.na"), np.uint8, n_rows)
+    with open(os.path.join(directory, f"{position}.utf8"), 'rb') as f:
+        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if ends[-1] else b''
+    start = 0
+    for row, (end, is_missing) in enumerate(zip(ends.tolist(), missing.tolist())):
+        texts[row] = np.nan if is_missing else blob[start:end].decode('utf-8')
+        start = end
+    if isinstance(blob, mmap.mmap):
+        blob.close()
+    return texts
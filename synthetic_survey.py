@@ -0,0 +1,158 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from survey_data import read_excel_cached
+from survey_dataset import QUESTIONS_FILE, NUMERIC_FILE, TEXT_FILE, DEMOGRAPHIC_COLUMNS, demographic_mappings
+
+# Columns of the synthetic workbooks besides the free text: every column the
+# dashboard reads, with the same names and code ranges as the real exports
+ANSWER_COLUMNS = ['Q1', 'Q2', 'Q3', 'Q4', 'Q5', 'Q6', 'Q7', 'Q10']
+TEXT_QUESTIONS = ['Q8', 'Q9']
+
+# Fallback phrases for the free text when no real answers are available
+DEFAULT_OPENERS = ['Yes', 'No', 'It depends', 'Absolutely not', 'Definitely', 'Not really', 'I think so',
+                   'Probably not', 'Maybe', 'Of course']
+DEFAULT_REASONS = ['it has a broth', 'it is too thick', 'it is served over rice', 'the bread is on the outside',
+                   'there is nothing in between', 'it is still pizza', 'that is just how it is eaten',
+                   'it depends on the consistency', 'a stew is not a soup', 'it is its own thing']
+
+
+# Value distributions of a real export, used to draw synthetic respondents:
+# the share of every code (missing included) per column, the ages, and the
+# free-text answers split into opening words and reasons
+class SurveyProfile:
+    def __init__(self, distributions, ages, openers, reasons, missing_text):
+        self.distributions = distributions
+        self.ages = ages
+        self.openers = openers
+        self.reasons = reasons
+        self.missing_text = missing_text
+
+    @classmethod
+    def from_frame(cls, numeric_df):
+        distributions = {}
+        for col in ANSWER_COLUMNS + DEMOGRAPHIC_COLUMNS:
+            if col in numeric_df.columns:
+                shares = numeric_df[col].value_counts(dropna=False, normalize=True)
+                distributions[col] = (shares.index.to_numpy(dtype=object), shares.to_numpy())
+        ages = numeric_df['AGE'].dropna().to_numpy()
+        openers, reasons, missing_text = {}, {}, {}
+        for question_id in TEXT_QUESTIONS:
+            texts = numeric_df.get(f"{question_id}_text", pd.Series(dtype=object)).dropna().astype(str)
+            parts = [_split_answer(text) for text in texts]
+            openers[question_id] = np.array(sorted({opener for opener, _ in parts if opener}) or DEFAULT_OPENERS,
+                                            dtype=object)
+            reasons[question_id] = np.array(sorted({reason for _, reason in parts if reason}) or DEFAULT_REASONS,
+                                            dtype=object)
+            missing_text[question_id] = 1 - len(texts) / max(len(numeric_df), 1)
+        return cls(distributions, ages, openers, reasons, missing_text)
+
+    # Uniform codes over the demographic mappings and questions, for when no
+    # real export is at hand
+    @classmethod
+    def default(cls):
+        answer_counts = {'Q1': 4, 'Q2': 2, 'Q3': 4, 'Q4': 4, 'Q5': 5, 'Q6': 3, 'Q7': 5, 'Q10': 6}
+        distributions = {}
+        for col, count in answer_counts.items():
+            distributions[col] = (np.arange(1, count + 1, dtype=object), np.full(count, 1 / count))
+        for col in DEMOGRAPHIC_COLUMNS:
+            codes = np.array([code for code in demographic_mappings[col] if isinstance(code, int)], dtype=object)
+            distributions[col] = (codes, np.full(len(codes), 1 / len(codes)))
+        openers = {question_id: np.array(DEFAULT_OPENERS, dtype=object) for question_id in TEXT_QUESTIONS}
+        reasons = {question_id: np.array(DEFAULT_REASONS, dtype=object) for question_id in TEXT_QUESTIONS}
+        return cls(distributions, np.arange(18, 91), openers, reasons, {q: 0.01 for q in TEXT_QUESTIONS})
+
+    # Profile of the real numeric export in `data_dir`, or the default one
+    @classmethod
+    def load(cls, data_dir='.'):
+        path = os.path.join(data_dir, NUMERIC_FILE)
+        if os.path.exists(path):
+            return cls.from_frame(read_excel_cached(path))
+        return cls.default()
+
+
+# Split an answer into its first words (up to the first comma or full stop)
+# and the rest
+def _split_answer(text):
+    text = re.sub(r"\s+", ' ', text).strip()
+    match = re.match(r"([^,.!?]{1,40})[,.!?]\s*(.+)", text)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    return (text, '') if len(text) <= 40 else ('', text)
+
+
+# Free-text answers for `rows` respondents. A share `repeat_share` of the
+# answers repeats an earlier one word for word (as real exports do); the
+# others combine an opener with one or two reasons, which keeps the number of
+# distinct answers growing with the number of rows.
+def _synthetic_texts(rng, rows, openers, reasons, missing_share, repeat_share=0.3):
+    texts = openers[rng.integers(0, len(openers), rows)] + ', ' + reasons[rng.integers(0, len(reasons), rows)]
+    longer = rng.random(rows) < 0.4
+    texts[longer] = texts[longer] + ' and ' + reasons[rng.integers(0, len(reasons), longer.sum())]
+    repeated = np.flatnonzero(rng.random(rows) < repeat_share)
+    if len(repeated):
+        texts[repeated] = texts[rng.integers(0, rows, len(repeated))]
+    texts[rng.random(rows) < missing_share] = np.nan
+    return texts
+
+
+# Numeric and text frames for `rows` synthetic respondents with the schema of
+# the real exports (the text frame adds the Q8/Q9 answers), plus the
+# questions frame
+def generate_frames(rows, seed=0, profile=None):
+    rng = np.random.default_rng(seed)
+    profile = profile or SurveyProfile.default()
+
+    columns = {'participant_id': np.arange(1, rows + 1)}
+    for col in ANSWER_COLUMNS[:7]:
+        columns[col] = _draw(rng, profile.distributions[col], rows)
+    for question_id in TEXT_QUESTIONS:
+        columns[f"{question_id}_text"] = _synthetic_texts(
+            rng, rows, profile.openers[question_id], profile.reasons[question_id],
+            profile.missing_text[question_id])
+    columns['Q10'] = _draw(rng, profile.distributions['Q10'], rows)
+    columns['AGE'] = profile.ages[rng.integers(0, len(profile.ages), rows)]
+    for col in DEMOGRAPHIC_COLUMNS:
+        columns[col] = _draw(rng, profile.distributions[col], rows)
+
+    text_df = pd.DataFrame(columns)
+    numeric_df = text_df.drop(columns=[f"{question_id}_text" for question_id in TEXT_QUESTIONS])
+    questions_df = pd.DataFrame({
+        'Question_ID': [f"Q{number}" for number in range(1, 11)],
+        'Question_Text': [f"Question {number}" for number in range(1, 11)],
+    })
+    return questions_df, numeric_df, text_df
+
+
+def _draw(rng, distribution, rows):
+    values, shares = distribution
+    # Keep numeric codes numeric (floats when some answers are missing)
+    numeric = pd.to_numeric(pd.Series(values), errors='coerce')
+    if (numeric.notna() == pd.notna(values)).all():
+        values = numeric.to_numpy()
+        if not np.isnan(values).any():
+            values = values.astype(np.int64)
+    return values[rng.choice(len(values), size=rows, p=shares / shares.sum())]
+
+
+# Write the frames as the three workbooks the dashboard reads
+def write_workbooks(directory, questions_df, numeric_df, text_df):
+    os.makedirs(directory, exist_ok=True)
+    for name, df in [(QUESTIONS_FILE, questions_df), (NUMERIC_FILE, numeric_df), (TEXT_FILE, text_df)]:
+        df.to_excel(os.path.join(directory, name), index=False)
+
+
+# Write synthetic workbooks for a quick look at the dashboard at scale
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic survey workbooks")
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    frames = generate_frames(args.rows, args.seed, SurveyProfile.load())
+    write_workbooks(args.directory, *frames)
+    print(f"Wrote {args.rows} respondents to {args.directory}")
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from near_duplicates import NearDuplicateIndex, find_near_duplicates
+from synthetic_survey import SurveyProfile, generate_frames
+
+
+@pytest.fixture(scope='module')
+def texts():
+    _, _, text_df = generate_frames(6000, seed=5, profile=SurveyProfile.load())
+    return text_df['Q8_text'].reset_index(drop=True)
+
+
+def extend_in_batches(texts, bounds):
+    index = NearDuplicateIndex(texts[:bounds[0]])
+    for end in bounds[1:] + [len(texts)]:
+        index = index.extend(texts[:end])
+    return index
+
+
+def test_reposted_answers_join_the_stored_cluster(texts):
+    index = NearDuplicateIndex(texts)
+    answer = next(text for text in texts.dropna() if len(text) > 40)
+    row = int(texts[texts == answer].index[0])
+    posted = pd.Series([answer, answer.upper() + '!!', answer + ' really', 'something else entirely, nothing alike'])
+    extended = index.extend(pd.concat([texts, posted], ignore_index=True))
+    new_labels = extended.labels[len(texts):]
+    assert list(new_labels[:3]) == [index.labels[row]] * 3
+    assert new_labels[3] == len(texts) + 3
+    # The rows already indexed keep their labels
+    assert np.array_equal(extended.labels[:len(texts)], index.labels)
+
+
+def test_extend_only_groups_what_a_full_build_groups(texts):
+    full = find_near_duplicates(texts)
+    extended = extend_in_batches(texts, [3000, 3500, 3600])
+    assert np.array_equal(extended.labels < 0, full < 0)
+    answered = extended.labels >= 0
+    # Every cluster of the appended index lies within one cluster of the full build
+    pairs = pd.DataFrame({'extended': extended.labels[answered], 'full': full[answered]})
+    assert (pairs.groupby('extended')['full'].nunique() == 1).all()
+    # Labels are the first row of their cluster
+    assert (extended.labels[answered] <= np.flatnonzero(answered)).all()
+    for label in np.unique(extended.labels[answered]):
+        assert extended.labels[label] == label
+
+
+def test_extend_leaves_the_original_index_untouched(texts):
+    index = NearDuplicateIndex(texts[:4000])
+    labels, parts = index.labels.copy(), [(keys.copy(), rows.copy()) for keys, rows in index.parts]
+    index.extend(texts[:5000])
+    index.extend(texts)
+    assert np.array_equal(index.labels, labels)
+    assert all(np.array_equal(a, c) and np.array_equal(b, d) for (a, b), (c, d) in zip(index.parts, parts))
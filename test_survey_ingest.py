@@ -0,0 +1,134 @@
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+import growable_arrays
+
+TOKEN = 'test-token'
+
+
+# The dashboard app with POST /ingest on, its caches and append log in a
+# temporary directory and the file watcher off. Settings are read at import.
+@pytest.fixture(scope='module')
+def app_module():
+    with tempfile.TemporaryDirectory() as cache_dir, pytest.MonkeyPatch.context() as mp:
+        mp.setenv('SURVEY_CACHE_DIR', cache_dir)
+        mp.setenv('SURVEY_INGEST_TOKEN', TOKEN)
+        mp.setenv('SURVEY_RELOAD_INTERVAL', '0')
+        import app
+        mp.setattr(app.dataset_watcher, 'cache_dir', cache_dir)
+        yield app
+
+
+# The first rows of a workbook as POST /ingest receives them
+def workbook_rows(path, rows=3):
+    from survey_data import read_excel_cached
+    return json.loads(read_excel_cached(path).head(rows).to_json(orient='records', date_format='iso'))
+
+
+def post(app_module, payload):
+    client = app_module.server.test_client()
+    return client.post('/ingest', json=payload, headers={'Authorization': f"Bearer {TOKEN}"})
+
+
+def test_ingest_json_rows_keep_dtypes_and_existing_rows(app_module):
+    from survey_dataset import NUMERIC_FILE, TEXT_FILE
+    before = app_module.dataset_watcher.current
+    response = post(app_module, {'numeric': workbook_rows(NUMERIC_FILE), 'text': workbook_rows(TEXT_FILE)})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    after = app_module.dataset_watcher.current
+    for old, new in ((before.numeric_df, after.numeric_df), (before.text_df, after.text_df)):
+        pd.testing.assert_series_equal(new.dtypes, old.dtypes)
+        pd.testing.assert_frame_equal(new.iloc[:len(old)], old)
+        # The posted rows are the workbooks' first rows, so they come out
+        # the way the first rows were loaded
+        pd.testing.assert_frame_equal(new.iloc[len(old):].reset_index(drop=True), old.head(3))
+
+
+def test_ingest_fills_left_out_datetime_columns(app_module):
+    from survey_dataset import NUMERIC_FILE
+    rows = workbook_rows(NUMERIC_FILE, rows=1)
+    del rows[0]['engagement_completed_EST']
+    response = post(app_module, {'numeric': rows})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    completed = app_module.dataset_watcher.current.numeric_df['engagement_completed_EST']
+    assert completed.dtype == 'datetime64[ns]'
+    assert pd.isna(completed.iloc[-1]) and completed.iloc[:-1].notna().any()
+
+
+def test_ingest_rejects_values_of_the_wrong_type(app_module):
+    from survey_dataset import NUMERIC_FILE
+    before = app_module.dataset_watcher.current
+    rows = workbook_rows(NUMERIC_FILE, rows=1)
+    rows[0]['engagement_started_EST'] = 'yesterday'
+    response = post(app_module, {'numeric': rows})
+    assert response.status_code == 400
+    assert 'engagement_started_EST' in response.get_json()['error']
+    assert app_module.dataset_watcher.current is before
+
+
+def test_append_does_not_widen_the_dtype():
+    dates = np.array(['2025-03-04T13:59:50'], dtype='datetime64[ns]')
+    with pytest.raises(TypeError):
+        growable_arrays.append(dates, np.array(['2025-03-05T10:00:00'], dtype=object))
+    with pytest.raises(TypeError):
+        growable_arrays.append(np.arange(3), np.array([np.nan]))
+    grown = growable_arrays.append(np.arange(3), np.array([3], dtype=np.int32))
+    assert grown.dtype == np.int64 and grown.tolist() == [0, 1, 2, 3]
+
+
+# Count and first row of each selected combination of values, the way the
+# callbacks total the cells of every part of a cube, as plain values in a
+# fixed order whatever order the categories list the values in
+def cell_totals(cells):
+    keys = [col for col in cells.columns if col not in ('count', 'first_row')]
+    cells = cells.astype({col: object for col in keys})
+    totals = cells.groupby(keys, dropna=False).agg(count=('count', 'sum'), first_row=('first_row', 'min'))
+    return totals.sort_values('first_row').reset_index()
+
+
+# A dataset grown by appending batches answers every query the way one built
+# from all the rows at once does. The batches are sized so the word index
+# both keeps and merges parts, and the grown arrays fill their spare room
+# before reallocating.
+def test_appended_batches_match_a_full_build(tmp_path):
+    from survey_dataset import build_dataset
+    from survey_ingest import append_respondents
+    from synthetic_survey import SurveyProfile, generate_frames
+    questions_df, numeric_df, text_df = generate_frames(3000, seed=11, profile=SurveyProfile.load())
+    cache_dir = str(tmp_path)
+    full = build_dataset(questions_df.copy(), numeric_df.copy(), text_df.copy(), cache_dir=cache_dir)
+    bounds = [2000, 2400, 2900, 3000]
+    first = build_dataset(questions_df.copy(), numeric_df[:bounds[0]].copy(), text_df[:bounds[0]].copy(),
+                          cache_dir=cache_dir)
+    first_terms = {qid: matrix.top_terms(n=20) for qid, matrix in first.text_term_matrices.items()}
+    dataset = first
+    for start, end in zip(bounds, bounds[1:]):
+        dataset = append_respondents(dataset, numeric_df[start:end], text_df[start:end], cache_dir=cache_dir)
+    assert dataset.batches == 3
+
+    values = full.filter_values
+    selections = [{}, {'GENDER': values['GENDER'][:1]},
+                  {'AGE_GROUP': values['AGE_GROUP'][:2], 'REGION': values['REGION'][1:2]}]
+    for selection in selections:
+        assert np.array_equal(dataset.text_filter_index.mask(selection), full.text_filter_index.mask(selection))
+        for cubes in ('numeric_cubes', 'text_cubes'):
+            for question_id, cube in getattr(full, cubes).items():
+                pd.testing.assert_frame_equal(
+                    cell_totals(getattr(dataset, cubes)[question_id].select(selection, ['GENDER'])),
+                    cell_totals(cube.select(selection, ['GENDER'])))
+        rows = np.flatnonzero(full.text_filter_index.mask(selection))
+        for question_id, matrix in full.text_term_matrices.items():
+            assert dataset.text_term_matrices[question_id].top_terms(rows, n=20) == matrix.top_terms(rows, n=20)
+
+    for question_id, index in full.text_search_indexes.items():
+        words = [term for term, _ in full.text_term_matrices[question_id].top_terms(n=8) if ' ' not in term]
+        for query in words + [' '.join(words[:2]), 'zzzz']:
+            expected = index.search(query)
+            assert np.array_equal(dataset.text_search_indexes[question_id].search(query), expected), query
+        assert len(dataset.text_search_indexes[question_id].parts) > 1
+
+    # The dataset the batches were appended to still answers for its own rows
+    assert {qid: matrix.top_terms(n=20) for qid, matrix in first.text_term_matrices.items()} == first_terms
+    assert len(first.text_filter_index.mask({})) == bounds[0]
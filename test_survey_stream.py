@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import survey_stream
+from survey_stream import ColumnStore, read_column_store
+
+
+def chunks_of(df, rows):
+    return [df.iloc[start:start + rows].reset_index(drop=True) for start in range(0, len(df), rows)]
+
+
+# Columns of the shapes the survey exports have: IDs and free text with a
+# value per row, dates, and answers with a few values
+def export_frame(rows):
+    rng = np.random.default_rng(0)
+    started = pd.Timestamp('2025-03-04 09:00') + pd.to_timedelta(rng.integers(0, 10 ** 6, rows), unit='s')
+    started = pd.Series(started).mask(rng.random(rows) < 0.1)
+    return pd.DataFrame({
+        'participant_id': np.arange(rows),
+        'engagement_id': [f"eng-{value:08x}" for value in rng.integers(0, 2 ** 32, rows)],
+        'engagement_started_EST': started,
+        'Q1': rng.choice(['Yes', 'No', None], rows),
+        'Q1_something_else_text': [f"other answer {i}" if i % 3 else None for i in range(rows)],
+    })
+
+
+def write_store(directory, chunks, text_columns=()):
+    store = ColumnStore(str(directory), text_columns=text_columns)
+    for chunk in chunks:
+        store.append(chunk)
+    store.close()
+    return store
+
+
+def test_high_cardinality_columns_keep_no_values_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(survey_stream, 'STORE_MAX_VALUES', 500)
+    df = export_frame(5000)
+    store = ColumnStore(str(tmp_path))
+    for chunk in chunks_of(df, 400):
+        store.append(chunk)
+        # At most one chunk of values past the bound before the switch
+        assert all(len(values) <= 500 + 400 for values in store.values.values())
+    store.close()
+    assert store.kinds == {'participant_id': 'number', 'engagement_id': 'text', 'engagement_started_EST': 'datetime',
+                           'Q1': 'values', 'Q1_something_else_text': 'text'}
+    assert list(store.values) == ['Q1']
+
+    stored = read_column_store(str(tmp_path))
+    expected = df.assign(Q1=df['Q1'].astype('category'))
+    pd.testing.assert_frame_equal(stored, expected, check_categorical=False)
+
+
+# Dates that later chunks hold as strings come back as they are, the way a
+# whole read keeps a column of mixed values
+def test_date_column_with_other_values_is_recoded(tmp_path):
+    dates = pd.Series(pd.to_datetime(['2025-03-04 10:00', None, '2025-03-05 11:30', '2025-03-06 08:15']))
+    chunks = [pd.DataFrame({'completed': dates[:2]}), pd.DataFrame({'completed': [None, None]}),
+              pd.DataFrame({'completed': dates[2:].reset_index(drop=True)}), pd.DataFrame({'completed': ['n/a', None]})]
+    store = write_store(tmp_path, chunks)
+    assert store.kinds['completed'] == 'values'
+    stored = read_column_store(str(tmp_path))['completed']
+    assert stored.isna().tolist() == [False, True, True, True, False, False, False, True]
+    assert list(stored.dropna()) == [dates[0], dates[2], dates[3], 'n/a']
@@ -0,0 +1,137 @@
+import random
+import re
+import pandas as pd
+import pytest
+from synthetic_survey import SurveyProfile, generate_frames
+from text_analysis import PatternMatcher, analyze_text_response, classify_responses
+
+EMOJIS = {'Yes': '✅', 'No': '❌', 'It depends': '🤔', 'Ambiguous': '❓'}
+
+
+# analyze_text_response as it was before PatternMatcher: one re.search per
+# pattern, with the pattern lists written out
+def reference_analyze(text, question_id):
+    if pd.isna(text) or not isinstance(text, str):
+        return None, None
+    text = text.lower().strip()
+    yes_patterns = [
+        r'\byes\b', r'\byeah\b', r'\bep\b', r'\bsure\b', r'\bdefinitely\b',
+        r'\babsolutely\b', r'\bagree\b', r'\bwould\b', r'\bpositive\b', r'\baffirmative\b',
+        r'\bi think so\b', r'\bi would\b', r'\bi do\b', r'\bi believe so\b'
+    ]
+    no_patterns = [
+        r'\bno\b', r'\bnope\b', r'\bnah\b', r'\bnever\b', r'\bdisagree\b',
+        r'\bwouldn\'t\b', r'\bwould not\b', r'\bnegative\b', r'\bnot\b',
+        r'\bi don\'t\b', r'\bi do not\b', r'\bi wouldn\'t\b', r'\bi would not\b'
+    ]
+    if question_id == 'Q8':
+        yes_contexts = [r'is a soup', r'type of soup', r'soup-like', r'similar to soup',
+                        r'considered a soup', r'classified as soup', r'soup category']
+        no_contexts = [r'not a soup', r'isn\'t a soup', r'is not a soup', r'different from soup',
+                       r'stew', r'sauce', r'dish', r'not soup', r'wouldn\'t classify']
+    elif question_id == 'Q9':
+        yes_contexts = [r'is a sandwich', r'sandwich-like', r'would be a sandwich',
+                        r'technically a sandwich', r'fits the definition', r'meets the criteria']
+        no_contexts = [r'not a sandwich', r'isn\'t a sandwich', r'is not a sandwich',
+                       r'wouldn\'t be a sandwich', r'would not be a sandwich', r'just pizza']
+    else:
+        yes_contexts = []
+        no_contexts = []
+    is_yes = any(re.search(pattern, text) for pattern in yes_patterns)
+    is_no = any(re.search(pattern, text) for pattern in no_patterns)
+    context_yes = any(re.search(pattern, text) for pattern in yes_contexts)
+    context_no = any(re.search(pattern, text) for pattern in no_contexts)
+    if (is_yes and not is_no) or (context_yes and not context_no):
+        label = "Yes"
+    elif (is_no and not is_yes) or (context_no and not context_yes):
+        label = "No"
+    elif "it depends" in text or "depends" in text:
+        label = "It depends"
+    else:
+        if question_id == 'Q8':
+            if any(word in text for word in ['stew', 'sauce', 'dish', 'not liquid enough']):
+                return "No", EMOJIS["No"]
+            elif any(word in text for word in ['liquid', 'broth', 'bowl']):
+                return "Yes", EMOJIS["Yes"]
+        elif question_id == 'Q9':
+            if any(word in text for word in ['bread', 'filling', 'between']):
+                return "Yes", EMOJIS["Yes"]
+            elif any(word in text for word in ['still pizza', 'just pizza', 'not bread']):
+                return "No", EMOJIS["No"]
+        yes_score = sum(1 for pattern in yes_patterns + yes_contexts if re.search(pattern, text))
+        no_score = sum(1 for pattern in no_patterns + no_contexts if re.search(pattern, text))
+        label = "Yes" if yes_score > no_score else "No" if no_score > yes_score else "Ambiguous"
+    return label, EMOJIS[label]
+
+
+# Answers at the edges of the rules: word boundaries, phrases that are
+# prefixes of each other, and punctuation the patterns contain
+EDGE_CASES = [
+    None, float('nan'), '', '   ', 'Yes', 'YES!', 'yes.', '(yes)', 'yesterday', 'eyes', 'ep', 'step', 'ep.',
+    'no', 'No.', 'nope', 'nothing', 'know', 'not', 'knot', 'no-one', 'nah', 'never', 'forever', 'agree',
+    'disagree', 'i agree, not really', 'would', 'wouldn', "wouldn't", "i wouldn't", 'would not', 'i would',
+    'i would not', 'i would-not', 'i do', 'i do not', 'i don', "i don't", 'i doubt', 'i think so', 'i think so?',
+    'i think sour', 'i believe so', 'i believe sooo', 'yes and no', 'no, yes', 'yes\nno', 'it depends',
+    'depends', 'dependson', 'It depends on the stew', 'is a soup', 'this is a souper dish', 'soup-like',
+    'soup like', 'soup- like', 'not soup', 'not a soup', "isn't a soup", 'isnt a soup', 'is not a soup',
+    'stewed', 'a saucepan', 'a bowl of liquid', 'brothers', 'not liquid enough', 'soup category',
+    "wouldn't classify", 'classified as soup', 'is a sandwich', 'sandwich-like', 'would be a sandwich',
+    "wouldn't be a sandwich", 'would not be a sandwich', 'technically a sandwich', 'just pizza', 'just pizzas',
+    'still pizza', 'not bread', 'bread', 'in between', 'filling', 'fits the definition', 'meets the criteria',
+    'sure thing', 'surely', 'positive', 'negative', 'affirmative', 'absolutely not', 'definitely not',
+    '¿sí? no sé', 'naïve yes', 'yes—no', 'yes_no', 'no1', '1no', 'a.b', 'c++', '$5 soup',
+]
+
+QUESTIONS = ['Q8', 'Q9', 'Q1']
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    _, _, text_df = generate_frames(5000, seed=3, profile=SurveyProfile.load())
+    texts = list(EDGE_CASES)
+    for question_id in ['Q8', 'Q9']:
+        texts.extend(text_df[f"{question_id}_text"])
+    # Random word salads over the words the rules look at
+    words = sorted({word for text in EDGE_CASES if isinstance(text, str) for word in text.split()})
+    rng = random.Random(0)
+    separators = [' ', ', ', '. ', '-', "'", '']
+    for _ in range(5000):
+        parts = rng.choices(words, k=rng.randint(1, 6))
+        texts.append(''.join(part + rng.choice(separators) for part in parts))
+    return texts
+
+
+@pytest.mark.parametrize('question_id', QUESTIONS)
+def test_analyze_text_response_matches_per_pattern_search(corpus, question_id):
+    mismatches = [(text, analyze_text_response(text, question_id), reference_analyze(text, question_id))
+                  for text in corpus
+                  if analyze_text_response(text, question_id) != reference_analyze(text, question_id)]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('question_id', QUESTIONS)
+def test_classify_responses_matches_per_pattern_search(corpus, question_id):
+    labels, emojis = classify_responses(pd.Series(corpus, dtype=object), question_id)
+    expected = [reference_analyze(text, question_id) for text in corpus]
+    assert list(zip(labels, emojis)) == expected
+
+
+# Patterns with escaped metacharacters and \b on either side, sharing
+# prefixes, counted against one re.search per pattern
+def test_pattern_matcher_counts_match_per_pattern_search():
+    groups = {
+        'dots': [r'a\.b', r'a\.b\.c', r'\ba\b'],
+        'symbols': [r'\bc\+\+', r'c\+\+\b', r'\(yes\)', r'\$5\b', r'\[x\]', r'\?', r'soup-like'],
+        'words': [r'\bover\b', r'over', r'\bover the\b', r'the\b', r'\bthe', r'isn\'t', r'\bi\b', r'\bi do\b'],
+        'empty': [],
+    }
+    matcher = PatternMatcher(groups)
+    alphabet = ['a', '.', 'b', 'c', '+', '(', 'yes', ')', '$', '5', '[', 'x', ']', '?', 'soup', '-', 'like',
+                'over', ' ', 'the', "isn't", 'i', 'do', '_', '1']
+    rng = random.Random(1)
+    texts = [''.join(rng.choices(alphabet, k=rng.randint(0, 12))) for _ in range(20000)]
+    texts += ['a.b.c', 'c++', 'xc++', 'c++x', '(yes)', '$5', '$50', '[x]', 'soup-like', 'over the top',
+              'overthe', 'leftover the', 'i do', 'i don', 'hi do']
+    for text in texts:
+        expected = [sum(1 for pattern in groups[name] if re.search(pattern, text)) for name in groups]
+        assert matcher.scan(text) == expected, text